@@ -1,2 +1,6 @@
 from app.server import run_server
-from app.client import run_client
\ No newline at end of file
+from app.client import run_client
+from app.parallel_client import run_parallel_client
+from app.metadata_client import run_metadata_client
+from app.async_server import AsyncServer
+from app.async_client import AsyncClient, TransferError
@@ -0,0 +1,124 @@
+from common import (
+    AsyncConnectionManager,
+    UnknownConnectionIDEvent,
+    ConnectionTerminatedEvent,
+)
+from app.client import ClientConnection
+from frame import *
+
+import asyncio
+import logging
+
+"""
+
+Embeddable asyncio client. All transfers of an AsyncClient share one connection (a new one is
+established if the previous one was closed), each transfer is represented by a future:
+
+    async with AsyncClient("localhost", 12345) as client:
+        await asyncio.gather(client.fetch("a.txt", "/tmp/a.txt"), client.fetch("b.txt"))
+
+Several AsyncClient objects can be used at once, e.g. to fetch from several servers.
+
+"""
+
+
+class TransferError(Exception):
+    pass
+
+
+class AsyncClientConnection(ClientConnection):
+
+    def __init__(self, connection_manager, host, port, congestion_control="cubic", pacing=True, durability="none", compress=False):
+        super().__init__(connection_manager, host, port, [], congestion_control, pacing, durability=durability, compress=compress)
+        self.transfers: dict[int, tuple[asyncio.Future, str]] = {}  # stream_id -> (future, destination)
+
+    def fetch(self, path: str, destination: str, priority: int = 0, weight: int = 1) -> asyncio.Future:
+        stream_id = self.request_file(path, destination, priority, weight)
+        future = asyncio.get_running_loop().create_future()
+        self.transfers[stream_id] = (future, destination)
+        return future
+
+    def transfer_finished(self, stream_id: int, error: str | None):
+        if stream_id not in self.transfers:
+            return
+        future, destination = self.transfers.pop(stream_id)
+        if future.done():
+            return
+        if error is None:
+            future.set_result(destination)
+        else:
+            future.set_exception(TransferError(f"transfer of {destination} failed: {error}"))
+
+    def fail_transfers(self, error: str):
+        for stream_id in list(self.transfers.keys()):
+            self.transfer_finished(stream_id, error)
+
+
+class AsyncClient:
+
+    def __init__(self, host: str, port: int, p=0, q=1, ipv6=False, congestion_control="cubic", pacing=True, durability="none", compress=False):
+        self.host = host
+        self.port = port
+        self.p = p
+        self.q = q
+        self.ipv6 = ipv6
+        self.congestion_control = congestion_control
+        self.pacing = pacing
+        self.durability = durability
+        self.compress = compress
+        self.connection_manager: AsyncConnectionManager | None = None
+        self.connection: AsyncClientConnection | None = None
+        self.closed_connection_ids: set[int] = set()
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.close()
+
+    async def start(self):
+        self.connection_manager = AsyncConnectionManager(0, self.p, self.q, self.ipv6, self.handle_event)
+        await self.connection_manager.start()
+        logging.info(
+            f"client socket bound to {self.connection_manager.local_address} on port {self.connection_manager.local_port}")
+
+    async def fetch(self, path: str, destination: str | None = None, priority: int = 0, weight: int = 1) -> str:
+        """
+        transfers the file at path (on the server) to destination (default: the same path).
+        priority (0-7) and weight (1-8) are used by the stream scheduler of the server.
+        returns the destination once the file was received and its checksum was verified.
+        """
+        if self.connection_manager is None:
+            await self.start()
+        if self.connection is None or self.connection.is_closed():
+            self.connection = AsyncClientConnection(
+                self.connection_manager, self.host, self.port, self.congestion_control, self.pacing, self.durability, self.compress)
+            self.connection_manager.add_connection(self.connection)
+        future = self.connection.fetch(path, destination if destination is not None else path, priority, weight)
+        self.connection_manager.schedule_flush()
+        return await future
+
+    def handle_event(self, event):
+        logging.info(type(event).__name__)
+        if isinstance(event, UnknownConnectionIDEvent):
+            # the reply of the server to the first packet carries the connection id. late packets
+            # of previous connections are ignored
+            if self.connection is not None and self.connection.connection_id == 0 \
+                    and event.packet.header.connection_id not in self.closed_connection_ids:
+                self.connection.update_connection_id(event.packet, event.host, event.port)
+        elif isinstance(event, ConnectionTerminatedEvent):
+            self.closed_connection_ids.add(event.connection.connection_id)
+            event.connection.fail_transfers("connection closed")
+            if event.connection is self.connection:
+                self.connection = None
+
+    def close(self):
+        if self.connection_manager is None:
+            return
+        if self.connection is not None and not self.connection.is_closed():
+            self.connection.queue_frame(ExitFrame())
+            self.connection.close()
+            # sends the exit frame and fails all transfers that are still running
+            self.connection_manager.flush()
+        self.connection_manager.close()
@@ -0,0 +1,62 @@
+from common import (
+    AsyncConnectionManager,
+)
+from app.server import handle_server_event
+
+import logging
+
+"""
+
+Embeddable asyncio server, it serves files next to whatever else runs in the event loop:
+
+    server = AsyncServer(12345)
+    await server.start()
+    ...
+    server.close()
+
+or, if the server is the only task: await AsyncServer(12345).serve_forever()
+
+"""
+
+
+class AsyncServer:
+
+    def __init__(self, port: int, p=0, q=1, ipv6=False, congestion_control="cubic", pacing=True, scheduler="rr", compression="zlib"):
+        self.port = port
+        self.p = p
+        self.q = q
+        self.ipv6 = ipv6
+        self.congestion_control = congestion_control
+        self.pacing = pacing
+        self.scheduler = scheduler
+        self.compression = compression
+        self.connection_manager: AsyncConnectionManager | None = None
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.close()
+
+    async def start(self):
+        self.connection_manager = AsyncConnectionManager(self.port, self.p, self.q, self.ipv6, self.handle_event)
+        await self.connection_manager.start()
+        logging.info(
+            f"server listening at {self.connection_manager.local_address} on port {self.connection_manager.local_port}")
+
+    @property
+    def local_port(self) -> int:
+        return self.connection_manager.local_port
+
+    def handle_event(self, event):
+        handle_server_event(self.connection_manager, event, self.congestion_control, self.pacing, self.scheduler, self.compression)
+
+    async def serve_forever(self):
+        if self.connection_manager is None:
+            await self.start()
+        await self.connection_manager.wait_closed()
+
+    def close(self):
+        if self.connection_manager is not None:
+            self.connection_manager.close()
@@ -4,30 +4,83 @@ from common import (
     UnknownConnectionIDEvent,
     Stream,
     ConnectionTerminatedEvent,
+    Decompressor,
+    DeltaDecoder,
+    DirectoryEntry,
+    PathMTUDiscovery,
 )
+from common.delta import choose_block_size, compute_signature, signature_entry
 from packet import Packet
 from frame import *
 
+from typing import Callable
+
 import logging
+import os
 import signal
+import stat
 import pathlib
 import common.util as util
 
+
+class SegmentedTransfer:
+    # a file that is fetched as several range streams of one connection, see ClientConnection.request_segmented()
+
+    def __init__(self, transfer_id: int, path: str, destination: str, size: int) -> None:
+        self.transfer_id = transfer_id  # passed to transfer_finished() once the whole file is there
+        self.path = path
+        self.destination = destination
+        self.size = size
+        self.segments: dict[int, tuple[int, int]] = {}  # stream_id -> (offset, length) of the segments in flight
+        self.retries = 0
+        self.error: str | None = None
+
+    def __repr__(self) -> str:
+        return f"SegmentedTransfer(path={self.path}, segments={len(self.segments)}, retries={self.retries})"
+
+
 class ClientConnection(Connection):
     stream_id_index = 0  # Returns 1 first time due to returning ++0
+    # segments that failed with an error of the server are requested again, at most this often per file
+    max_segment_retries = 3
 
-    def __init__(self, connection_manager, host, port, files: list[str]):
+    def __init__(self, connection_manager, host, port, files: list[str], congestion_control="cubic", pacing=True, priorities: dict[str, int] | None = None, weights: dict[str, int] | None = None, durability="none", segments=1, compress=False, delta=False):
         self.connection_id = None  # will be initialized upon reply from server
-        super().__init__(connection_manager, host, port, 0)
+        super().__init__(connection_manager, host, port, 0, congestion_control, pacing)
+        self.durability = durability  # see common/writer.py
+        self.compress = compress  # the server may send the files compressed, see common/compression.py
+        # stream_id -> handler(answer, error) of commands that are answered with an AnswerFrame (stat, checksum of a path)
+        self.pending_answers: dict[int, Callable[[bytes | None, str | None], None]] = {}
+        self.segmented_transfers: dict[int, SegmentedTransfer] = {}  # stream_id of a segment -> its file
+        self.delta_transfers: dict[int, tuple[str, str]] = {}  # stream_id -> path on the server, destination
 
+        # the server sends the files in the order chosen by its stream scheduler, priorities and weights are per file
+        priorities = priorities if priorities is not None else {}
+        weights = weights if weights is not None else {}
         for file_path in files:
-            if pathlib.Path(file_path).exists():
-                logging.info("File exists, requesting the rest of the file")
-                file_size = pathlib.Path(file_path).stat().st_size
-                checksum_so_far = util.crc32_file_checksum(file_path, offset=0, length=file_size)
-                self.command_read(file_path, offset=file_size, length=0, checkChecksum=True, checksum=checksum_so_far)
+            if delta and pathlib.Path(file_path).is_file():
+                self.request_delta(file_path)
+            elif segments > 1:
+                self.request_segmented(file_path, segments=segments)
             else:
-                self.command_read(file_path)
+                self.request_file(file_path, priority=priorities.get(file_path, 0), weight=weights.get(file_path, 1))
+
+    def request_file(self, path: str, destination: str | None = None, priority: int = 0, weight: int = 1) -> int:
+        # requests the file at path from the server and stores it at destination (default: the same path).
+        # returns the stream_id of the transfer
+        destination = destination if destination is not None else path
+        if pathlib.Path(destination).exists():
+            logging.info("File exists, requesting the rest of the file")
+            file_size = pathlib.Path(destination).stat().st_size
+            checksum_so_far = util.crc32_file_checksum(destination, offset=0, length=file_size)
+            return self.command_read(path, offset=file_size, length=0, checkChecksum=True, checksum=checksum_so_far, destination=destination, priority=priority, weight=weight)
+        else:
+            return self.command_read(path, destination=destination, priority=priority, weight=weight)
+
+    def transfer_finished(self, stream_id: int, error: str | None):
+        # called once the transfer of a stream is over, error is None if the file was received completely
+        pass
+
     def handle_frame(self, frame: Frame):
         if isinstance(frame, ExitFrame):
             logging.info("Server closed connection.")
@@ -37,16 +90,35 @@ class ClientConnection(Connection):
         elif isinstance(frame, DataFrame):
             # logging.info("Recieved data frame with stream id " +
             #              str(frame.header.stream_id))
-            if frame.header.payload_length == 0:
-                self.streams[frame.header.stream_id].flush()
-                logging.info(
-                    "Transfer of " + self.streams[frame.header.stream_id].path + " completed.")
-                # ask for checksum
-                self.frame_queue.append(ChecksumFrame(
-                    frame.header.stream_id, self.streams[frame.header.stream_id].path))
-            else:
-                self.streams[frame.header.stream_id].file.write(
-                    frame.payload.data)
+            if frame.header.stream_id not in self.streams:
+                # late frame of a stream that failed already
+                return
+            try:
+                if frame.header.payload_length == 0:
+                    # waits until the write-behind thread wrote everything, the checksum is calculated from the file
+                    self.streams[frame.header.stream_id].flush()
+                    logging.info(
+                        "Transfer of " + self.streams[frame.header.stream_id].path + " completed.")
+                    if self.streams[frame.header.stream_id].end_offset is not None or frame.header.stream_id in self.delta_transfers:
+                        # a range of the file or a rebuilt file, the checksum of the whole file is verified by path
+                        self.streams.pop(frame.header.stream_id).close()
+                        self.stream_finished(frame.header.stream_id, None)
+                        self.finish_if_idle()
+                        return
+                    # ask for checksum
+                    self.frame_queue.append(ChecksumFrame(
+                        frame.header.stream_id, self.streams[frame.header.stream_id].path))
+                else:
+                    # written at the offset of the frame, the payload is not copied
+                    self.streams[frame.header.stream_id].write(
+                        frame.header.offset, frame.payload.data)
+            except (OSError, ValueError) as e:
+                # ValueError: the compressed data could not be decompressed
+                logging.error(f"Could not write {self.streams[frame.header.stream_id].path}: {e}")
+                self.fail_stream(frame.header.stream_id, str(e))
+        elif isinstance(frame, AnswerFrame) and frame.header.stream_id in self.pending_answers:
+            self.pending_answers.pop(frame.header.stream_id)(frame.payload.data, None)
+            self.finish_if_idle()
         elif isinstance(frame, AnswerFrame):
             # TODO: Only the checksum answer frame is implemented
             # There is currently no way of knowing which command the answer is for in the spec, so changes are needed to the protocol
@@ -58,23 +130,32 @@ class ClientConnection(Connection):
             logging.info("Local checksum: " + str(local_checksum))
             logging.info("Remote checksum: " + str(remote_checksum))
             # Immediately close the stream after checksum is received
-            self.streams[frame.header.stream_id].close()
+            try:
+                self.streams[frame.header.stream_id].close()
+            except OSError as e:
+                # the file could not be synced to disk (see durability)
+                logging.error(f"Could not write {self.streams[frame.header.stream_id].path}: {e}")
+                self.fail_stream(frame.header.stream_id, str(e))
+                return
             logging.info(
                 "Closed stream with stream id " + str(frame.header.stream_id))
             # Check if the checksum matches the file, if not delete the file
             if local_checksum == remote_checksum:
                 logging.info("Checksums match")
+                self.transfer_finished(frame.header.stream_id, None)
             else:
                 logging.error("Checksums do not match, deleting file")
                 self.streams[frame.header.stream_id].remove_file()
+                self.transfer_finished(frame.header.stream_id, "checksum mismatch")
 
             del self.streams[frame.header.stream_id]
+            self.finish_if_idle()
 
-            if len(self.streams.items()) == 0:
-                self.queue_frame(ExitFrame(), transmit_first=True)
-                logging.info("Client closing connection.")
-                self.close() # pray
-
+        elif isinstance(frame, ErrorFrame) and frame.header.stream_id in self.pending_answers:
+            logging.error(
+                "Recieved error frame on stream id " + str(frame.header.stream_id) + " with message: " + frame.payload.data)
+            self.pending_answers.pop(frame.header.stream_id)(None, frame.payload.data)
+            self.finish_if_idle()
         elif isinstance(frame, ErrorFrame):
             logging.error(
                 "Recieved error frame on stream id " + str(frame.header.stream_id) + " with message: " + frame.payload.data)
@@ -85,14 +166,18 @@ class ClientConnection(Connection):
                 for stream_id in stream_ids:
                     self.streams[stream_id].close()
                     del self.streams[stream_id]
+                    self.stream_finished(stream_id, frame.payload.data, retry=False)
+                for stream_id, handler in list(self.pending_answers.items()):
+                    del self.pending_answers[stream_id]
+                    handler(None, frame.payload.data)
                 self.queue_frame(ExitFrame())
                 self.close()
-            else:
+                return
+            elif frame.header.stream_id in self.streams:
                 self.streams[frame.header.stream_id].close()
                 del self.streams[frame.header.stream_id]
-            if all((stream.is_closed for stream in self.streams.values())):
-                self.queue_frame(ExitFrame())
-                self.close()
+                self.stream_finished(frame.header.stream_id, frame.payload.data)
+            self.finish_if_idle()
         elif isinstance(frame, AckFrame):
             # ignore that, is already handled in connection.py
             pass
@@ -101,26 +186,218 @@ class ClientConnection(Connection):
                 "Recieved unknown frame with type \"" + str(frame.type) + "\"")
             self.queue_frame(ErrorFrame(0, "not implemented yet"))
 
-    def command_read(self, path: str, offset=0, length=0, checkChecksum=False, checksum=0):
+    def finish_if_idle(self):
+        # the connection is closed once all transfers are finished and all commands are answered
+        if len(self.streams) == 0 and len(self.pending_answers) == 0:
+            self.queue_frame(ExitFrame(), transmit_first=True)
+            logging.info("Client closing connection.")
+            self.close()
+
+    def fail_stream(self, stream_id: int, error: str):
+        # the file could not be stored, the rest of the stream is ignored
+        stream = self.streams.pop(stream_id)
+        try:
+            stream.close()
+        except OSError:
+            pass
+        self.stream_finished(stream_id, error, retry=False)
+        if all((stream.is_closed for stream in self.streams.values())):
+            self.queue_frame(ExitFrame())
+            self.close()
+
+    def stream_finished(self, stream_id: int, error: str | None, retry: bool = True):
+        # segments are reported to their file, the file is finished once all of its segments are.
+        # delta transfers replace the basis once the rebuilt file was verified
+        if stream_id in self.delta_transfers:
+            self.delta_finished(stream_id, error)
+            return
+        if stream_id not in self.segmented_transfers:
+            self.transfer_finished(stream_id, error)
+            return
+        transfer = self.segmented_transfers.pop(stream_id)
+        offset, length = transfer.segments.pop(stream_id)
+        if error is not None and retry and transfer.retries < self.max_segment_retries:
+            # only the failed segment is fetched again, the other segments are not affected
+            logging.warning(f"Segment {offset}-{offset + length} of {transfer.path} failed ({error}), requesting it again")
+            transfer.retries += 1
+            self.request_segment(transfer, offset, length)
+            return
+        if error is not None and transfer.error is None:
+            transfer.error = error
+        if transfer.segments:
+            return
+        if transfer.error is not None:
+            pathlib.Path(transfer.destination).unlink(missing_ok=True)
+            self.transfer_finished(transfer.transfer_id, transfer.error)
+            return
+        # the checksum of the whole file, the segments have no checksums of their own
+        self.verify_file(transfer.path, transfer.destination,
+                         lambda error: self.transfer_finished(transfer.transfer_id, error))
+
+    def delta_finished(self, stream_id: int, error: str | None):
+        path, destination = self.delta_transfers.pop(stream_id)
+        rebuilt_path = self.delta_path(destination)
+        if error is not None:
+            pathlib.Path(rebuilt_path).unlink(missing_ok=True)
+            self.transfer_finished(stream_id, error)
+            return
+
+        def finished(error: str | None):
+            if error is None:
+                os.replace(rebuilt_path, destination)
+            self.transfer_finished(stream_id, error)
+
+        # an empty rebuilt file was deleted when its stream was closed
+        pathlib.Path(rebuilt_path).touch()
+        self.verify_file(path, rebuilt_path, finished)
+
+    def verify_file(self, path: str, local_path: str, finished: Callable[[str | None], None]):
+        # compares the sha256 of local_path with the one of path on the server, local_path is deleted if they differ
+        def verify(remote_checksum: bytes | None, error: str | None):
+            local_checksum = util.sha256_file_checksum(local_path)
+            logging.info("Local checksum: " + str(local_checksum))
+            logging.info("Remote checksum: " + str(remote_checksum))
+            if error is None and local_checksum != remote_checksum:
+                error = "checksum mismatch"
+            if error is not None:
+                logging.error("Checksums do not match, deleting file")
+                pathlib.Path(local_path).unlink(missing_ok=True)
+            else:
+                logging.info("Checksums match")
+            finished(error)
+
+        self.command_file_checksum(path, verify)
+
+    def request_delta(self, path: str, destination: str | None = None) -> int:
+        # fetches only the differences between the file on the server and the existing destination (the basis),
+        # see common/delta.py. the file is rebuilt next to the basis and replaces it once it was verified
+        destination = destination if destination is not None else path
+        block_size = choose_block_size(pathlib.Path(destination).stat().st_size)
+        signature = compute_signature(destination, block_size)
+        logging.info(f"Requesting delta of {path} ({len(signature) // signature_entry.size} blocks of {block_size} bytes)")
+
+        stream_id = self.next_stream_id()
+        open(self.delta_path(destination), "wb").close()
+        stream = Stream.open(stream_id, self.delta_path(destination), "r", self.durability)
+        stream.decoder = DeltaDecoder(destination, block_size)
+        self.add_stream(stream)
+        self.delta_transfers[stream_id] = (path, destination)
+
+        self.queue_frame(DeltaFrame(stream_id, block_size, len(signature), path))
+        # the signatures are sent as data frames that fit into packets of the smallest size
+        frame_size = PathMTUDiscovery.base_packet_size - Packet.Header.size - DataFrame.Header.size
+        for offset in range(0, len(signature), frame_size):
+            self.queue_frame(DataFrame(stream_id, offset, signature[offset:offset + frame_size]))
+        return stream_id
+
+    def delta_path(self, destination: str) -> str:
+        return destination + ".rft-delta"
+
+    def command_read(self, path: str, offset=0, length=0, checkChecksum=False, checksum=0, destination=None, priority=0, weight=1):
         # TODO continue read from partially completed file (maybe use "a" mode instead?)
         stream_id = self.next_stream_id()
-        self.streams[stream_id] = Stream.open(stream_id, path, "r")
-        flags = 0 if not checkChecksum else 0b00000001
+        stream = Stream.open(stream_id, destination if destination is not None else path, "r", self.durability)
+        if self.compress:
+            # the server may send compressed data, it is decompressed to the file from offset on
+            stream.decoder = Decompressor(offset)
+        self.add_stream(stream)
+        flags = ReadFrame.encode_flags(checkChecksum, priority, weight, self.compress)
         self.queue_frame(ReadFrame(stream_id, flags,
                          offset, length, checksum, path))
+        return stream_id
+
+    def request_range(self, path: str, offset: int, length: int, destination: str, file_size: int | None = None) -> int:
+        # requests length bytes of the file at offset, they are written to the same offset of destination.
+        # if the size of the whole file is known, the writer allocates it up front
+        stream_id = self.command_read(path, offset=offset, length=length, destination=destination)
+        self.streams[stream_id].set_range(offset, length)
+        self.streams[stream_id].expected_size = file_size
+        return stream_id
+
+    def request_segmented(self, path: str, destination: str | None = None, segments: int = 4) -> int:
+        # fetches the file as up to segments range streams on this connection, which the server reads and sends
+        # concurrently. the segments complete in any order, a failed one is requested again on its own.
+        # the file is always fetched from the start (no resume). returns the id passed to transfer_finished()
+        destination = destination if destination is not None else path
+        transfer_id = None
+
+        def start(answer: bytes | None, error: str | None):
+            if error is not None:
+                self.transfer_finished(transfer_id, error)
+                return
+            size, _, mode = StatFrame.unpack_answer(answer)
+            if not stat.S_ISREG(mode):
+                self.transfer_finished(transfer_id, "not a file")
+                return
+            if size == 0:
+                # there is no range to request, the whole (empty) file is read instead
+                self.command_read(path, destination=destination)
+                return
+            # the segments are written at their offsets into a file of the final size
+            with open(destination, "wb") as file:
+                file.truncate(size)
+            transfer = SegmentedTransfer(transfer_id, path, destination, size)
+            for offset, length in util.split_ranges(size, segments):
+                self.request_segment(transfer, offset, length)
+
+        transfer_id = self.command_stat(path, start)
+        return transfer_id
+
+    def request_segment(self, transfer: SegmentedTransfer, offset: int, length: int):
+        stream_id = self.request_range(transfer.path, offset, length, transfer.destination, transfer.size)
+        transfer.segments[stream_id] = (offset, length)
+        self.segmented_transfers[stream_id] = transfer
 
     def command_checksum(self, stream_id: int):
         self.queue_frame(ChecksumFrame(
             stream_id, self.streams[stream_id].path))
 
+    def command_file_checksum(self, path: str, handler: Callable[[bytes | None, str | None], None]) -> int:
+        # sha256 of the whole file at path on the server, passed to the handler (or the error message)
+        stream_id = self.next_stream_id()
+        self.pending_answers[stream_id] = handler
+        self.queue_frame(ChecksumFrame(stream_id, path))
+        return stream_id
+
     def command_write(self, path: str, offset=0, length=0):
         pass
 
-    def command_stat(self, path: str):
-        pass
+    def command_stat(self, path: str, handler: Callable[[bytes | None, str | None], None]) -> int:
+        # the answer is decoded with StatFrame.unpack_answer()
+        stream_id = self.next_stream_id()
+        self.pending_answers[stream_id] = handler
+        self.queue_frame(StatFrame(stream_id, path))
+        return stream_id
 
-    def command_list(self, path: str):
-        pass
+    def command_list(self, path: str, handler: Callable[[list[DirectoryEntry] | None, str | None], None]) -> int:
+        # the entries of the directory at path, sorted by name, passed to the handler once all pages of the
+        # listing arrived (see ListFrame). the pages can arrive in any order
+        stream_id = self.next_stream_id()
+        pages: dict[int, list[tuple[str, int, int, int]]] = {}
+        last_page: int | None = None
+
+        def receive_page(answer: bytes | None, error: str | None):
+            nonlocal last_page
+            if error is not None:
+                handler(None, error)
+                return
+            try:
+                index, last, entries = ListFrame.unpack_page(answer)
+            except ValueError as e:
+                handler(None, f"invalid listing: {e}")
+                return
+            pages.setdefault(index, entries)
+            if last:
+                last_page = index
+            if last_page is not None and all(index in pages for index in range(last_page + 1)):
+                handler([DirectoryEntry(*entry) for index in range(last_page + 1) for entry in pages[index]], None)
+            else:
+                # wait for the other pages
+                self.pending_answers[stream_id] = receive_page
+
+        self.pending_answers[stream_id] = receive_page
+        self.queue_frame(ListFrame(stream_id, path))
+        return stream_id
 
     def next_stream_id(self):
         self.stream_id_index += 1
@@ -136,7 +413,7 @@ class ClientConnection(Connection):
         self.connection_manager.connections[new_id] = self
         self.update(packet, (host, port))
 
-def run_client(host, port, files, p = 0, q = 1, ipv6 = False):
+def run_client(host, port, files, p = 0, q = 1, ipv6 = False, congestion_control = "cubic", pacing = True, priorities = None, weights = None, durability = "none", segments = 1, compress = False, delta = False):
 
     def handle_exit(signum, frame):
         logging.info("Exiting...")
@@ -154,10 +431,15 @@ def run_client(host, port, files, p = 0, q = 1, ipv6 = False):
     signal.signal(signal.SIGTERM, handle_exit)
 
     connection_manager = ConnectionManager(0, p, q, ipv6)
-    connection = ClientConnection(connection_manager, host, port, files)
+    connection = ClientConnection(connection_manager, host, port, files, congestion_control, pacing, priorities, weights, durability, segments, compress, delta)
     logging.info(
         f"client socket bound to {connection_manager.local_address} on port {connection_manager.local_port}")
 
+    run_connection(connection_manager, connection)
+
+
+def run_connection(connection_manager: ConnectionManager, connection: ClientConnection):
+    # runs the loop until the connection is closed
     connection_manager.add_connection(connection)
     for event in connection_manager.loop():
         logging.info(type(event).__name__)
@@ -0,0 +1,43 @@
+from frame import StatFrame
+from app.parallel_client import run_commands
+
+import datetime
+import logging
+import stat
+
+"""
+
+Metadata commands of the client (rft --stat / rft --list): the metadata of files and the entries
+of directories on the server are printed instead of fetching files. Every path is a command of
+its own, all of them are sent over one control connection. The server answers from its metadata cache (see
+common/metadata_cache.py), so sizes and modification times can be up to a second old.
+
+"""
+
+
+def format_entry(name: str, size: int, mtime_ns: int, mode: int) -> str:
+    # one line per file, similar to ls -l
+    mtime = datetime.datetime.fromtimestamp(mtime_ns / 1e9).strftime("%Y-%m-%d %H:%M:%S")
+    return f"{stat.filemode(mode)} {size:>12} {mtime} {name}"
+
+
+def run_metadata_client(host, port, paths, command, p = 0, q = 1, ipv6 = False) -> bool:
+    # command is "stat" or "list", returns whether all paths were found
+    if command == "stat":
+        commands = [lambda connection, handler, path=path: connection.command_stat(path, handler) for path in paths]
+    else:
+        commands = [lambda connection, handler, path=path: connection.command_list(path, handler) for path in paths]
+    success = True
+    for path, (answer, error) in zip(paths, run_commands(host, port, p, q, ipv6, commands)):
+        if error is not None:
+            logging.error(f"Could not {command} {path}: {error}")
+            success = False
+            continue
+        if command == "stat":
+            size, mtime_ns, mode = StatFrame.unpack_answer(answer)
+            print(format_entry(path, size, mtime_ns, mode))
+        else:
+            print(f"{path}: {len(answer)} entries")
+            for entry in answer:
+                print(format_entry(entry.name, entry.size, entry.mtime_ns, entry.mode))
+    return success
@@ -0,0 +1,133 @@
+from common import ConnectionManager
+from frame import StatFrame
+from app.client import ClientConnection, run_connection
+
+import logging
+import multiprocessing
+import os
+import pathlib
+import stat
+import common.util as util
+
+"""
+
+Striped transfer of large files. A single connection is limited by its congestion window and by
+the event loop of one process, so a file can instead be fetched over several connections in
+parallel (rft --parallel N):
+
+1. the size of the file is requested with a StatFrame over a control connection
+2. the file is split into up to N byte ranges (of at least 1 MiB, see util.split_ranges())
+3. every range is fetched by its own process, over its own socket and connection id. The ranges
+   are requested with the offset and length of a ReadFrame and written at their offset into the
+   destination file, which is created with the final size up front
+4. once all ranges are there, the sha256 of the whole file is compared with the checksum of the
+   server (requested by path over a control connection), the file is deleted if they differ
+
+The processes are forked, every range is a complete client of its own.
+
+"""
+
+
+class RangeClientConnection(ClientConnection):
+    # a client connection that only runs commands and remembers whether a transfer failed
+
+    def __init__(self, connection_manager, host, port, congestion_control="cubic", pacing=True, durability="none", compress=False):
+        super().__init__(connection_manager, host, port, [], congestion_control, pacing, durability=durability, compress=compress)
+        self.errors: list[str] = []
+
+    def transfer_finished(self, stream_id: int, error: str | None):
+        if error is not None:
+            self.errors.append(error)
+
+
+def run_command(host, port, p, q, ipv6, command) -> tuple[bytes | None, str | None]:
+    # runs a single command (command(connection, handler)) over a new control connection and returns its answer
+    return run_commands(host, port, p, q, ipv6, [command])[0]
+
+
+def run_commands(host, port, p, q, ipv6, commands: list) -> list[tuple[bytes | None, str | None]]:
+    # runs the commands over one control connection (they are answered in any order), returns their answers in order
+    results = [(None, "no answer") for _ in commands]
+
+    def handler(index: int):
+        def store(answer: bytes | None, error: str | None):
+            results[index] = (answer, error)
+        return store
+
+    connection_manager = ConnectionManager(0, p, q, ipv6)
+    try:
+        connection = RangeClientConnection(connection_manager, host, port)
+        for index, command in enumerate(commands):
+            command(connection, handler(index))
+        run_connection(connection_manager, connection)
+    finally:
+        connection_manager.close()
+    return results
+
+
+def fetch_range(host, port, path, offset, length, size, p, q, ipv6, congestion_control, pacing, durability, compress):
+    # runs in its own process, the exit code tells whether the range was received
+    connection_manager = ConnectionManager(0, p, q, ipv6)
+    connection = RangeClientConnection(connection_manager, host, port, congestion_control, pacing, durability, compress)
+    connection.request_range(path, offset, length, path, size)
+    run_connection(connection_manager, connection)
+    if connection.errors or connection.streams:
+        logging.error(f"Range {offset}-{offset + length} of {path} failed: {connection.errors}")
+        os._exit(1)
+    os._exit(0)
+
+
+def fetch_file(host, port, path, parallel, p, q, ipv6, congestion_control, pacing, durability, compress) -> bool:
+    answer, error = run_command(host, port, p, q, ipv6, lambda connection, handler: connection.command_stat(path, handler))
+    if error is not None:
+        logging.error(f"Could not stat {path}: {error}")
+        return False
+    size, _, mode = StatFrame.unpack_answer(answer)
+    if not stat.S_ISREG(mode):
+        logging.error(f"{path} is not a file")
+        return False
+    if size == 0:
+        # there is no range to request, the whole (empty) file is read over one connection instead (as in
+        # ClientConnection.request_segmented()). the stream compares the checksum itself
+        ranges = [(0, 0)]
+    else:
+        ranges = util.split_ranges(size, parallel)
+        # the ranges are written at their offsets into a file of the final size
+        with open(path, "wb") as file:
+            file.truncate(size)
+
+    context = multiprocessing.get_context("fork")
+    processes = []
+    for offset, length in ranges:
+        process = context.Process(target=fetch_range, name=f"rft-range-{offset}",
+                                  args=(host, port, path, offset, length, size, p, q, ipv6, congestion_control, pacing, durability, compress))
+        process.start()
+        processes.append(process)
+    for process in processes:
+        process.join()
+
+    if any(process.exitcode != 0 for process in processes):
+        logging.error(f"Transfer of {path} failed, deleting file")
+        pathlib.Path(path).unlink(missing_ok=True)
+        return False
+    logging.info(f"Transfer of {path} completed over {len(processes)} connections.")
+    if size == 0:
+        return True
+
+    remote_checksum, error = run_command(host, port, p, q, ipv6,
+                                         lambda connection, handler: connection.command_file_checksum(path, handler))
+    local_checksum = util.sha256_file_checksum(path)
+    logging.info("Local checksum: " + str(local_checksum))
+    logging.info("Remote checksum: " + str(remote_checksum))
+    if error is not None or local_checksum != remote_checksum:
+        logging.error("Checksums do not match, deleting file")
+        pathlib.Path(path).unlink(missing_ok=True)
+        return False
+    logging.info("Checksums match")
+    return True
+
+
+def run_parallel_client(host, port, files, parallel, p = 0, q = 1, ipv6 = False, congestion_control = "cubic", pacing = True, durability = "none", compress = False):
+    # the files are fetched one after the other, each of them over parallel connections
+    for path in files:
+        fetch_file(host, port, path, parallel, p, q, ipv6, congestion_control, pacing, durability, compress)
@@ -1,4 +1,8 @@
 from common import (
+    ChecksumIndex,
+    MetadataCache,
+    PathMTUDiscovery,
+    Signatures,
     Stream,
     Connection,
     ConnectionManager,
@@ -9,15 +13,50 @@ from common import (
 from packet import Packet
 from frame import *
 
+from concurrent.futures import Future, ThreadPoolExecutor
+
 import logging
-import pathlib
+import multiprocessing
+import os
+import socket
+import stat
 import common.util as util
 
 
+def hash_file(path: str, result: os.stat_result) -> tuple[bytes, bool]:
+    # runs on a thread of the checksum pool, also returns whether the file still has the size and mtime of result
+    digest = util.sha256_file_checksum(path)
+    after = os.stat(path)
+    return digest, (after.st_size, after.st_mtime_ns) == (result.st_size, result.st_mtime_ns)
+
+
 class ServerConnection(Connection):
+    # crc32 checkpoints of the files that were resumed, shared by all connections of the process
+    checksum_index = ChecksumIndex()
+    # stat results and directory listings, shared by all connections of the process (see common/metadata_cache.py)
+    metadata_cache = MetadataCache()
+    # limits of the signatures of delta transfers: the announced length, and the signature data that arrives before its DeltaFrame
+    max_signature_length = 64 * 1024 * 1024
+    max_early_data = 16 * 1024 * 1024
+    # a ChecksumFrame without a stream hashes the whole file, which is done on these threads so the event loop
+    # keeps serving the other connections. created on first use, so that workers do not inherit it (see run_workers())
+    checksum_pool: ThreadPoolExecutor | None = None
+    checksum_workers = 2
 
-    def __init__(self, connection_manager: ConnectionManager, host: str, port: int, connection_id: int):
-        super().__init__(connection_manager, host, port, connection_id)
+    def __init__(self, connection_manager: ConnectionManager, host: str, port: int, connection_id: int, congestion_control: str = "cubic", pacing: bool = True, scheduler: str = "rr", compression: str = "zlib"):
+        super().__init__(connection_manager, host, port, connection_id, congestion_control, pacing, scheduler)
+        # codec used for streams whose client accepts compressed data, "none" disables compression
+        self.compression = compression
+        # delta transfers whose signatures are still being received (see common/delta.py), and signature data
+        # of stream ids whose DeltaFrame did not arrive yet
+        self.delta_requests: dict[int, Stream] = {}
+        self.early_data: dict[int, list[tuple[int, bytes]]] = {}
+        self.early_data_bytes = 0
+        # stream id -> (path, stat result, digest being computed) of the path checksums that are not answered yet
+        self.pending_checksums: dict[int, tuple[str, os.stat_result, Future]] = {}
+        # stream id -> (crc32 sent by the client, arguments of open_stream(), crc32 and sha256 being computed) of the
+        # resumed transfers whose prefix is not verified yet
+        self.pending_resumes: dict[int, tuple[int, tuple, Future]] = {}
 
     def handle_frame(self, frame: Frame):
         # this function is called upon reception of a frame
@@ -39,40 +78,123 @@ class ServerConnection(Connection):
             # if ReadFrame with an existing stream id is received, queue an ErrorFrame
             logging.info("queued frames: " + str(len(self.frame_queue)))
             self.flush()
-            if frame.header.stream_id in self.streams:
+            if frame.header.stream_id in self.streams or frame.header.stream_id in self.pending_resumes:
                 # check error codes
                 self.queue_frame(ErrorFrame(
                     frame.header.stream_id, "stream id already exists"))
                 return
-            # if the path does not exist, send an error frame
-            if not pathlib.Path(frame.payload.data).exists():
+            # if the path does not exist (or is not a file), send an error frame
+            result = self.metadata_cache.stat(frame.payload.data)
+            if result is None or not stat.S_ISREG(result.st_mode):
                 self.queue_frame(ErrorFrame(
                     frame.header.stream_id, "file not found"))
                 return
             # check if the offset+length is greater than the file size
-            if (frame.header.offset + frame.header.length) > pathlib.Path(frame.payload.data).stat().st_size:
+            if (frame.header.offset + frame.header.length) > result.st_size:
+                # only this stream fails, other ranges of the connection may be fine
                 self.queue_frame(ErrorFrame(
-                    0, "offset+length greater than file size"))
+                    frame.header.stream_id, "offset+length greater than file size"))
                 return
-            
-            if frame.header.flags & 0b00000001:
+
+            arguments = (frame.header.stream_id, frame.payload.data, frame.header.offset, frame.header.length,
+                         frame.priority, frame.weight, frame.compress)
+            if frame.check_checksum:
                 logging.info("Resumption chekcsum check requested")
-                checksum_until_offset = util.crc32_file_checksum(frame.payload.data, offset=0, length=frame.header.offset)
-                if frame.header.checksum != checksum_until_offset:
-                    self.queue_frame(ErrorFrame(
-                        0, "checksum mismatch"))
-                    return
+                # the prefix (from the nearest checkpoint on) is read on the checksum pool, the stream is created by
+                # flush() once it was verified. the sha256 of the prefix is the start of its running checksum
+                future = self.submit_checksum(self.checksum_index.prefix, frame.payload.data, frame.header.offset)
+                self.pending_resumes[frame.header.stream_id] = (frame.header.checksum, arguments, future)
+                return
+            self.open_stream(*arguments)
+            return
+
+        elif isinstance(frame, DeltaFrame):
+            if frame.header.stream_id in self.streams or frame.header.stream_id in self.delta_requests:
+                self.queue_frame(ErrorFrame(
+                    frame.header.stream_id, "stream id already exists"))
+                return
+            result = self.metadata_cache.stat(frame.payload.data)
+            if result is None or not stat.S_ISREG(result.st_mode):
+                self.queue_frame(ErrorFrame(
+                    frame.header.stream_id, "file not found"))
+                return
+            if not DeltaFrame.min_block_size <= frame.header.block_size <= DeltaFrame.max_block_size or \
+                    frame.header.signature_length > self.max_signature_length:
+                self.queue_frame(ErrorFrame(
+                    frame.header.stream_id, "invalid block size or signature length"))
+                return
+            try:
+                signatures = Signatures(frame.header.block_size, frame.header.signature_length)
+            except ValueError as e:
+                self.queue_frame(ErrorFrame(frame.header.stream_id, str(e)))
+                return
+            # the stream is scheduled once all signatures are there
+            try:
+                stream = Stream(frame.header.stream_id, frame.payload.data, "w")
+            except OSError as e:
+                self.queue_read_error(frame.header.stream_id, frame.payload.data, e)
+                return
+            stream.signatures = signatures
+            self.delta_requests[frame.header.stream_id] = stream
+            for offset, data in self.early_data.pop(frame.header.stream_id, []):
+                self.early_data_bytes -= len(data)
+                self.receive_signatures(frame.header.stream_id, offset, data)
+            self.receive_signatures(frame.header.stream_id, 0, b"")
+            return
+
+        elif isinstance(frame, DataFrame):
+            # the client only sends the signatures of delta transfers
+            if frame.header.stream_id in self.delta_requests:
+                self.receive_signatures(frame.header.stream_id, frame.header.offset, frame.payload.data)
+            elif frame.header.stream_id not in self.streams and self.early_data_bytes + frame.header.payload_length <= self.max_early_data:
+                # the DeltaFrame may arrive later
+                self.early_data.setdefault(frame.header.stream_id, []).append((frame.header.offset, frame.payload.data))
+                self.early_data_bytes += frame.header.payload_length
+            return
+
+        elif isinstance(frame, StatFrame):
+            # files and directories, the client checks the type in the mode
+            result = self.metadata_cache.stat(frame.payload.data)
+            if result is None:
+                self.queue_frame(ErrorFrame(
+                    frame.header.stream_id, "file not found"))
+                return
+            self.queue_frame(AnswerFrame(
+                frame.header.stream_id, StatFrame.pack_answer(result.st_size, result.st_mtime_ns, result.st_mode)))
+            return
 
-            # create a new stream if everything is fine
-            stream = Stream(frame.header.stream_id, frame.payload.data, "w")
-            self.streams[frame.header.stream_id] = stream
+        elif isinstance(frame, ListFrame):
+            entries = self.metadata_cache.list(frame.payload.data)
+            if entries is None:
+                self.queue_frame(ErrorFrame(
+                    frame.header.stream_id, "directory not found"))
+                return
+            # one AnswerFrame per page, every page fits into a packet of the base size. an empty directory
+            # is answered with a single empty page
+            page_size = PathMTUDiscovery.base_packet_size - Packet.Header.size - AnswerFrame.Header.size - ListFrame.page_header.size
+            pages: list[list[bytes]] = [[]]
+            used = 0
+            for entry in entries:
+                packed = ListFrame.pack_entry(entry.name, entry.size, entry.mtime_ns, entry.mode)
+                if used + len(packed) > page_size and pages[-1]:
+                    pages.append([])
+                    used = 0
+                pages[-1].append(packed)
+                used += len(packed)
+            for index, page in enumerate(pages):
+                self.queue_frame(AnswerFrame(
+                    frame.header.stream_id, ListFrame.pack_page(index, index == len(pages) - 1, page)))
             return
 
         elif isinstance(frame, ChecksumFrame):
-            # if the stream id does not exist, send an error frame
+            # if the stream id does not exist, the checksum of the file at the path of the frame is sent
             if frame.header.stream_id not in self.streams:
-                self.queue_frame(ErrorFrame(
-                    frame.header.stream_id, "stream id does not exist"))
+                result = self.metadata_cache.stat(frame.payload.data)
+                if result is None or not stat.S_ISREG(result.st_mode):
+                    self.queue_frame(ErrorFrame(
+                        frame.header.stream_id, "stream id does not exist"))
+                    return
+                self.request_path_checksum(frame.header.stream_id, frame.payload.data, result)
                 return
             # send the checksum of the file
             self.queue_frame(AnswerFrame(
@@ -84,33 +206,182 @@ class ServerConnection(Connection):
                 "Recieved unknown frame with type \"" + str(frame.type) + "\"")
             self.queue_frame(ErrorFrame(0, "not implemented yet"))
 
+    def queue_read_error(self, stream_id: int, path: str, error: OSError):
+        if isinstance(error, FileNotFoundError):
+            self.queue_frame(ErrorFrame(stream_id, "file not found"))
+        else:
+            self.queue_frame(ErrorFrame(stream_id, f"could not read {path}: {error.strerror}"))
+
+    def request_path_checksum(self, stream_id: int, path: str, result: os.stat_result):
+        # answers from the metadata cache if the file did not change since it was hashed last, otherwise the
+        # file is hashed on the checksum pool and answered by flush() once the digest is ready
+        digest = self.metadata_cache.checksum(path, result)
+        if digest is not None:
+            self.queue_frame(AnswerFrame(stream_id, digest))
+            return
+        if stream_id in self.pending_checksums:
+            return  # a retransmitted ChecksumFrame
+        self.pending_checksums[stream_id] = (path, result, self.submit_checksum(hash_file, path, result))
+
+    def submit_checksum(self, function, *args) -> Future:
+        if ServerConnection.checksum_pool is None:
+            ServerConnection.checksum_pool = ThreadPoolExecutor(self.checksum_workers, thread_name_prefix="rft-checksum")
+        future = self.checksum_pool.submit(function, *args)
+        # the result is handled by the next flush, the connection manager is woken up for it
+        future.add_done_callback(lambda _: self.connection_manager.wake(self))
+        return future
+
+    def answer_path_checksums(self):
+        for stream_id, (path, result, future) in list(self.pending_checksums.items()):
+            if not future.done():
+                continue
+            del self.pending_checksums[stream_id]
+            try:
+                digest, unchanged = future.result()
+            except OSError as e:
+                self.queue_frame(ErrorFrame(stream_id, f"could not read {path}: {e.strerror}"))
+                continue
+            if unchanged:
+                # a file that was written while it was hashed is hashed again next time
+                self.metadata_cache.store_checksum(path, result, digest)
+            self.queue_frame(AnswerFrame(stream_id, digest))
+
+    def open_stream(self, stream_id: int, path: str, offset: int, length: int, priority: int, weight: int, compress: bool, prefix_hash=None):
+        # a resumed transfer starts at the offset, a length other than 0 requests a range of the file (see
+        # app/parallel_client.py and ClientConnection.request_segmented()). prefix_hash is the sha256 of the first
+        # offset bytes of a resumed transfer
+        try:
+            # the metadata cache may be slightly outdated, the file can be gone (or unreadable) by now
+            stream = Stream(stream_id, path, "w", priority, weight)
+        except OSError as e:
+            self.queue_read_error(stream_id, path, e)
+            return
+        stream.set_range(offset, length)
+        if prefix_hash is not None:
+            stream.set_checksum_prefix(prefix_hash, offset)
+        if compress and self.compression != "none":
+            stream.compression = self.compression
+        self.add_stream(stream)
+
+    def start_resumed_streams(self):
+        for stream_id, (checksum, arguments, future) in list(self.pending_resumes.items()):
+            if not future.done():
+                continue
+            del self.pending_resumes[stream_id]
+            try:
+                checksum_until_offset, prefix_hash = future.result()
+            except OSError as e:
+                self.queue_read_error(stream_id, arguments[1], e)
+                continue
+            if checksum != checksum_until_offset:
+                self.queue_frame(ErrorFrame(
+                    0, "checksum mismatch"))
+                continue
+            self.open_stream(*arguments, prefix_hash)
+
+    def flush(self):
+        if self.pending_checksums:
+            self.answer_path_checksums()
+        if self.pending_resumes:
+            self.start_resumed_streams()
+        super().flush()
+
+    def receive_signatures(self, stream_id: int, offset: int, data):
+        stream = self.delta_requests[stream_id]
+        try:
+            if data:
+                stream.signatures.write(offset, data)
+        except ValueError as e:
+            del self.delta_requests[stream_id]
+            stream.close()
+            self.queue_frame(ErrorFrame(stream_id, str(e)))
+            return
+        if stream.signatures.complete:
+            del self.delta_requests[stream_id]
+            self.add_stream(stream)
+
 
 # Socket -> ConnectionManager
 # ConnectionHander -> Connection
 # Connection -> ServerConecion ClientConnection
 
-def run_server(port: int, p = 1, q = 0, ipv6 = False):
+def handle_server_event(connection_manager: ConnectionManager, event, congestion_control = "cubic", pacing = True, scheduler = "rr", compression = "zlib"):
+    logging.info(type(event).__name__)
+    # Send to different ServerConnections depending on header
+    if isinstance(event, UnknownConnectionIDEvent):
+        logging.info("got an unknown connection id event, ignoring...")
+
+    elif isinstance(event, ZeroConnectionIDEvent):
+        logging.info("got a zero connection id event")
+        # if the connection id is 0, then it is a new connection request, and it should either have no frames, or start with a command
+        if len(event.packet.frames) > 1 and not isinstance(event.packet.frames[0], (ReadFrame, DeltaFrame, StatFrame, ListFrame, ChecksumFrame)):
+            return
+        logging.info(f"adding a new client connection...")
+        # if the checks pass, create a new ServerConnection
+        conn = ServerConnection(
+            connection_manager, event.host, event.port, connection_manager.next_connection_id(), congestion_control, pacing, scheduler, compression)
+        connection_manager.add_connection(conn)
+        conn.update(event.packet, (event.host, event.port))
+    elif isinstance(event, ConnectionTerminatedEvent):
+        # server continues to listen for new connections in this case
+        pass
+
+
+def run_server(port: int, p = 1, q = 0, ipv6 = False, congestion_control = "cubic", pacing = True, workers = 1, scheduler = "rr", compression = "zlib"):
+    if workers > 1:
+        run_workers(port, p, q, ipv6, congestion_control, pacing, workers, scheduler, compression)
+        return
+
     connection_manager = ConnectionManager(port, p, q, ipv6)
     logging.info(
         f"server listening at {connection_manager.local_address} on port {connection_manager.local_port}")
 
     for event in connection_manager.loop():
-        logging.info(type(event).__name__)
-        # Send to different ServerConnections depending on header
-        if isinstance(event, UnknownConnectionIDEvent):
-            logging.info("got an unknown connection id event, ignoring...")
-
-        elif isinstance(event, ZeroConnectionIDEvent):
-            logging.info("got a zero connection id event")
-            # if the connection id is 0, then it is a new connection request, and it should either have no frames, or a single ReadFrame
-            if len(event.packet.frames) > 1 and not isinstance(event.packet.frames[0], ReadFrame):
-                continue
-            logging.info(f"adding a new client connection...")
-            # if the checks pass, create a new ServerConnection
-            conn = ServerConnection(
-                connection_manager, event.host, event.port, connection_manager.next_connection_id())
-            connection_manager.add_connection(conn)
-            conn.update(event.packet, (event.host, event.port))
-        elif isinstance(event, ConnectionTerminatedEvent):
-            # server continues to listen for new connections in this case
-            pass
\ No newline at end of file
+        handle_server_event(connection_manager, event, congestion_control, pacing, scheduler, compression)
+
+def run_workers(port: int, p, q, ipv6, congestion_control, pacing, workers: int, scheduler = "rr", compression = "zlib"):
+    # starts one process per worker, all of them bind the port with SO_REUSEPORT. the connection ids encode the
+    # worker (highest byte), so at most 256 workers are possible
+    if not hasattr(socket, "SO_REUSEPORT"):
+        raise ValueError("multiple workers require SO_REUSEPORT, which is not supported on this platform")
+    if not 1 < workers <= 256:
+        raise ValueError("the number of workers must be between 1 and 256")
+    if port == 0:
+        raise ValueError("multiple workers require a fixed port")
+
+    # one unix datagram socket pair per worker: other workers send to the first socket, the worker receives
+    # from the second one. the sockets are created before the workers are forked, so every worker inherits all of them
+    socket_pairs = [socket.socketpair(socket.AF_UNIX, socket.SOCK_DGRAM) for _ in range(workers)]
+    context = multiprocessing.get_context("fork")
+    processes = [
+        context.Process(
+            target=run_worker,
+            args=(worker_id, socket_pairs, port, p, q, ipv6, congestion_control, pacing, scheduler, compression),
+            name=f"rft-worker-{worker_id}",
+            daemon=True,
+        )
+        for worker_id in range(workers)
+    ]
+    for process in processes:
+        process.start()
+    logging.info(f"started {workers} workers on port {port}")
+
+    try:
+        for process in processes:
+            process.join()
+    finally:
+        for process in processes:
+            process.terminate()
+
+
+def run_worker(worker_id: int, socket_pairs: list, port: int, p, q, ipv6, congestion_control, pacing, scheduler = "rr", compression = "zlib"):
+    connection_manager = ConnectionManager(port, p, q, ipv6, reuse_port=True)
+    connection_manager.enable_forwarding(worker_id, socket_pairs[worker_id][1], [pair[0] for pair in socket_pairs])
+    logging.info(
+        f"worker {worker_id} listening at {connection_manager.local_address} on port {connection_manager.local_port}")
+
+    try:
+        for event in connection_manager.loop():
+            handle_server_event(connection_manager, event, congestion_control, pacing, scheduler, compression)
+    except KeyboardInterrupt:
+        pass
@@ -1,15 +1,81 @@
+from common.ack_policy import (
+    AckPolicy,
+)
+from common.batch_io import (
+    DatagramIO,
+    MMsgDatagramIO,
+    create_datagram_io,
+)
+from common.checksum_index import (
+    ChecksumIndex,
+)
+from common.compression import (
+    CompressingReader,
+    Decompressor,
+    compression_codecs,
+)
+from common.delta import (
+    DeltaReader,
+    DeltaDecoder,
+    Signatures,
+)
+from common.metadata_cache import (
+    DirectoryEntry,
+    MetadataCache,
+)
 from common.connection import (
     Connection,
 )
 from common.connection_manager import (
+    BaseConnectionManager,
     ConnectionManager,
     UnknownConnectionIDEvent,
     ZeroConnectionIDEvent,
     ConnectionTerminatedEvent,
 )
+from common.async_connection_manager import (
+    AsyncConnectionManager,
+)
+from common.congestion_control import (
+    CongestionControl,
+    NewReno,
+    Cubic,
+    congestion_control_algorithms,
+)
+from common.flow_control import (
+    ReceiveWindow,
+)
+from common.inflight import (
+    InflightPacket,
+    InflightPackets,
+)
+from common.pacer import (
+    Pacer,
+)
+from common.path_mtu import (
+    PathMTUDiscovery,
+)
+from common.rtt import (
+    RTTEstimator,
+)
+from common.scheduler import (
+    StreamScheduler,
+    RoundRobinScheduler,
+    DeficitRoundRobinScheduler,
+    PriorityScheduler,
+    ShortestRemainingFirstScheduler,
+    stream_schedulers,
+)
 from common.stream import (
     Stream,
 )
+from common.timers import (
+    TimerHeap,
+)
+from common.writer import (
+    FileWriter,
+    durability_policies,
+)
 from common.util import (
     sha256_file_checksum,
     crc32_file_checksum,
@@ -0,0 +1,72 @@
+"""
+
+Acknowledgement policy of a connection. Acknowledging every packet (or every batch of packets
+that arrive together) means that a bulk transfer causes about one ack packet per data packet on
+the reverse path, each of which has to be sent, received, checksummed and processed. Instead,
+an ack is sent
+
+- once ack_every ack-eliciting packets arrived in order since the last ack
+- right away if a packet arrived out of order, was a duplicate, or left or filled a gap (the
+  peer needs the selective ack for its loss detection, see Connection.detect_lost_packets())
+- at the latest max_ack_delay seconds (or a quarter of the round trip time, if that is shorter)
+  after the first packet that was not acknowledged yet (the connection wakes up for it, see
+  Connection.next_deadline())
+- together with any other frame the connection sends anyway (piggybacked, see Connection.flush())
+
+The first quick_acks packets of a connection are acknowledged right away (like the quickack mode
+of linux): in slow start the window of the peer is only a few packets, so a delayed ack would
+stall it for the whole delay.
+
+The ack is built when the connection flushes, so all packets that arrived in the meantime are
+acknowledged with a single frame. The delay of an ack is part of the rtt samples of the peer (the
+ack frames carry no ack delay), which is why max_ack_delay stays well below RTTEstimator.min_rto.
+
+"""
+
+
+class AckPolicy:
+    ack_every = 2  # ack-eliciting packets
+    max_ack_delay = 0.025  # seconds
+    quick_acks = 16  # packets at the start of a connection
+
+    def __init__(self, ack_every: int | None = None, max_ack_delay: float | None = None) -> None:
+        if ack_every is not None:
+            self.ack_every = ack_every
+        if max_ack_delay is not None:
+            self.max_ack_delay = max_ack_delay
+        self.unacked = 0  # ack-eliciting packets that arrived since the last ack
+        self.deadline: float | None = None  # when the ack has to be sent at the latest, None if nothing is unacknowledged
+        self.immediate = False
+        self.received = 0
+        # statistics
+        self.acks_sent = 0
+        self.packets_acked = 0
+
+    def __repr__(self) -> str:
+        return f"AckPolicy(unacked={self.unacked}, immediate={self.immediate}, acks_sent={self.acks_sent}, packets_acked={self.packets_acked})"
+
+    def on_packet_received(self, current_time: float, in_order: bool = True, smoothed_rtt: float | None = None) -> None:
+        # an ack-eliciting packet arrived (also if it is a duplicate or was buffered)
+        self.unacked += 1
+        self.received += 1
+        if self.deadline is None:
+            delay = self.max_ack_delay if smoothed_rtt is None else min(self.max_ack_delay, smoothed_rtt / 4)
+            self.deadline = current_time + delay
+        if not in_order or self.unacked >= self.ack_every or self.received <= self.quick_acks:
+            self.immediate = True
+
+    @property
+    def pending(self) -> bool:
+        return self.unacked > 0
+
+    def due(self, current_time: float) -> bool:
+        # whether the ack must be sent now, even if there is nothing else to send
+        return self.immediate or (self.deadline is not None and current_time >= self.deadline)
+
+    def on_ack_sent(self) -> None:
+        # an ack for everything that arrived so far was queued
+        self.acks_sent += 1
+        self.packets_acked += self.unacked
+        self.unacked = 0
+        self.deadline = None
+        self.immediate = False
@@ -0,0 +1,116 @@
+from __future__ import annotations
+import common
+
+import asyncio
+import logging
+import time
+
+"""
+
+asyncio variant of the ConnectionManager, for embedding RFT into programs that run an asyncio
+event loop (see app/async_client.py and app/async_server.py).
+
+Instead of the blocking select() loop, the socket is handed to the event loop as a datagram
+endpoint. Received datagrams are passed to the connections right away, the connections are
+flushed once per event loop iteration (so datagrams that arrive together are acknowledged
+together), and retransmission/pacing timeouts are timers of the event loop.
+
+The events that ConnectionManager.loop() yields are passed to the event_handler callback instead.
+
+Datagrams are sent with the transport (one sendto() per datagram), which queues them if the
+socket buffer is full instead of blocking the event loop.
+
+"""
+
+
+class ConnectionManagerProtocol(asyncio.DatagramProtocol):
+
+    def __init__(self, connection_manager: AsyncConnectionManager) -> None:
+        self.connection_manager = connection_manager
+
+    def datagram_received(self, data: bytes, addr: tuple) -> None:
+        self.connection_manager.datagram_received(data, addr)
+
+    def error_received(self, exc: Exception) -> None:
+        logging.warning(f"socket error: {exc}")
+
+
+class AsyncConnectionManager(common.BaseConnectionManager):
+    # the garbage collector is left alone, the process does not belong to us
+    gc_threshold = None
+
+    def __init__(self, local_port=0, p=0, q=1, ipv6=False, event_handler=None):
+        super().__init__(local_port, p, q, ipv6)
+        self.event_handler = event_handler if event_handler is not None else (lambda event: None)
+        self.transport: asyncio.DatagramTransport | None = None
+        self.timer: asyncio.TimerHandle | None = None
+        self.flush_scheduled = False
+        self.closed = None  # future that is done once close() was called
+        self.event_loop: asyncio.AbstractEventLoop | None = None
+
+    async def start(self):
+        self.event_loop = asyncio.get_running_loop()
+        self.transport, _ = await self.event_loop.create_datagram_endpoint(
+            lambda: ConnectionManagerProtocol(self), sock=self.socket)
+        self.closed = self.event_loop.create_future()
+
+    def close(self):
+        if self.timer is not None:
+            self.timer.cancel()
+        if self.transport is not None:
+            self.transport.close()
+        if self.closed is not None and not self.closed.done():
+            self.closed.set_result(None)
+
+    async def wait_closed(self):
+        await self.closed
+
+    def sendto(self, data, address):
+        if not self.simulate_loss():
+            self.transport.sendto(data, self.io.resolve(address))
+
+    def sendmany(self, datagrams: list, address):
+        address = self.io.resolve(address)
+        for data in datagrams:
+            if not self.simulate_loss():
+                self.transport.sendto(data, address)
+
+    def wake(self, connection: common.Connection):
+        # thread safe, the connection is flushed by the event loop
+        self.event_loop.call_soon_threadsafe(self.on_wake, connection)
+
+    def on_wake(self, connection: common.Connection):
+        self.request_flush(connection)
+        self.schedule_flush()
+
+    def datagram_received(self, data: bytes, addrinfo: tuple):
+        for event in self.handle_datagram(data, addrinfo):
+            self.event_handler(event)
+        self.schedule_flush()
+
+    def schedule_flush(self):
+        # connections are flushed after all datagrams that are ready now were received
+        if not self.flush_scheduled and self.transport is not None:
+            self.flush_scheduled = True
+            asyncio.get_running_loop().call_soon(self.flush)
+
+    def flush(self):
+        self.flush_scheduled = False
+        if self.transport is None or self.transport.is_closing():
+            return
+        for event in self.flush_connections():
+            self.event_handler(event)
+        self.schedule_timer()
+
+    def schedule_timer(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        timeout, _ = self.next_timeout()
+        if timeout is not None:
+            self.timer = asyncio.get_running_loop().call_later(timeout, self.on_timer)
+
+    def on_timer(self):
+        self.timer = None
+        self.fire_timers(time.time())
+        self.flush()
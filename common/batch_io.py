@@ -0,0 +1,249 @@
+from __future__ import annotations
+
+import ctypes
+import ctypes.util
+import errno
+import logging
+import os
+import socket
+import struct
+import sys
+
+from collections import OrderedDict
+
+"""
+
+Batched datagram I/O. Sending and receiving one datagram per system call (plus one select()
+per received datagram) is the main cpu cost of a transfer, so the connection manager hands
+whole batches of datagrams to this layer:
+
+recvmany(): returns all datagrams that are waiting in the socket receive buffer (up to batch_size)
+sendmany(): sends a list of datagrams to the same address
+
+On linux, recvmmsg()/sendmmsg() are called via ctypes, which moves a whole batch with a single
+system call. Everywhere else (or if libc cannot be loaded) DatagramIO drains the socket with
+recvfrom_into() into a reusable buffer and sends with one sendto() per datagram.
+
+The received data is always copied out of the receive buffers (only the actual length of the
+datagram), since packets keep memoryviews of it (e.g. DataFrame payloads in the receive buffer).
+
+Resolved and encoded addresses are cached per peer. The caches only keep the max_entries most
+recently used addresses, a server that receives from many (or spoofed) source addresses would
+otherwise grow them without limit.
+
+"""
+
+
+class AddressCache:
+    # least recently used cache of addresses (resolved addresses, encoded struct sockaddr, ...)
+    max_entries = 1024
+
+    def __init__(self) -> None:
+        self.entries: OrderedDict = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def get(self, key):
+        value = self.entries.get(key)
+        if value is not None:
+            self.entries.move_to_end(key)
+        return value
+
+    def put(self, key, value) -> None:
+        self.entries[key] = value
+        if len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+
+class DatagramIO:
+    # 64kib is the maximum ip payload size
+    max_datagram_size = 65536
+
+    def __init__(self, sock: socket.socket, batch_size: int = 64) -> None:
+        self.socket = sock
+        self.batch_size = batch_size
+        self.buffer = bytearray(self.max_datagram_size)
+        self.resolved_addresses = AddressCache()
+
+    def resolve(self, address: tuple) -> tuple:
+        # sendto() would resolve host names on every single call
+        resolved = self.resolved_addresses.get(address)
+        if resolved is None:
+            resolved = socket.getaddrinfo(address[0], address[1], self.socket.family, socket.SOCK_DGRAM)[0][4]
+            self.resolved_addresses.put(address, resolved)
+        return resolved
+
+    def recvmany(self) -> list[tuple[bytes, tuple]]:
+        # must only be called if the socket is readable (at least one datagram is returned)
+        view = memoryview(self.buffer)
+        length, address = self.socket.recvfrom_into(self.buffer)
+        datagrams = [(bytes(view[:length]), address)]
+        flags = getattr(socket, "MSG_DONTWAIT", None)
+        if flags is None:
+            return datagrams
+        while len(datagrams) < self.batch_size:
+            try:
+                length, address = self.socket.recvfrom_into(self.buffer, 0, flags)
+            except (BlockingIOError, InterruptedError):
+                break
+            datagrams.append((bytes(view[:length]), address))
+        return datagrams
+
+    def sendmany(self, datagrams: list, address: tuple) -> None:
+        address = self.resolve(address)
+        for data in datagrams:
+            self.socket.sendto(data, address)
+
+
+class iovec(ctypes.Structure):
+    _fields_ = [
+        ("iov_base", ctypes.c_void_p),
+        ("iov_len", ctypes.c_size_t),
+    ]
+
+
+class msghdr(ctypes.Structure):
+    _fields_ = [
+        ("msg_name", ctypes.c_void_p),
+        ("msg_namelen", ctypes.c_uint32),
+        ("msg_iov", ctypes.POINTER(iovec)),
+        ("msg_iovlen", ctypes.c_size_t),
+        ("msg_control", ctypes.c_void_p),
+        ("msg_controllen", ctypes.c_size_t),
+        ("msg_flags", ctypes.c_int),
+    ]
+
+
+class mmsghdr(ctypes.Structure):
+    _fields_ = [
+        ("msg_hdr", msghdr),
+        ("msg_len", ctypes.c_uint),
+    ]
+
+
+class MMsgDatagramIO(DatagramIO):
+    sockaddr_size = 128  # sizeof(struct sockaddr_storage)
+
+    def __init__(self, sock: socket.socket, libc: ctypes.CDLL, batch_size: int = 64) -> None:
+        super().__init__(sock, batch_size)
+        self.recvmmsg = libc.recvmmsg
+        self.recvmmsg.argtypes = [ctypes.c_int, ctypes.POINTER(mmsghdr), ctypes.c_uint, ctypes.c_int, ctypes.c_void_p]
+        self.recvmmsg.restype = ctypes.c_int
+        self.sendmmsg = libc.sendmmsg
+        self.sendmmsg.argtypes = [ctypes.c_int, ctypes.POINTER(mmsghdr), ctypes.c_uint, ctypes.c_int]
+        self.sendmmsg.restype = ctypes.c_int
+
+        # receive side: batch_size buffers (and source addresses) that are reused for every call
+        self.recv_buffers = (ctypes.c_char * (self.max_datagram_size * batch_size))()
+        self.recv_names = (ctypes.c_char * (self.sockaddr_size * batch_size))()
+        self.recv_iovecs = (iovec * batch_size)()
+        self.recv_messages = (mmsghdr * batch_size)()
+        for i in range(batch_size):
+            self.recv_iovecs[i].iov_base = ctypes.addressof(self.recv_buffers) + i * self.max_datagram_size
+            self.recv_iovecs[i].iov_len = self.max_datagram_size
+            self.recv_messages[i].msg_hdr.msg_iov = ctypes.pointer(self.recv_iovecs[i])
+            self.recv_messages[i].msg_hdr.msg_iovlen = 1
+            self.recv_messages[i].msg_hdr.msg_name = ctypes.addressof(self.recv_names) + i * self.sockaddr_size
+        self.recv_view = memoryview(self.recv_buffers).cast("B")
+        self.recv_names_view = memoryview(self.recv_names).cast("B")
+
+        # send side: the iovecs point directly to the encoded packets, nothing is copied
+        self.send_iovecs = (iovec * batch_size)()
+        self.send_messages = (mmsghdr * batch_size)()
+        for i in range(batch_size):
+            self.send_messages[i].msg_hdr.msg_iov = ctypes.pointer(self.send_iovecs[i])
+            self.send_messages[i].msg_hdr.msg_iovlen = 1
+
+        self.sockaddrs = AddressCache()  # address -> encoded struct sockaddr
+        self.addresses = AddressCache()  # encoded struct sockaddr -> address
+
+    def encode_sockaddr(self, address: tuple) -> ctypes.Array:
+        sockaddr = self.sockaddrs.get(address)
+        if sockaddr is None:
+            resolved = self.resolve(address)
+            if self.socket.family == socket.AF_INET6:
+                # struct sockaddr_in6: family, port, flowinfo, address, scope id
+                host, port, flowinfo, scope_id = resolved
+                data = struct.pack("=H", socket.AF_INET6) + struct.pack("!HI", port, flowinfo) + \
+                    socket.inet_pton(socket.AF_INET6, host.split("%")[0]) + struct.pack("=I", scope_id)
+            else:
+                # struct sockaddr_in: family, port, address, padding
+                host, port = resolved
+                data = struct.pack("=H", socket.AF_INET) + struct.pack("!H", port) + \
+                    socket.inet_pton(socket.AF_INET, host) + bytes(8)
+            sockaddr = ctypes.create_string_buffer(data, len(data))
+            self.sockaddrs.put(address, sockaddr)
+        return sockaddr
+
+    def decode_sockaddr(self, data: bytes) -> tuple:
+        address = self.addresses.get(data)
+        if address is None:
+            family, = struct.unpack_from("=H", data)
+            if family == socket.AF_INET6:
+                port, flowinfo = struct.unpack_from("!HI", data, 2)
+                scope_id, = struct.unpack_from("=I", data, 24)
+                address = (socket.inet_ntop(socket.AF_INET6, data[8:24]), port, flowinfo, scope_id)
+            else:
+                port, = struct.unpack_from("!H", data, 2)
+                address = (socket.inet_ntop(socket.AF_INET, data[4:8]), port)
+            self.addresses.put(data, address)
+        return address
+
+    def recvmany(self) -> list[tuple[bytes, tuple]]:
+        for i in range(self.batch_size):
+            # the kernel overwrites the length with the length of the actual source address
+            self.recv_messages[i].msg_hdr.msg_namelen = self.sockaddr_size
+        count = self.recvmmsg(self.socket.fileno(), self.recv_messages, self.batch_size, socket.MSG_DONTWAIT, None)
+        if count < 0:
+            error = ctypes.get_errno()
+            if error in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR):
+                return []
+            raise OSError(error, os.strerror(error))
+        datagrams = []
+        for i in range(count):
+            start = i * self.max_datagram_size
+            name_start = i * self.sockaddr_size
+            name = bytes(self.recv_names_view[name_start:name_start + self.recv_messages[i].msg_hdr.msg_namelen])
+            datagrams.append((bytes(self.recv_view[start:start + self.recv_messages[i].msg_len]), self.decode_sockaddr(name)))
+        return datagrams
+
+    def sendmany(self, datagrams: list, address: tuple) -> None:
+        sockaddr = self.encode_sockaddr(address)
+        for start in range(0, len(datagrams), self.batch_size):
+            batch = datagrams[start:start + self.batch_size]
+            # keeps the ctypes views of the datagrams alive until sendmmsg() returns
+            buffers = []
+            for i, data in enumerate(batch):
+                if isinstance(data, bytes):
+                    buffer = ctypes.c_char_p(data)
+                    self.send_iovecs[i].iov_base = ctypes.cast(buffer, ctypes.c_void_p).value
+                else:
+                    buffer = ctypes.c_char.from_buffer(data)
+                    self.send_iovecs[i].iov_base = ctypes.addressof(buffer)
+                buffers.append(buffer)
+                self.send_iovecs[i].iov_len = len(data)
+                self.send_messages[i].msg_hdr.msg_name = ctypes.addressof(sockaddr)
+                self.send_messages[i].msg_hdr.msg_namelen = len(sockaddr)
+            sent = 0
+            while sent < len(batch):
+                # sendmmsg() may send only a part of the batch (e.g. if the socket send buffer is full)
+                count = self.sendmmsg(self.socket.fileno(), ctypes.byref(self.send_messages[sent]), len(batch) - sent, 0)
+                if count < 0:
+                    error = ctypes.get_errno()
+                    if error == errno.EINTR:
+                        continue
+                    raise OSError(error, os.strerror(error))
+                sent += count
+            del buffers
+
+
+def create_datagram_io(sock: socket.socket, batch_size: int = 64) -> DatagramIO:
+    if sys.platform.startswith("linux"):
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+            if hasattr(libc, "recvmmsg") and hasattr(libc, "sendmmsg"):
+                return MMsgDatagramIO(sock, libc, batch_size)
+        except OSError as e:
+            logging.warning(f"could not load libc, falling back to single datagram I/O: {e}")
+    return DatagramIO(sock, batch_size)
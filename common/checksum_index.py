@@ -0,0 +1,86 @@
+from __future__ import annotations
+
+from collections import OrderedDict
+
+import hashlib
+import os
+import threading
+import zlib
+
+"""
+
+Checksum index for resumed transfers. A ReadFrame with the resume flag carries the crc32 of the
+first offset bytes of the file, which the server has to verify, and a resumed stream needs the
+sha256 of the same prefix for its running checksum (see Stream.update_checksum()). Instead of
+reading the whole prefix for every resume, the index remembers the crc32 and the sha256 state at
+every checkpoint_interval bytes of a file, prefix() only reads from the nearest checkpoint before
+the requested offset. A sha256 state takes about 200 bytes, a 10 GiB file about 500 KiB.
+
+The server calls prefix() on its checksum threads (see app/server.py), the index is therefore
+locked.
+
+Files are identified by (path, device, inode, size, mtime), a file that was modified gets a new
+entry. The index is kept in memory, the least recently used files are evicted once there are
+more than max_files.
+
+"""
+
+
+class ChecksumIndex:
+    checkpoint_interval = 4 * 1024 * 1024
+    max_files = 256
+    read_size = 1024 * 1024
+
+    def __init__(self) -> None:
+        # file key -> (crc32, sha256 state) of the first 0, checkpoint_interval, 2 * checkpoint_interval, ... bytes
+        self.files: OrderedDict[tuple, list[tuple[int, hashlib._Hash]]] = OrderedDict()
+        self.lock = threading.Lock()
+
+    def __repr__(self) -> str:
+        return f"ChecksumIndex(files={len(self.files)})"
+
+    def checkpoints(self, path: str) -> list[tuple[int, hashlib._Hash]]:
+        stat = os.stat(path)
+        key = (path, stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime_ns)
+        with self.lock:
+            checkpoints = self.files.get(key)
+            if checkpoints is None:
+                checkpoints = [(0, hashlib.sha256())]  # the empty prefix
+                self.files[key] = checkpoints
+                if len(self.files) > self.max_files:
+                    self.files.popitem(last=False)
+            else:
+                self.files.move_to_end(key)
+        return checkpoints
+
+    def crc32(self, path: str, length: int) -> int:
+        # crc32 of the first length bytes of the file (the whole file if it is shorter)
+        return self.prefix(path, length)[0]
+
+    def prefix(self, path: str, length: int) -> tuple[int, hashlib._Hash]:
+        # crc32 and sha256 hash object of the first length bytes of the file, both continue at the nearest checkpoint
+        checkpoints = self.checkpoints(path)
+        with self.lock:
+            index = min(length // self.checkpoint_interval, len(checkpoints) - 1)
+            crc, sha256_state = checkpoints[index]
+        sha256_hash = sha256_state.copy()
+        offset = index * self.checkpoint_interval
+
+        buffer = bytearray(self.read_size)
+        view = memoryview(buffer)
+        with open(path, "rb") as file:
+            file.seek(offset)
+            while offset < length:
+                # reads stop at the next checkpoint, so that it can be recorded
+                next_checkpoint = (offset // self.checkpoint_interval + 1) * self.checkpoint_interval
+                count = file.readinto(view[:min(self.read_size, length - offset, next_checkpoint - offset)])
+                if not count:
+                    break
+                crc = zlib.crc32(view[:count], crc)
+                sha256_hash.update(view[:count])
+                offset += count
+                if offset == next_checkpoint:
+                    with self.lock:
+                        if len(checkpoints) == offset // self.checkpoint_interval:
+                            checkpoints.append((crc, sha256_hash.copy()))
+        return crc, sha256_hash
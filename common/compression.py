@@ -0,0 +1,199 @@
+from __future__ import annotations
+
+import abc
+import zlib
+
+try:
+    import lzma
+except ImportError:  # python built without liblzma
+    lzma = None
+try:
+    import bz2
+except ImportError:  # python built without libbz2
+    bz2 = None
+
+"""
+
+Compression of the data of a stream. A client that sets the compress flag of a ReadFrame accepts
+compressed data, the server then sends the output of a streaming compressor instead of the raw
+file. The compressed data has its own offset space: the DataFrame offsets count the compressed
+bytes from 0, the first byte is the id of the codec that the server chose (codec_ids). The
+client decompresses the data in order and writes it at the file offsets it belongs to, so the
+writer and the final checksum still deal with the uncompressed file.
+
+Files that do not compress (archives, media, ...) would only cost cpu time on both sides. The
+server compresses the first sample_size bytes with zlib first, if they do not shrink below
+max_sample_ratio the codec "none" is announced and the data is sent as it is.
+
+lzma and bz2 are optional, they are only offered if the python build has them.
+
+"""
+
+codec_ids = {"none": 0, "zlib": 1, "lzma": 2, "bz2": 3}
+compression_codecs = tuple(name for name, module in (("zlib", zlib), ("lzma", lzma), ("bz2", bz2)) if module is not None)
+
+sample_size = 128 * 1024
+max_sample_ratio = 0.9
+
+
+class StoredCodec:
+    # the codec "none": the data is passed through. decompress() never expands the data, so max_length is not needed
+    needs_input = True
+    eof = False
+
+    def compress(self, data):
+        return data
+
+    def decompress(self, data, max_length: int = -1):
+        return data
+
+    def flush(self) -> bytes:
+        return b""
+
+
+def create_compressor(codec: str):
+    if codec == "zlib":
+        # level 1: most of the gain for text files at a fraction of the cpu time of the default level
+        return zlib.compressobj(1)
+    if codec == "lzma" and lzma is not None:
+        return lzma.LZMACompressor(preset=1)
+    if codec == "bz2" and bz2 is not None:
+        return bz2.BZ2Compressor()
+    if codec == "none":
+        return StoredCodec()
+    raise ValueError(f"unknown compression codec {codec}")
+
+
+def create_decompressor(codec_id: int):
+    if codec_id == codec_ids["zlib"]:
+        return zlib.decompressobj()
+    if codec_id == codec_ids["lzma"] and lzma is not None:
+        return lzma.LZMADecompressor()
+    if codec_id == codec_ids["bz2"] and bz2 is not None:
+        return bz2.BZ2Decompressor()
+    if codec_id == codec_ids["none"]:
+        return StoredCodec()
+    raise ValueError(f"unsupported compression codec id {codec_id}")
+
+
+class CompressingReader:
+    # compresses the bytes [start, end) of a ReadAheadReader, read() is used like ReadAheadReader.read() but
+    # with offsets of the compressed data. the offsets must not go backwards (the sender reads sequentially)
+    input_size = 256 * 1024
+
+    def __init__(self, reader, codec: str, start: int, end: int | None, on_input=None) -> None:
+        self.reader = reader
+        # called with (file offset, data) for the uncompressed data in file order, e.g. to keep a running checksum
+        self.on_input = on_input
+        self.input_offset = start
+        self.end = end if end is not None else reader.size
+        self.codec = codec
+        self.compressor = None  # created once the sample was checked
+        self.finished = False
+        # compressed data that was not read yet, output[0] is at output_offset
+        self.output = bytearray()
+        self.output_offset = 0
+
+    def __repr__(self) -> str:
+        return f"CompressingReader(codec={self.codec}, input_offset={self.input_offset}, output_offset={self.output_offset})"
+
+    def read(self, offset: int, length: int) -> bytes:
+        # up to length compressed bytes at offset, empty once all of the data was read
+        if offset < self.output_offset:
+            raise ValueError(f"compressed data at {offset} was read already")
+        del self.output[:offset - self.output_offset]
+        self.output_offset = offset
+        if self.compressor is None:
+            self.start()
+        while len(self.output) < length and not self.finished:
+            data = self.reader.read(self.input_offset, min(self.input_size, self.end - self.input_offset))
+            if not data:
+                self.output += self.compressor.flush()
+                self.finished = True
+                break
+            if self.on_input is not None:
+                self.on_input(self.input_offset, data)
+            self.output += self.compressor.compress(data)
+            self.input_offset += len(data)
+        # a copy, output changes with the next read
+        return bytes(self.output[:length])
+
+    def start(self) -> None:
+        sample = self.reader.read(self.input_offset, min(sample_size, self.end - self.input_offset))
+        if self.codec != "none" and len(sample) > 0 and len(zlib.compress(sample, 1)) > max_sample_ratio * len(sample):
+            self.codec = "none"
+        self.compressor = create_compressor(self.codec)
+        self.output.append(codec_ids[self.codec])
+
+    def remaining_bytes(self) -> int:
+        # uncompressed bytes that were not compressed yet
+        return max(0, self.end - self.input_offset)
+
+    def close(self) -> None:
+        self.output = bytearray()
+        self.reader.close()
+
+
+class OrderedDecoder(abc.ABC):
+    # decoder of the data of a stream that has to be processed in order (compressed data, delta records), the
+    # DataFrames may arrive in any order. feed() yields the (file offset, data) pieces that can be written now
+    max_pending_frames = 4096
+
+    def __init__(self) -> None:
+        self.input_offset = 0  # stream bytes that were decoded already
+        self.pending: dict[int, bytes] = {}  # stream offset -> data that arrived early
+
+    def feed(self, offset: int, data):
+        if offset < self.input_offset or offset in self.pending:
+            return  # duplicate
+        if len(self.pending) >= self.max_pending_frames:
+            raise ValueError("too many frames out of order")
+        self.pending[offset] = data
+        while self.input_offset in self.pending:
+            data = self.pending.pop(self.input_offset)
+            self.input_offset += len(data)
+            yield from self.decode(data)
+
+    @abc.abstractmethod
+    def decode(self, data):
+        ...
+
+    def close(self) -> None:
+        pass
+
+
+class Decompressor(OrderedDecoder):
+    # upper bound of the output of one decompress() call: a small frame can expand to a huge amount of data,
+    # which is handed to the writer piece by piece instead of being decompressed into memory at once
+    max_output = 1024 * 1024
+
+    def __init__(self, start: int) -> None:
+        super().__init__()
+        self.decompressor = None  # created once the codec id (the first byte) arrived
+        self.output_offset = start  # file offset of the next decompressed byte
+
+    def __repr__(self) -> str:
+        return f"Decompressor(input_offset={self.input_offset}, output_offset={self.output_offset}, pending={len(self.pending)})"
+
+    def decode(self, data):
+        if self.decompressor is None:
+            self.decompressor = create_decompressor(data[0])
+            data = data[1:]
+        while True:
+            try:
+                decompressed = self.decompressor.decompress(data, self.max_output)
+            except Exception as e:  # zlib.error, lzma.LZMAError, OSError of bz2
+                raise ValueError(f"corrupt compressed data: {e}") from e
+            if decompressed:
+                yield self.output_offset, decompressed
+                self.output_offset += len(decompressed)
+            if hasattr(self.decompressor, "unconsumed_tail"):
+                # zlib: the input that did not fit into max_output is handed back
+                data = self.decompressor.unconsumed_tail
+                if not data and len(decompressed) < self.max_output:
+                    return
+            else:
+                # lzma, bz2: the input is buffered by the decompressor
+                data = b""
+                if self.decompressor.needs_input or self.decompressor.eof:
+                    return
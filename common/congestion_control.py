@@ -0,0 +1,156 @@
+import abc
+import logging
+import math
+
+"""
+
+Congestion control algorithms. A connection owns exactly one CongestionControl object which
+keeps track of the congestion window (cwnd, in bytes). The connection reports events to it:
+
+on_ack():     a packet carrying at least one frame other than an AckFrame was acknowledged
+on_loss():    a packet is considered lost (but the connection is still able to detect losses)
+on_timeout(): the retransmission timer fired, i.e. no feedback arrived for a long time
+
+The window is counted in bytes, max_datagram_size is the size of a full sized packet and is
+updated by the connection whenever path MTU discovery finds a larger packet size.
+
+"""
+
+
+class CongestionControl(abc.ABC):
+
+    def __init__(self, max_datagram_size: int, slowstart_threshold: int) -> None:
+        self.max_datagram_size = max_datagram_size
+        # RFC 6928 initial window
+        self.cwnd = min(10 * max_datagram_size, max(2 * max_datagram_size, 14720))
+        self.slowstart_threshold = slowstart_threshold
+        # packets sent before this point in time do not cause another window reduction (one reduction per round trip)
+        self.recovery_start_time = 0
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}(cwnd={self.cwnd}, slowstart_threshold={self.slowstart_threshold})"
+
+    @property
+    def minimum_window(self) -> int:
+        return 2 * self.max_datagram_size
+
+    @property
+    def is_slowstart(self) -> bool:
+        return self.cwnd < self.slowstart_threshold
+
+    def in_recovery(self, sent_time: float) -> bool:
+        return sent_time <= self.recovery_start_time
+
+    def on_ack(self, acked_bytes: int, sent_time: float, now: float) -> None:
+        if self.in_recovery(sent_time):
+            # do not grow the window for packets that were sent before the last reduction
+            return
+        if self.is_slowstart:
+            # slow start: grow by the number of acknowledged bytes (RFC 3465), i.e. double the window every round trip
+            self.cwnd += acked_bytes
+            logging.info(f"congestion window increased quickly to {self.cwnd}")
+        else:
+            self.on_congestion_avoidance_ack(acked_bytes, now)
+            logging.info(f"congestion window increased normally to {self.cwnd}")
+
+    def on_loss(self, sent_time: float, now: float) -> None:
+        if self.in_recovery(sent_time):
+            return
+        self.recovery_start_time = now
+        self.on_congestion_event(now)
+        logging.info(f"congestion window decreased to {self.cwnd}")
+
+    def on_timeout(self, now: float) -> None:
+        # nothing was heard from the peer for a whole retransmit timeout, start over with slow start
+        self.recovery_start_time = now
+        self.on_congestion_event(now)
+        self.cwnd = self.minimum_window
+        logging.info(f"congestion window collapsed to {self.cwnd} after a timeout")
+
+    @abc.abstractmethod
+    def on_congestion_avoidance_ack(self, acked_bytes: int, now: float) -> None:
+        ...
+
+    @abc.abstractmethod
+    def on_congestion_event(self, now: float) -> None:
+        # reduce cwnd and slowstart_threshold
+        ...
+
+
+class NewReno(CongestionControl):
+
+    def __init__(self, max_datagram_size: int, slowstart_threshold: int) -> None:
+        super().__init__(max_datagram_size, slowstart_threshold)
+        self.bytes_acked = 0
+
+    def on_congestion_avoidance_ack(self, acked_bytes: int, now: float) -> None:
+        # additive increase: one max sized datagram per congestion window that is acknowledged
+        self.bytes_acked += acked_bytes
+        if self.bytes_acked >= self.cwnd:
+            self.bytes_acked -= self.cwnd
+            self.cwnd += self.max_datagram_size
+
+    def on_congestion_event(self, now: float) -> None:
+        # multiplicative decrease
+        self.cwnd = max(self.cwnd // 2, self.minimum_window)
+        self.slowstart_threshold = self.cwnd
+        self.bytes_acked = 0
+
+
+class Cubic(CongestionControl):
+    # constants from RFC 9438
+    C = 0.4
+    beta = 0.7
+
+    def __init__(self, max_datagram_size: int, slowstart_threshold: int) -> None:
+        super().__init__(max_datagram_size, slowstart_threshold)
+        self.w_max = 0  # window (in bytes) before the last reduction
+        self.w_last_max = 0
+        self.w_est = 0  # estimate of the window a reno flow would have (reno friendly region)
+        self.k = 0  # time it takes to grow back to w_max
+        self.epoch_start = None
+
+    def w_cubic(self, t: float) -> float:
+        # the cubic window function, C is given in segments / s^3
+        return self.C * (t - self.k) ** 3 * self.max_datagram_size + self.w_max
+
+    def on_congestion_avoidance_ack(self, acked_bytes: int, now: float) -> None:
+        if self.epoch_start is None:
+            # start of a congestion avoidance epoch (after a reduction or when slow start reached the threshold)
+            self.epoch_start = now
+            self.w_est = self.cwnd
+            if self.w_max > self.cwnd:
+                self.k = math.cbrt((self.w_max - self.cwnd) / self.max_datagram_size / self.C)
+            else:
+                self.w_max = self.cwnd
+                self.k = 0
+
+        alpha = 3 * (1 - self.beta) / (1 + self.beta)
+        self.w_est += alpha * acked_bytes / self.cwnd * self.max_datagram_size
+
+        target = self.w_cubic(now - self.epoch_start)
+        target = min(max(target, self.cwnd), 1.5 * self.cwnd)
+
+        if self.w_est > target:
+            # reno friendly region
+            self.cwnd = int(self.w_est)
+        else:
+            self.cwnd += int((target - self.cwnd) * acked_bytes / self.cwnd)
+
+    def on_congestion_event(self, now: float) -> None:
+        # fast convergence: release bandwidth if the window did not grow back to the last maximum
+        if self.cwnd < self.w_last_max:
+            self.w_last_max = self.cwnd
+            self.w_max = self.cwnd * (1 + self.beta) / 2
+        else:
+            self.w_last_max = self.cwnd
+            self.w_max = self.cwnd
+        self.cwnd = max(int(self.cwnd * self.beta), self.minimum_window)
+        self.slowstart_threshold = self.cwnd
+        self.epoch_start = None
+
+
+congestion_control_algorithms = {
+    "newreno": NewReno,
+    "cubic": Cubic,
+}
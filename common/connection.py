@@ -6,6 +6,7 @@ from frame import *
 from abc import abstractmethod
 from collections import deque
 
+import errno
 import time
 import logging
 
@@ -13,20 +14,29 @@ last_data_frame_offset = 0
 
 
 class Connection:
+    # initial slow start threshold in bytes. RFC 5681 allows it to be arbitrarily high, slow start then lasts until
+    # the first loss, after which the congestion control sets the threshold to the reduced window. a lower value
+    # makes connections switch to congestion avoidance at that window (e.g. on paths that are known to be shallow)
+    initial_slowstart_threshold = 2**32 - 1
 
     def __init__(
         self,
-        connection_manager: common.ConnectionManager,
+        connection_manager: common.BaseConnectionManager,
         remote_host: str,
         remote_port: int,
         connection_id: int,
+        congestion_control: str = "cubic",
+        pacing: bool = True,
+        scheduler: str = "rr",
     ) -> None:
         self.connection_manager = connection_manager
         self.remote_host = remote_host
         self.remote_port = remote_port
         self.connection_id = connection_id
         self.streams: dict[int, common.Stream] = {}
-        self.retransmit_timeout = 1  # seconds
+        # decides which stream sends the next data frame, see generate_frame()
+        self.scheduler: common.StreamScheduler = common.stream_schedulers[scheduler]()
+        self.rtt = common.RTTEstimator()  # provides the retransmit timeout, see retransmit_timeout
         self.connection_timeout = 5 * 60  # seconds
         self.last_updated = time.time()
 
@@ -42,20 +52,35 @@ class Connection:
         # frames are scheduled using a double-ended queue (also see queue_frame() function)
         self.frame_queue = deque()
 
-        # start out with 32 max-sized packets, usually the receive buffer for sockets under linux can hold that amount
-        self.max_packet_size = 1500 - 40 - 8  # TODO do MTU discovery?
-        self.max_inflight_bytes = 1000
-        self.is_slowstart = True
-        self.slowstart_threshold = 10000
+        # the max packet size starts out conservatively and is raised by path MTU discovery (see max_packet_size)
+        self.path_mtu = common.PathMTUDiscovery()
+        # the congestion window (see max_inflight_bytes) is managed by the congestion control algorithm.
+        # slow start lasts until the first loss or until the window exceeds the slow start threshold
+        self.congestion_control: common.CongestionControl = common.congestion_control_algorithms[congestion_control](
+            self.max_packet_size, self.initial_slowstart_threshold)
+        # the pacer spreads the congestion window over a round trip instead of sending it in one burst
+        self.pacer = common.Pacer() if pacing else None
+        self.pacing_limited = False  # True if the last flush() stopped because of the pacer, see next_deadline()
 
         # send windowing
         self.last_sent_packet_id = 0
         self.next_recv_packet_id = 1  # will be initialized upon receiving the first packet
         self.receive_window = 1000
         self.receive_buffer: dict[int, Packet] = {}
-        self.inflight_packets: deque[tuple[float, Packet]] = deque()  # packet cache for retransmissions, queue is ordered by timestamps
-        self.inflight_bytes = 0   # should always match with packets in self.inflight_packets !
-        self.last_ack_sent = None # this is the packet that the last sent
+        self.inflight_packets = common.InflightPackets()  # packet cache for retransmissions, indexed by packet_id and by time
+        # loss detection with selective acks
+        self.packet_reordering_threshold = 3
+        self.largest_acked_packet_id = 0
+        self.latest_acked_sent_time = 0
+        self.max_sack_ranges = 64
+        # decides when received packets are acknowledged (every few packets, after a delay, or right away on gaps)
+        self.ack_policy = common.AckPolicy()
+        # flow control: the window this connection advertises for the data it receives (autotuned, see
+        # common/flow_control.py), and the window advertised by the peer, which limits max_inflight_bytes
+        self.flow_control = common.ReceiveWindow()
+        self.peer_window = common.ReceiveWindow.initial_window
+        # the streams that receive data and are not closed yet, only these are measured by update_receive_window()
+        self.receive_streams: dict[int, common.Stream] = {}
 
     def flush(self):
         """
@@ -74,40 +99,43 @@ class Connection:
 
         if self.retransmit_timeout_triggered:
             current_time = time.time()
-            no_ack_expected = []
-            retransmitted = []
-            for tp in self.inflight_packets:
-                timestamp, packet = tp
-                if current_time > timestamp + self.retransmit_timeout:
-                    # if the packet contained at least one frame other than AckFrame or an ExitFrame send a retransmit
-                    if next((frame for frame in packet.frames if type(frame) != AckFrame), None):
-                        logging.info(f"retransmitting packet, packet_id = {packet.header.packet_id}, {[type(frame).__name__ for frame in packet.frames]}")
-                        retransmitted.append(tp)
-                        self.connection_manager.sendto(packet.pack(), (self.remote_host, self.remote_port))
-                    else:
-                        logging.info("no ack expected for retransmitted packet")
-                        no_ack_expected.append(tp)
-            for tp in no_ack_expected:
-                _, packet = tp
-                self.inflight_packets.remove(tp)
-                self.inflight_bytes -= len(packet.pack())
-            for tp in retransmitted:
-                timestamp, packet = tp
-                self.inflight_packets.remove(tp)
-                self.inflight_packets.appendleft((current_time, packet))
+            # packets that were selectively acknowledged are no longer inflight, so only the gaps are retransmitted
+            for entry in self.inflight_packets.sent_before(current_time - self.retransmit_timeout):
+                self.retransmit(entry, current_time)
+            # back off only now, otherwise the timed out packets would not qualify for a retransmission above
+            self.rtt.on_timeout()
             self.retransmit_timeout_triggered = False
 
+        self.update_receive_window(time.time())
+
+        # an ack that is not due yet is only sent if it can ride along with other frames (see common/ack_policy.py)
+        if self.ack_policy.pending and (self.ack_policy.due(time.time()) or len(self.frame_queue) > 0):
+            self.queue_ack()
+
         # max_flush_bytes is the amount of bytes that we are allowed to send out according to the current send window:
         if not self.connection_id and len(self.inflight_packets) == 1:
             # in this case we cannot have more than one inflight packet
             max_flush_bytes = 0
+        elif not self.connection_id:
+            # every packet without a connection id would open a new connection on the server, so only the first
+            # packet is sent until the server answered (the rest of the frames stay queued)
+            max_flush_bytes = min(self.max_packet_size, self.max_inflight_bytes - self.inflight_bytes)
         else:
             max_flush_bytes = self.max_inflight_bytes - self.inflight_bytes
 
+        paced = False
+        if self.pacer is not None:
+            self.pacer.update(self.max_inflight_bytes, self.rtt.smoothed_rtt, self.congestion_control.is_slowstart, self.max_packet_size, time.time())
+            if self.pacer.budget() < max_flush_bytes:
+                max_flush_bytes = int(self.pacer.budget())
+                paced = True
+
         logging.info(f"max_flush_bytes = {max_flush_bytes}")
 
         to_be_flushed_packets: list[Packet] = []
         to_be_flushed_bytes: int = 0
+        generated_data = False
+        budget_exhausted = False  # True if there was more to send than max_flush_bytes allowed
         # ... and start packaging:
 
         while True:
@@ -119,10 +147,24 @@ class Connection:
 
             while True:
                 if len(self.frame_queue) == 0:
-                    generated_frame = self.generate_frame()
+                    # a pending ack is sent in the same packet as the next data frame, if there is one
+                    piggybacked_ack = self.build_ack() if self.ack_policy.pending else None
+                    # size the next data frame s.t. it fills up the rest of the packet without exceeding the send window
+                    max_payload_size = min(self.max_packet_size, max_flush_bytes - to_be_flushed_bytes) - \
+                        global_header_size - to_be_packaged_bytes - DataFrame.Header.size - \
+                        (len(piggybacked_ack) if piggybacked_ack is not None else 0)
+                    generated_frame = self.generate_frame(max_payload_size) if max_payload_size > 0 else None
                     if generated_frame is not None:
+                        generated_data = True
                         self.queue_frame(generated_frame)
+                        if piggybacked_ack is not None:
+                            self.queue_frame(piggybacked_ack, transmit_first=True)
+                            self.ack_policy.on_ack_sent()
                     else:
+                        if piggybacked_ack is not None:
+                            piggybacked_ack.release()
+                        if max_payload_size <= 0:
+                            budget_exhausted = True
                         break
 
                 # decide if we can package one more frame:
@@ -137,6 +179,7 @@ class Connection:
                         # since we can do nothing here, the ill-sized frame is now clogging the queue
                     break
                 elif to_be_flushed_bytes + predicted_packet_size > max_flush_bytes:
+                    budget_exhausted = True
                     # let's not trust our own implementation and log an error in case the send window size is too small.
                     if len(to_be_packaged_frames) == 0 and predicted_packet_size > self.max_inflight_bytes:
                         logging.error(
@@ -156,73 +199,184 @@ class Connection:
                 break
 
             # let's start packaging frames!
-            packet_id = self.last_sent_packet_id + 1
+            if any(frame.ack_eliciting for frame in to_be_packaged_frames):
+                packet_id = self.last_sent_packet_id + 1
+                self.last_sent_packet_id = packet_id
+            else:
+                # packets that only contain acks are never retransmitted, thus they must not occupy a packet_id.
+                # otherwise the peer would wait forever for a lost ack-only packet (see update())
+                packet_id = self.last_sent_packet_id
             packet = Packet(1, self.connection_id, packet_id, to_be_packaged_frames)
-            self.last_sent_packet_id = packet_id
             to_be_flushed_packets.append(packet)
             to_be_flushed_bytes += len(packet)
 
+        # probe for a larger path MTU while there is data to be sent. probes are not limited by the send window,
+        # but are counted as inflight bytes once sent.
+        probe_size = self.path_mtu.next_probe_size() if self.connection_id and generated_data else None
+
+        # all packets of this flush are handed to the connection manager at once (batched system calls)
+        t = time.time()
+        self.connection_manager.sendmany([packet.pack() for packet in to_be_flushed_packets], (self.remote_host, self.remote_port))
+        if self.pacer is not None:
+            self.pacer.on_sent(to_be_flushed_bytes)
+        self.pacing_limited = paced and budget_exhausted
         for packet in to_be_flushed_packets:
-            data = packet.pack()
-            t = time.time()
-            # if the packet contained at least one frame other than AckFrame save an timestamp
-            # # if next((frame for frame in packet.frames if type(frame) != AckFrame), None):
-            # #     self.inflight_packets.appendleft((t, packet))
-            # # else:
-            # #     self.inflight_packets.appendleft((None, packet))
-            # ack everything
-            if next((frame for frame in packet.frames if type(frame) != AckFrame), None):
-                self.inflight_packets.appendleft((t, packet))
-                self.inflight_bytes += len(data)
-            else:
-                self.last_ack_sent = packet
             logging.info(f"sending packet {t}, packet_id = {packet.header.packet_id}, {[type(frame).__name__ for frame in packet.frames]}")
+            # if the packet contained at least one frame other than AckFrame save it (together with its encoding)
+            if packet.contains_non_ack_frame():
+                self.inflight_packets.add(packet, packet.pack(), t)
+            else:
+                # ack-only packets are never retransmitted, the frames can be reused right away
+                for frame in packet.frames:
+                    frame.release()
+
+        if probe_size is not None:
+            self.send_mtu_probe(probe_size)
+
+    def send_mtu_probe(self, probe_size: int):
+        packet_id = self.last_sent_packet_id + 1
+        padding = probe_size - Packet.Header.size - PaddingFrame.Header.size
+        packet = Packet(1, self.connection_id, packet_id, [PaddingFrame(padding)])
+        self.last_sent_packet_id = packet_id
+        self.path_mtu.on_probe_sent(packet_id, probe_size)
+        data = packet.pack()
+        t = time.time()
+        logging.info(f"sending packet {t}, packet_id = {packet_id}, {[type(frame).__name__ for frame in packet.frames]}")
+        try:
             self.connection_manager.sendto(
                 data, (self.remote_host, self.remote_port)
             )
-
-    def generate_frame(self):
+        except OSError as e:
+            if e.errno != errno.EMSGSIZE:
+                raise
+            # the probe exceeds the MTU of the local interface, no need to wait for a timeout
+            self.path_mtu.on_probe_too_large(len(data))
+            packet = self.shrink_mtu_probe(packet)
+            data = packet.pack()
+            self.connection_manager.sendto(
+                data, (self.remote_host, self.remote_port)
+            )
+        # probes are retransmitted (shrunk) like any other packet, see retransmit()
+        self.inflight_packets.add(packet, data, t)
+        if self.pacer is not None:
+            self.pacer.on_sent(len(data))
+
+    @property
+    def max_packet_size(self) -> int:
+        return self.path_mtu.packet_size
+
+    @property
+    def max_inflight_bytes(self) -> int:
+        return min(self.congestion_control.cwnd, self.peer_window)
+
+    @property
+    def slowstart_threshold(self) -> int:
+        # the threshold is lowered by the congestion control on every congestion event
+        return self.congestion_control.slowstart_threshold
+
+    @property
+    def retransmit_timeout(self) -> float:
+        return self.rtt.rto
+
+    @property
+    def inflight_bytes(self) -> int:
+        return self.inflight_packets.bytes
+
+    def retransmit(self, entry: common.InflightPacket, current_time: float):
+        # resends an inflight packet (which keeps its packet_id), the encoded packet is reused
+        if entry.packet.is_mtu_probe():
+            # a lost probe is not retransmitted as is (it was probably too large), but shrunk to
+            # an empty padding frame. the packet_id still needs to be delivered to the peer.
+            self.path_mtu.on_probe_lost(entry.packet_id)
+            shrunk_packet = self.shrink_mtu_probe(entry.packet)
+            self.inflight_packets.replace(entry, shrunk_packet, shrunk_packet.pack())
+        logging.info(f"retransmitting packet, packet_id = {entry.packet_id}, {[type(frame).__name__ for frame in entry.packet.frames]}")
+        self.inflight_packets.retransmitted(entry, current_time)
+        self.connection_manager.sendto(entry.data, (self.remote_host, self.remote_port))
+        if self.pacer is not None:
+            self.pacer.on_sent(entry.size)
+
+    def shrink_mtu_probe(self, packet: Packet) -> Packet:
+        # returns a minimal packet with the same packet_id as the given probe
+        return Packet(1, self.connection_id, packet.header.packet_id, [PaddingFrame(0)])
+
+    def update_receive_window(self, current_time: float):
+        # autotunes the receive window from the disk writes of the streams and advertises it if it changed enough.
+        # closed streams are dropped here, their bytes are no longer counted (see ReceiveWindow.update())
+        for stream_id in [stream_id for stream_id, stream in self.receive_streams.items() if stream.is_closed]:
+            del self.receive_streams[stream_id]
+        if not self.receive_streams:
+            return  # nothing is received (e.g. the server of a download), the window stays as it is
+        written = sum(stream.written_bytes() for stream in self.receive_streams.values())
+        self.flow_control.update(current_time, written, self.rtt.smoothed_rtt)
+        window = self.flow_control.available(sum(stream.write_backlog() for stream in self.receive_streams.values()))
+        # a packet without connection id has to start with a command (see handle_server_event())
+        if self.connection_id and self.flow_control.should_advertise(window):
+            logging.info(f"advertising a receive window of {window} bytes, {self.flow_control}")
+            self.queue_frame(FlowControlFrame(window), transmit_first=True)
+            self.flow_control.advertised = window
+
+    def add_stream(self, stream: common.Stream):
+        self.streams[stream.stream_id] = stream
+        if stream.direction == "r":
+            self.receive_streams[stream.stream_id] = stream
+        self.scheduler.add(stream)
+        self.connection_manager.request_flush(self)
+
+    def generate_frame(self, max_payload_size: int):
         # this function is used by the ConnectionHandler to get the next frame to be sent
-        # it is a simple pop operation on the frame queue
-        for stream in self.streams.values():
-            frame = stream.get_next_data_frame()
-            if frame is not None:
-                logging.info(f"pop_frame({type(frame)})")
-                return frame
+        # the scheduler picks the stream (round robin, by priority, ...)
+        frame = self.scheduler.next_frame(max_payload_size)
+        if frame is not None:
+            logging.info(f"pop_frame({type(frame)})")
+        return frame
 
-    def current_timeout(self, current_time) -> float:
+    def next_deadline(self, current_time) -> float:
         """
-        returns a float indicating the seconds until the next timeout occurs
-        (could be either retransmit or connection timeout)
+        returns the point in time at which the next timeout occurs
+        (could be either retransmit, connection or pacing timeout), see common/timers.py
         """
 
         # self.last_updated = recv timestamp of last seen packet from peer
-        connection_timeout = max(0, self.last_updated + self.connection_timeout - current_time)
-
-        # if there is any non-ack frame in any of the inflight packets, the time until the next timeout event is not direcly the connection timeout value, it needs to be calculated
-        if len(self.inflight_packets) != 0 and next((tp for tp in self.inflight_packets if tp[1].contains_non_ack_frame()), None) is not None:
-            # find the oldest inflight packet that contains a non-ack frame
-            oldest_inflight_packet_with_non_ack_frame_timestamp, oldest_inflight_packet_with_non_ack_frame = next((tp for tp in self.inflight_packets if tp[1].contains_non_ack_frame()), None)
-            oldest_inflight_packet_with_non_ack_frame_timeout = max(0, oldest_inflight_packet_with_non_ack_frame_timestamp + self.retransmit_timeout - current_time)
-            return min(connection_timeout, oldest_inflight_packet_with_non_ack_frame_timeout)
-        else:
-            return connection_timeout
+        deadline = self.last_updated + self.connection_timeout
+
+        # if there are inflight packets (only packets with non-ack frames are kept), the oldest one times out first
+        oldest_inflight_packet = self.inflight_packets.oldest()
+        if oldest_inflight_packet is not None:
+            deadline = min(deadline, oldest_inflight_packet.sent_time + self.retransmit_timeout)
+        if self.pacing_limited:
+            # wake up as soon as the pacer allows the next full sized packet
+            deadline = min(deadline, current_time + self.pacer.delay(self.max_packet_size))
+        if self.ack_policy.pending:
+            # the delayed ack is sent by the flush after this deadline
+            deadline = min(deadline, self.ack_policy.deadline)
+        return deadline
+
+    def current_timeout(self, current_time) -> float:
+        """
+        returns a float indicating the seconds until the next timeout occurs
+        """
+        return max(0, self.next_deadline(current_time) - current_time)
 
     def timed_out(self, current_time):
         if current_time > self.last_updated + self.connection_timeout:
             self.close()
-        if len(self.inflight_packets) > 0:
-            self.decrease_congestion_window()
-            logging.info((current_time > self.inflight_packets[0][0] + self.retransmit_timeout))
-            logging.info(next((frame for frame in self.inflight_packets[0][1].frames if type(frame) != AckFrame), None))
-            if (current_time > self.inflight_packets[0][0] + self.retransmit_timeout) and next((frame for frame in self.inflight_packets[0][1].frames if type(frame) != AckFrame), None) is not None:
+        oldest_inflight_packet = self.inflight_packets.oldest()
+        if oldest_inflight_packet is not None:
+            if current_time >= oldest_inflight_packet.sent_time + self.retransmit_timeout:
                 self.retransmit_timeout_triggered = True  # in that case, flush() needs to do retransmissions
-                
+                # a lost probe was probably too large for the path (see detect_lost_packets()), only the
+                # timeout of a regular packet is a congestion signal
+                if not oldest_inflight_packet.packet.is_mtu_probe() or any(
+                        not entry.packet.is_mtu_probe() for entry in self.inflight_packets.sent_before(current_time - self.retransmit_timeout)):
+                    self.congestion_control.on_timeout(current_time)
+
 
     def update(self, packet: Packet, addrinfo):
         # this function applies updates to the connection/streams from a packets.
 
         self.last_updated = time.time()
+        self.connection_manager.request_flush(self)
 
         if self.remote_host != addrinfo[0]:
             logging.info(
@@ -244,15 +398,32 @@ class Connection:
             logging.info("Packet dropped due to invalid checksum")
             return
 
+        # acks are processed right away, they do not need to wait for missing packets
+        for frame in packet.frames:
+            if isinstance(frame, (AckFrame, SackFrame)):
+                self.handle_ack(frame)
+
+        if not packet.contains_non_ack_frame():
+            # ack-only packets are not part of the packet_id sequence (see flush())
+            for frame in packet.frames:
+                frame.release()
+            return
+
         if packet.header.packet_id < self.next_recv_packet_id:
-            logging.info(f"Expected packet_id {self.next_recv_packet_id} but got packet_id {packet.header.packet_id}, retransmitting ACK for {self.last_ack_sent.frames[0].header.packet_id}")
-            self.connection_manager.sendto(self.last_ack_sent.pack(), (self.remote_host, self.remote_port))
+            # our ack probably got lost, send a new one right away
+            logging.info(f"Expected packet_id {self.next_recv_packet_id} but got packet_id {packet.header.packet_id}, retransmitting ACK for {self.next_recv_packet_id - 1}")
+            self.ack_policy.on_packet_received(self.last_updated, False, self.rtt.smoothed_rtt)
             return
         elif packet.header.packet_id <= self.next_recv_packet_id + self.receive_window:
+            # a packet that leaves a gap, or arrives while there is one, is acknowledged right away: the peer
+            # needs the selective ack to detect the loss, and the ack of a filled gap to stop retransmitting
+            in_order = packet.header.packet_id == self.next_recv_packet_id and len(self.receive_buffer) == 0
             if packet.header.packet_id in self.receive_buffer:
                 logging.info(f"Recieved duplicate {packet.header.packet_id})")
+                in_order = False
             else:
                 self.receive_buffer[packet.header.packet_id] = packet
+            self.ack_policy.on_packet_received(self.last_updated, in_order, self.rtt.smoothed_rtt)
         else:
             # drop the packet since it's outside of recieve window.
             logging.info(f"dropping frame (expected packet_id {self.next_recv_packet_id + self.receive_window} but got packet_id {packet.header.packet_id})")
@@ -260,31 +431,46 @@ class Connection:
 
         # TODO: detect increase/decrease of send window size.
         if self.next_recv_packet_id not in self.receive_buffer:
+            # there is a gap, the packet waits in the receive buffer
             return
 
-        need_ACK = False
         while self.next_recv_packet_id in self.receive_buffer:
             # print(self.next_recv_packet_id)
             next_packet = self.receive_buffer.pop(self.next_recv_packet_id)
             logging.info(f"Handle packet {self.next_recv_packet_id}")
             for frame in next_packet.frames:
 
-                if isinstance(frame, AckFrame):
-                    acked_packet_id = frame.header.packet_id
-                    acked_packets = [tp for tp in self.inflight_packets if tp[1].header.packet_id <= acked_packet_id]
-                    for tp in acked_packets:
-                        self.inflight_packets.remove(tp)
-                        self.inflight_bytes -= len(tp[1].pack())
-                        logging.info(f"Received ACK for packet_id {acked_packet_id}")
-                        self.increase_congestion_window()
-                self.handle_frame(frame)
-            # if the packet contained at least one frame other than AckFrame or an ExitFrame send a response
-            if next((frame for frame in next_packet.frames if type(frame) != AckFrame), None):
-                need_ACK = True
-                last_handled_packet_id = next_packet.header.packet_id
+                if isinstance(frame, FlowControlFrame):
+                    # frames are delivered in order, so this is the latest window of the peer
+                    self.peer_window = frame.header.window_size
+                elif not isinstance(frame, (PaddingFrame, AckFrame, SackFrame)):
+                    # padding is only relevant for path MTU discovery, acks were already handled above
+                    self.handle_frame(frame)
+                frame.release()
             self.next_recv_packet_id += 1
-        if need_ACK:
-            self.queue_frame(AckFrame(last_handled_packet_id), transmit_first=True)
+
+    def build_ack(self) -> AckFrame | SackFrame:
+        # acknowledges all packets up to next_recv_packet_id - 1. if there are packets waiting in the receive
+        # buffer (i.e. at least one packet is missing), they are reported in a selective ack.
+        if len(self.receive_buffer) == 0:
+            return AckFrame.create(self.next_recv_packet_id - 1)
+        return SackFrame(self.next_recv_packet_id - 1, self.received_ranges())
+
+    def queue_ack(self):
+        self.queue_frame(self.build_ack(), transmit_first=True)
+        self.ack_policy.on_ack_sent()
+
+    def received_ranges(self) -> list[tuple[int, int]]:
+        # packet_id ranges of the receive buffer, starting with the lowest ones (closest to the gap that blocks delivery)
+        ranges = []
+        for packet_id in sorted(self.receive_buffer):
+            if len(ranges) > 0 and ranges[-1][1] + 1 == packet_id:
+                ranges[-1] = (ranges[-1][0], packet_id)
+            elif len(ranges) == self.max_sack_ranges:
+                break
+            else:
+                ranges.append((packet_id, packet_id))
+        return ranges
 
     def queue_frame(self, frame: Frame, transmit_first=None):
         # server/client or connection/stream (don't know yet) can use this function
@@ -305,6 +491,8 @@ class Connection:
 
         #logging.info(f"queue_frame({type(frame)})")
 
+        self.connection_manager.request_flush(self)
+
         if transmit_first is not None:
             if transmit_first:
                 self.frame_queue.append(frame)
@@ -314,7 +502,7 @@ class Connection:
             # heuristically guess what is best based on frame type:
             if isinstance(frame, DataFrame):
                 self.frame_queue.appendleft(frame)
-            elif isinstance(frame, ReadFrame):
+            elif isinstance(frame, (ReadFrame, DeltaFrame)):
                 self.frame_queue.appendleft(frame)
             elif isinstance(frame, ChecksumFrame):
                 self.frame_queue.append(frame)
@@ -328,7 +516,7 @@ class Connection:
                 self.frame_queue.append(frame)
             elif isinstance(frame, ExitFrame):
                 self.frame_queue.append(frame)
-            elif isinstance(frame, AckFrame):
+            elif isinstance(frame, (AckFrame, SackFrame)):
                 self.frame_queue.append(frame)
             elif isinstance(frame, FlowControlFrame):
                 self.frame_queue.append(frame)
@@ -342,23 +530,56 @@ class Connection:
                 logging.warning(
                     f"Scheduled unknown frame type {frame} for transmission")
 
-    def increase_congestion_window(self):
-        if self.is_slowstart:
-            # self.max_inflight_bytes = self.max_inflight_bytes + self.max_packet_size
-            if self.max_inflight_bytes > self.slowstart_threshold:
-                self.is_slowstart = False
-            logging.info(f"Congesiton window increased quickly to {self.max_inflight_bytes}")
-        else:
-            # self.max_inflight_bytes = self.max_inflight_bytes + (self.max_packet_size * (self.max_packet_size / self.max_inflight_bytes))
-            logging.info(f"Congesiton window increased normally to {self.max_inflight_bytes}")
-
-    def decrease_congestion_window(self):
-        # self.max_inflight_bytes = max(self.max_inflight_bytes / 2, 1000)
-        logging.info(f"Congesiton window decreased to {self.max_inflight_bytes}")
+    def handle_ack(self, frame: AckFrame | SackFrame):
+        current_time = time.time()
+        acked_packets = self.inflight_packets.ack_up_to(frame.header.packet_id)
+        ranges = frame.payload.data if isinstance(frame, SackFrame) else []
+        for first, last in ranges:
+            acked_packets.extend(self.inflight_packets.ack_range(first, last))
+        if len(acked_packets) > 0:
+            self.rtt.on_ack()
+            # only the newest acknowledged packet gives a meaningful rtt sample (the ack was sent for it).
+            # if it was retransmitted, we cannot tell which transmission is acknowledged, so no sample is taken
+            newest = max(acked_packets, key=lambda entry: entry.packet_id)
+            if not newest.retransmitted:
+                self.rtt.on_sample(current_time - newest.sent_time)
+                logging.info(f"rtt sample {current_time - newest.sent_time}, {self.rtt}")
+            self.largest_acked_packet_id = max(self.largest_acked_packet_id, newest.packet_id)
+            self.latest_acked_sent_time = max(self.latest_acked_sent_time, max(entry.sent_time for entry in acked_packets))
+        for entry in acked_packets:
+            logging.info(f"Received ACK for packet_id {entry.packet_id}")
+            if entry.packet.is_mtu_probe():
+                # probes are not subject to congestion control
+                self.path_mtu.on_probe_acked(entry.packet_id)
+                self.congestion_control.max_datagram_size = self.max_packet_size
+            else:
+                self.congestion_control.on_ack(entry.size, entry.sent_time, current_time)
+            for frame in entry.packet.frames:
+                frame.release()
+        if len(ranges) > 0:
+            self.detect_lost_packets(current_time)
+
+    def detect_lost_packets(self, current_time: float):
+        # a packet is considered lost if a packet with a packet_id at least packet_reordering_threshold higher was
+        # acknowledged, and that packet was sent after the (last transmission of the) lost packet. the second
+        # condition makes sure that a retransmission is not immediately considered lost again.
+        candidates = self.inflight_packets.up_to(self.largest_acked_packet_id - self.packet_reordering_threshold)
+        for entry in candidates:
+            if entry.sent_time >= self.latest_acked_sent_time:
+                continue
+            logging.info(f"packet_id {entry.packet_id} is lost")
+            if not entry.packet.is_mtu_probe():
+                self.congestion_control.on_loss(entry.sent_time, current_time)
+            self.retransmit(entry, current_time)
 
     def close(self):
+        # the peer should not have to retransmit what arrived before the connection was closed
+        if self.ack_policy.pending:
+            self.queue_ack()
         self.flush()
         self.closed = True
+        # the connection manager removes the connection with its next flush
+        self.connection_manager.request_flush(self)
 
     def is_closed(self):
         # returns if this connection is closed
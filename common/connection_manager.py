@@ -1,7 +1,11 @@
 from __future__ import annotations
 import common
 
+import abc
+import gc
 import socket
+import struct
+import sys
 import logging
 import select
 import time
@@ -105,110 +109,328 @@ class ConnectionTerminatedEvent:
     def __init__(self, connection):
         self.connection = connection
 
-class ConnectionManager:
+class BaseConnectionManager(abc.ABC):
+    # the parts of the connection manager that do not depend on how the socket is polled: the select() loop of
+    # ConnectionManager, or the asyncio event loop of AsyncConnectionManager (see common/async_connection_manager.py)
 
-    def __init__(self, local_port=0, p = 0, q = 1, ipv6 = False):
+    # threshold of the youngest garbage collector generation while connections exist (None keeps the default).
+    # frames and packets are freed by reference counting, frequent collections of them only cost time
+    gc_threshold = 100_000
+    # in a multi process server, the highest byte of a connection id is the id of the worker that owns it
+    worker_id_shift = 24
+    # prepended to datagrams that are forwarded to another worker: source port and length of the source host
+    forward_header = struct.Struct('<HB')
+
+    def __init__(self, local_port=0, p = 0, q = 1, ipv6 = False, reuse_port = False):
         if ipv6:
             self.socket = socket.socket(socket.AF_INET6, socket.SOCK_DGRAM)
             self.socket.setsockopt(socket.IPPROTO_IPV6, socket.IPV6_V6ONLY, 0)
+            if reuse_port:
+                self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
             self.socket.bind(("", local_port))
             self.local_address, self.local_port, _, _ = self.socket.getsockname()
         else:
             self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            if reuse_port:
+                self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
             self.socket.bind(("", local_port))
             self.local_address, self.local_port = self.socket.getsockname()
         logging.debug(
             f"local address is {self.local_address} at port {self.local_port}")
+        self.set_dont_fragment(ipv6)
+        self.set_buffer_sizes()
+        self.io = common.create_datagram_io(self.socket)
 
         self.connections: dict[int, common.Connection] = {}
+        self.timers = common.TimerHeap()  # the next timeout of every connection
+        # connections that have to be flushed: their timer fired, they received a packet or queued frames
+        self.to_be_flushed: set[common.Connection] = set()
+
 
         self.p = p
         self.q = q
         self.lastSendSuccessful = True
+        self.default_gc_threshold = None  # set while the garbage collector is tuned for a running transfer
+        self.last_connection_id = 0
+
+        # only used by multi process servers, see enable_forwarding()
+        self.worker_id: int | None = None
+        self.forward_socket: socket.socket | None = None
+        self.worker_sockets: list[socket.socket] = []
+
+    def set_dont_fragment(self, ipv6: bool):
+        # path MTU discovery only works if oversized datagrams are dropped instead of being fragmented. with the
+        # DF bit set, linux also rejects datagrams larger than the local interface MTU right away with EMSGSIZE.
+        # the constants are not exported by the socket module on all python versions, hence the fallbacks.
+        if not sys.platform.startswith("linux"):
+            return
+        options = [(socket.IPPROTO_IP, getattr(socket, "IP_MTU_DISCOVER", 10), getattr(socket, "IP_PMTUDISC_DO", 2))]
+        if ipv6:
+            options.append((socket.IPPROTO_IPV6, getattr(socket, "IPV6_MTU_DISCOVER", 23), getattr(socket, "IPV6_PMTUDISC_DO", 2)))
+        for level, option, value in options:
+            try:
+                self.socket.setsockopt(level, option, value)
+            except OSError as e:
+                logging.warning(f"could not set the don't fragment option: {e}")
+
+    def set_buffer_sizes(self, size=4 * 1024 * 1024):
+        # with a growing congestion window (and up to 64 KiB datagrams on loopback) the default socket buffers
+        # only hold a handful of packets and overflow during bursts. linux silently caps the size at rmem_max/wmem_max
+        for option in (socket.SO_RCVBUF, socket.SO_SNDBUF):
+            try:
+                self.socket.setsockopt(socket.SOL_SOCKET, option, size)
+            except OSError as e:
+                logging.warning(f"could not set socket buffer size: {e}")
 
     def add_connection(self, connection: common.Connection):
         if connection.connection_id in self.connections:
             raise Exception(
                 "Cannot have two connections with the same ID at once")
         self.connections[connection.connection_id] = connection
+        self.to_be_flushed.add(connection)
 
     def remove_connection(self, connection: common.Connection):
         del self.connections[connection.connection_id]
+        self.timers.cancel(connection)
+        self.to_be_flushed.discard(connection)
+
+    def request_flush(self, connection: common.Connection):
+        # called by the connection whenever it has something to send or its deadline may have changed
+        self.to_be_flushed.add(connection)
+
+    def tune_gc(self):
+        # while a transfer is running, all objects that exist already (modules, configuration, ...) are moved to
+        # the permanent generation and the collector runs less often. the defaults are restored once idle
+        if self.gc_threshold is None:
+            return
+        running = len(self.connections) > 0
+        if running and self.default_gc_threshold is None:
+            gc.collect()
+            gc.freeze()
+            self.default_gc_threshold = gc.get_threshold()
+            gc.set_threshold(self.gc_threshold, *self.default_gc_threshold[1:])
+        elif not running and self.default_gc_threshold is not None:
+            gc.set_threshold(*self.default_gc_threshold)
+            gc.unfreeze()
+            self.default_gc_threshold = None
+
+    def enable_forwarding(self, worker_id: int, forward_socket: socket.socket, worker_sockets: list[socket.socket]):
+        # multi process server (see app/server.py): all workers bind the same port with SO_REUSEPORT and the kernel
+        # spreads the datagrams by their source address. connection ids carry the worker that owns the connection,
+        # datagrams that arrive at the wrong worker (e.g. after the client changed its address) are forwarded to
+        # the owner over a local unix socket. forward_socket receives the datagrams forwarded to this worker,
+        # worker_sockets[i] sends to worker i
+        self.worker_id = worker_id
+        self.forward_socket = forward_socket
+        self.worker_sockets = worker_sockets
 
     def next_connection_id(self):
-        return max(self.connections.keys(), default=0) + 1
-
-    def loop(self):
-
+        # connection ids are not reused (until they wrap around), so late packets of a closed connection
+        # cannot be mistaken for packets of a new one
         while True:
-            logging.info(f"number of known connections: {len(self.connections)}")
-
-            to_be_deleted = []
-            for con in self.connections.values():
-                con.flush()
-                if con.is_closed():
-                    yield ConnectionTerminatedEvent(con)
-                    to_be_deleted.append(con.connection_id)
-            for key in to_be_deleted:
-                del self.connections[key]
-
-            # timeout so that retransmissions can be handled
-            current_time = time.time()
-            timeout, timedout_connection = min([(c.current_timeout(current_time), c) for c in self.connections.values()], default=(None, None))
-            logging.info(f"select({timeout})...")
-            rlist, _, _ = select.select([self.socket], [], [], timeout)
-
-            if len(rlist) == 0:
-                # timeout occured!
-                logging.info("rlist is empty")
-                timedout_connection.timed_out(time.time())
-                continue
-
-            # 64kib is the maximum ip payload size
-            data, addrinfo = self.socket.recvfrom(65536)
-            logging.info(addrinfo)
-
-            try:
-                packet = Packet.unpack(data)
-                connection_id = packet.header.connection_id
-            except Exception as e:
-                # ignore packets that are not parseable --> read again
-                logging.error("Could not parse the packet!")
-                logging.error(str(e))
-                continue
-
-            logging.info(f"received packet: {packet.header.packet_id}")
-
-            # ignore any packet with unknown conn_id as per RFC section 5.1.2
-            if connection_id == 0:
-                # this event occurs during a handshake on the server side
-                yield ZeroConnectionIDEvent(packet, addrinfo)
-                continue
-
+            if self.worker_id is None:
+                self.last_connection_id = self.last_connection_id % (2**32 - 1) + 1
+                connection_id = self.last_connection_id
+            else:
+                self.last_connection_id = self.last_connection_id % (2**self.worker_id_shift - 1) + 1
+                connection_id = self.worker_id << self.worker_id_shift | self.last_connection_id
             if connection_id not in self.connections:
-                # this event occurs during a handshake on the client side
-                yield UnknownConnectionIDEvent(packet, addrinfo)
-                continue
-
-            # check if the connection is created thruough the event above
-            # it may not be as the client may ignore the event
-            if connection_id in self.connections:
-                logging.info(f"updating connection with id {connection_id}")
-                self.connections[connection_id].update(packet, addrinfo)
+                return connection_id
+
+    @abc.abstractmethod
+    def wake(self, connection: common.Connection):
+        # thread safe: other threads (e.g. the checksum pool of the server) request a flush of the connection
+        ...
+
+    def flush_connections(self):
+        # lets the connections that requested a flush send what they can, closed connections are removed.
+        # all other connections did not change since their last flush, their timers are still up to date
+        to_be_deleted = []
+        current_time = time.time()
+        connections, self.to_be_flushed = self.to_be_flushed, set()
+        for con in connections:
+            if self.connections.get(con.connection_id) is not con:
+                continue  # not added yet, or removed already
+            con.flush()
+            # frames that were queued by the flush itself were sent, or wait for an ack or a timer
+            self.to_be_flushed.discard(con)
+            if con.is_closed():
+                to_be_deleted.append(con)
+            else:
+                # the deadline only changes if the connection sent or received something, or its timer fired
+                self.timers.schedule(con, con.next_deadline(current_time))
+        # the events are only yielded once all connections were flushed, the caller may stop the loop on one
+        for con in to_be_deleted:
+            yield ConnectionTerminatedEvent(con)
+        for con in to_be_deleted:
+            self.remove_connection(con)
+        self.tune_gc()
+
+    def next_timeout(self) -> tuple[float | None, common.Connection | None]:
+        # seconds until the next timeout (retransmission, pacing, ...) and the connection it belongs to
+        deadline, connection = self.timers.next()
+        if deadline is None:
+            return None, None
+        return max(0, deadline - time.time()), connection
+
+    def fire_timers(self, current_time):
+        # lets every connection whose deadline has passed handle its timeouts, the next flush reschedules them
+        for connection in self.timers.pop_due(current_time):
+            connection.timed_out(current_time)
+            self.to_be_flushed.add(connection)
+
+    def forward(self, worker_id: int, data: bytes, addrinfo: tuple):
+        host = addrinfo[0].encode()
+        try:
+            self.worker_sockets[worker_id].send(
+                self.forward_header.pack(addrinfo[1], len(host)) + host + data, socket.MSG_DONTWAIT)
+        except OSError as e:
+            # the other worker is overloaded (or gone), the datagram is lost like any other udp datagram
+            logging.warning(f"could not forward datagram to worker {worker_id}: {e}")
+
+    def receive_forwarded(self) -> list[tuple[bytes, tuple]]:
+        datagrams = []
+        while len(datagrams) < self.io.batch_size:
+            try:
+                message = self.forward_socket.recv(self.io.max_datagram_size + 512, socket.MSG_DONTWAIT)
+            except (BlockingIOError, InterruptedError):
+                break
+            port, host_length = self.forward_header.unpack_from(message)
+            start = self.forward_header.size
+            host = message[start:start + host_length].decode()
+            datagrams.append((message[start + host_length:], (host, port)))
+        return datagrams
+
+    def handle_datagram(self, data: bytes, addrinfo: tuple, forwarded: bool = False):
+        logging.info(addrinfo)
+
+        if self.worker_id is not None and not forwarded and len(data) >= Packet.Header.size:
+            # only the connection id is read here, the owning worker parses the packet. new connections
+            # (connection id 0) are accepted by whichever worker received the packet
+            connection_id, = struct.unpack_from('<I', data, 1)
+            owner = connection_id >> self.worker_id_shift
+            if connection_id != 0 and owner != self.worker_id:
+                if owner < len(self.worker_sockets):
+                    self.forward(owner, data, addrinfo)
+                return
+
+        try:
+            packet = Packet.unpack(data)
+            connection_id = packet.header.connection_id
+        except Exception as e:
+            # ignore packets that are not parseable --> read again
+            logging.error("Could not parse the packet!")
+            logging.error(str(e))
+            return
+
+        logging.info(f"received packet: {packet.header.packet_id}")
+
+        # ignore any packet with unknown conn_id as per RFC section 5.1.2
+        if connection_id == 0:
+            # this event occurs during a handshake on the server side
+            yield ZeroConnectionIDEvent(packet, addrinfo)
+            return
+
+        if connection_id not in self.connections:
+            # this event occurs during a handshake on the client side
+            yield UnknownConnectionIDEvent(packet, addrinfo)
+            return
+
+        # check if the connection is created thruough the event above
+        # it may not be as the client may ignore the event
+        if connection_id in self.connections:
+            logging.info(f"updating connection with id {connection_id}")
+            self.connections[connection_id].update(packet, addrinfo)
 
     def sendto(self, data, address):
         #self.socket.sendto(data, address)
         #return
+        if not self.simulate_loss():
+            self.socket.sendto(data, self.io.resolve(address))
+
+    def sendmany(self, datagrams: list, address):
+        # sends all datagrams with as few system calls as possible, the loss simulation applies to each datagram
+        self.io.sendmany([data for data in datagrams if not self.simulate_loss()], address)
+
+    def simulate_loss(self) -> bool:
+        # returns True if the next datagram is dropped (gilbert-elliott model with the parameters p and q)
         logging.info(f"p: {self.p}, q: {self.q}")
         if self.lastSendSuccessful:
             if random.uniform(0, 1) >= self.p: # 1 - p
-                self.socket.sendto(data, address)
+                return False
             else:
                 self.lastSendSuccessful = False
+                return True
         else:
             if random.uniform(0, 1) >= self.q: # 1 - q
                 self.lastSendSuccessful = True
-                self.socket.sendto(data, address)
+                return False
             else:
+                return True
+
+
+class ConnectionManager(BaseConnectionManager):
+    # runs the connections with a blocking select() loop, see loop()
+
+    def __init__(self, local_port=0, p = 0, q = 1, ipv6 = False, reuse_port = False):
+        super().__init__(local_port, p, q, ipv6, reuse_port)
+        # other threads (e.g. the checksum pool of the server) wake up the loop through this socket pair,
+        # the connections they woke up are passed in the queue (see wake())
+        self.wakeup_receiver, self.wakeup_sender = socket.socketpair()
+        self.wakeup_receiver.setblocking(False)
+        self.wakeup_sender.setblocking(False)
+        self.woken_connections: queue.SimpleQueue = queue.SimpleQueue()
+
+    def close(self):
+        # closes the socket, the connections are not notified
+        self.socket.close()
+        self.wakeup_receiver.close()
+        self.wakeup_sender.close()
+
+    def loop(self):
+
+        while True:
+            logging.info(f"number of known connections: {len(self.connections)}")
+
+            yield from self.flush_connections()
+
+            # timeout so that retransmissions can be handled
+            timeout, _ = self.next_timeout()
+            logging.info(f"select({timeout})...")
+            readable = [self.socket, self.wakeup_receiver] if self.forward_socket is None else [self.socket, self.wakeup_receiver, self.forward_socket]
+            rlist, _, _ = select.select(readable, [], [], timeout)
+
+            # all timers that are due fire now, also if datagrams arrived in the meantime
+            self.fire_timers(time.time())
+            if len(rlist) == 0:
+                # timeout occured!
+                logging.info("rlist is empty")
+                continue
+
+            if self.wakeup_receiver in rlist:
+                self.receive_wakeups()
+
+            # all datagrams that are waiting are received at once, the connections are flushed afterwards
+            if self.socket in rlist:
+                for data, addrinfo in self.io.recvmany():
+                    yield from self.handle_datagram(data, addrinfo)
+            if self.forward_socket is not None and self.forward_socket in rlist:
+                for data, addrinfo in self.receive_forwarded():
+                    yield from self.handle_datagram(data, addrinfo, forwarded=True)
+
+    def wake(self, connection: common.Connection):
+        # thread safe: the connection is flushed by the next iteration of the loop
+        self.woken_connections.put(connection)
+        try:
+            self.wakeup_sender.send(b"\0")
+        except (BlockingIOError, InterruptedError):
+            pass  # the loop is woken up already
+
+    def receive_wakeups(self):
+        try:
+            while self.wakeup_receiver.recv(4096):
                 pass
-        
\ No newline at end of file
+        except (BlockingIOError, InterruptedError):
+            pass
+        while not self.woken_connections.empty():
+            self.request_flush(self.woken_connections.get())
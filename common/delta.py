@@ -0,0 +1,316 @@
+from __future__ import annotations
+
+from common.compression import OrderedDecoder
+
+import hashlib
+import logging
+import math
+import os
+import struct
+import zlib
+
+"""
+
+Delta transfer (rsync algorithm) for files that exist on the client already, but may have changed
+anywhere. Instead of the whole file, only the parts that the client does not have are sent:
+
+1. the client splits its copy (the basis) into blocks of block_size bytes and sends a signature
+   per block: the adler32 checksum (weak, can be rolled over the data byte by byte) and a 16 byte
+   blake2b hash (strong). The signatures follow a DeltaFrame as DataFrames of the same stream
+2. the server looks for blocks of the basis in its file. The weak checksum is rolled over the
+   file, a position whose weak checksum is known is confirmed with the strong hash
+3. the server sends a stream of records: copy records (block n to m of the basis) and literal
+   records (data the basis does not contain). The records have their own offset space
+4. the client rebuilds the file into a temporary file from the basis and the literal data, and
+   replaces the basis once the sha256 of the whole file matches. The basis stays untouched if
+   anything goes wrong
+
+The weak checksum is rolled in python, which is much slower than the blocks that are checked with
+zlib. A region that does not match anything within one block of positions is most likely new
+data: the server then skips ahead block by block (up to max_skip_blocks at a time, doubling after
+every failed search) and searches again. Matches right behind a changed region can be missed
+this way, they are sent as literal data instead.
+
+The file is read with pread, one window of input_size bytes (plus one block) per step, and the
+literal data again once its record is written. It is not mapped into memory: a mapped file that is
+truncated during the transfer raises SIGBUS and kills the whole server. A short read is the end of
+the file instead (the client then fails the sha256 check and keeps its basis).
+
+"""
+
+weak_modulus = 65521  # the adler32 modulus
+signature_entry = struct.Struct('<I16s')  # weak checksum, strong hash
+
+op_copy = 0
+op_literal = 1
+copy_record = struct.Struct('<BQI')  # op, first block of the basis, number of blocks
+literal_record = struct.Struct('<BI')  # op, length of the literal data that follows
+
+
+def strong_hash(data) -> bytes:
+    return hashlib.blake2b(data, digest_size=16).digest()
+
+
+def choose_block_size(size: int) -> int:
+    # about the square root of the file size (as rsync), so that the signatures and the literal data
+    # of a small change both stay small. a power of two between 4 KiB and 1 MiB
+    if size <= 0:
+        return 4096
+    return 1 << max(12, min(20, math.ceil(math.log2(math.sqrt(size)))))
+
+
+def compute_signature(path: str, block_size: int) -> bytes:
+    signature = bytearray()
+    with open(path, "rb") as file:
+        while block := file.read(block_size):
+            signature += signature_entry.pack(zlib.adler32(block), strong_hash(block))
+    return bytes(signature)
+
+
+class Signatures:
+    # the signatures of the basis as received by the server, the DataFrames may arrive in any order
+
+    def __init__(self, block_size: int, length: int) -> None:
+        if length % signature_entry.size:
+            raise ValueError(f"invalid signature length {length}")
+        self.block_size = block_size
+        self.data = bytearray(length)
+        self.received = 0
+        self.offsets: set[int] = set()
+
+    def __repr__(self) -> str:
+        return f"Signatures(block_size={self.block_size}, received={self.received}/{len(self.data)})"
+
+    def write(self, offset: int, data) -> None:
+        if offset in self.offsets:
+            return  # duplicate
+        if offset + len(data) > len(self.data):
+            raise ValueError("signature data beyond the announced length")
+        self.offsets.add(offset)
+        self.data[offset:offset + len(data)] = data
+        self.received += len(data)
+
+    @property
+    def complete(self) -> bool:
+        return self.received >= len(self.data)
+
+    def table(self) -> dict[int, dict[bytes, int]]:
+        # weak checksum -> strong hash -> block index (the first block if the basis contains a block more than once)
+        table: dict[int, dict[bytes, int]] = {}
+        for index, (weak, strong) in enumerate(signature_entry.iter_unpack(self.data)):
+            table.setdefault(weak, {}).setdefault(strong, index)
+        return table
+
+
+class DeltaReader:
+    # produces the records of the delta of the file at path against the basis described by signatures.
+    # read() is used like ReadAheadReader.read(), offsets are offsets of the records and must not go backwards
+    input_size = 1024 * 1024  # bytes of the file that are processed per step
+    literal_size = 1024 * 1024  # longer literal data is split into several records
+    max_skip_blocks = 64
+
+    def __init__(self, path: str, signatures: Signatures) -> None:
+        self.fd = os.open(path, os.O_RDONLY)
+        self.size = os.fstat(self.fd).st_size
+        if hasattr(os, "posix_fadvise"):
+            os.posix_fadvise(self.fd, 0, 0, os.POSIX_FADV_SEQUENTIAL)
+        # the part of the file that the current step works on, window[0] is at window_offset
+        self.window = b""
+        self.window_offset = 0
+        self.block_size = signatures.block_size
+        self.table = signatures.table()
+
+        self.position = 0  # start of the window that is checked next
+        self.literal_start = 0  # data from here up to position is not covered by a record yet
+        self.copy_start = 0  # pending copy record (consecutive blocks are merged into one record)
+        self.copy_count = 0
+        self.weak: int | None = None  # weak checksum of the window at position, None if it has to be computed
+        self.search_left = self.block_size  # positions that are searched byte by byte before skipping ahead
+        self.skip_blocks = 1
+        self.finished = False
+        # records that were not read yet, output[0] is at output_offset
+        self.output = bytearray()
+        self.output_offset = 0
+        self.literal_bytes = 0  # statistics
+        self.copied_bytes = 0
+
+    def __repr__(self) -> str:
+        return f"DeltaReader(position={self.position}, literal_bytes={self.literal_bytes}, copied_bytes={self.copied_bytes})"
+
+    def read(self, offset: int, length: int) -> bytes:
+        # up to length bytes of records at offset, empty once all of them were read
+        if offset < self.output_offset:
+            raise ValueError(f"delta data at {offset} was read already")
+        del self.output[:offset - self.output_offset]
+        self.output_offset = offset
+        while len(self.output) < length and not self.finished:
+            self.step()
+        # a copy, output changes with the next read
+        return bytes(self.output[:length])
+
+    def remaining_bytes(self) -> int:
+        return max(0, self.size - self.position)
+
+    def pread(self, offset: int, length: int) -> bytes:
+        data = os.pread(self.fd, length, offset)
+        if len(data) < length:
+            # the file was truncated, it ends here now
+            self.size = offset + len(data)
+        return data
+
+    def match(self, start: int, end: int, weak: int) -> int | None:
+        candidates = self.table.get(weak)
+        if candidates is None:
+            return None
+        return candidates.get(strong_hash(self.window[start - self.window_offset:end - self.window_offset]))
+
+    def step(self) -> None:
+        block_size = self.block_size
+        # positions up to end are checked, the window also holds the block that starts at the last one
+        end = min(self.size, self.position + self.input_size)
+        self.window_offset = self.position
+        self.window = self.pread(self.position, min(self.size, end + block_size) - self.position)
+        data, base, size = self.window, self.window_offset, self.size
+        end = min(end, size)
+        while self.position < end and self.size == size:
+            position = self.position
+            if size - position < block_size:
+                # the last block of the basis may be shorter, it can only match the end of the file
+                index = self.match(position, size, zlib.adler32(data[position - base:size - base]))
+                if index is not None:
+                    self.add_copy(index, size - position)
+                self.position = size
+                break
+
+            if self.weak is None:
+                self.weak = zlib.adler32(data[position - base:position - base + block_size])
+            index = self.match(position, position + block_size, self.weak)
+            if index is not None:
+                self.add_copy(index, block_size)
+                self.position += block_size
+                self.weak = None
+                self.search_left = block_size
+                self.skip_blocks = 1
+                continue
+
+            if self.search_left > 0 and position + block_size < size:
+                # roll the weak checksum until a known one (or the end of the search) is reached
+                a, b = self.weak & 0xFFFF, self.weak >> 16
+                table = self.table
+                # the search stops at the end of the window and continues with the next step
+                steps = min(self.search_left, size - block_size - position, end - position)
+                last = position + steps
+                while position < last:
+                    out, new = data[position - base], data[position - base + block_size]
+                    a = (a - out + new) % weak_modulus
+                    b = (b - block_size * out + a - 1) % weak_modulus
+                    position += 1
+                    if (b << 16 | a) in table:
+                        break
+                self.search_left -= position - self.position
+                self.position = position
+                self.weak = b << 16 | a
+            else:
+                # nothing within one block of positions, skip ahead
+                self.position = min(size, position + self.skip_blocks * block_size)
+                self.skip_blocks = min(2 * self.skip_blocks, self.max_skip_blocks)
+                self.search_left = block_size
+                self.weak = None
+
+            if self.position - self.literal_start >= self.literal_size:
+                self.add_literal(self.position)
+
+        if self.position >= self.size or self.size < size:
+            # the end of the file, or it was truncated while literal data was read
+            self.position = min(self.position, self.size)
+            self.add_literal(self.size)
+            self.add_pending_copy()
+            self.finished = True
+
+    def add_copy(self, index: int, length: int) -> None:
+        self.add_literal(self.position)
+        if self.copy_count and index == self.copy_start + self.copy_count:
+            self.copy_count += 1
+        else:
+            self.add_pending_copy()
+            self.copy_start, self.copy_count = index, 1
+        self.copied_bytes += length
+        self.literal_start = self.position + length
+
+    def add_pending_copy(self) -> None:
+        if self.copy_count:
+            self.output += copy_record.pack(op_copy, self.copy_start, self.copy_count)
+            self.copy_count = 0
+
+    def add_literal(self, end: int) -> None:
+        if end <= self.literal_start:
+            return
+        self.add_pending_copy()
+        data = self.pread(self.literal_start, end - self.literal_start)
+        self.output += literal_record.pack(op_literal, len(data))
+        self.output += data
+        self.literal_bytes += len(data)
+        self.literal_start += len(data)
+
+    def close(self) -> None:
+        if self.fd is None:
+            return
+        logging.info(f"delta: {self.literal_bytes} bytes of literal data, {self.copied_bytes} bytes copied from the basis")
+        self.output = bytearray()
+        self.window = b""
+        os.close(self.fd)
+        self.fd = None
+
+
+class DeltaDecoder(OrderedDecoder):
+    # rebuilds the file from the basis and the records of the server
+    copy_size = 1024 * 1024  # copied blocks are read in pieces of this size
+
+    def __init__(self, basis_path: str, block_size: int) -> None:
+        super().__init__()
+        self.basis = os.open(basis_path, os.O_RDONLY)
+        self.block_size = block_size
+        self.buffer = bytearray()  # records that are not complete yet
+        self.literal_left = 0  # literal data of the current record that did not arrive yet
+        self.output_offset = 0
+
+    def __repr__(self) -> str:
+        return f"DeltaDecoder(input_offset={self.input_offset}, output_offset={self.output_offset}, pending={len(self.pending)})"
+
+    def decode(self, data):
+        self.buffer += data
+        while self.buffer:
+            if self.literal_left:
+                piece = bytes(self.buffer[:self.literal_left])
+                del self.buffer[:len(piece)]
+                self.literal_left -= len(piece)
+                yield self.output_offset, piece
+                self.output_offset += len(piece)
+            elif self.buffer[0] == op_literal:
+                if len(self.buffer) < literal_record.size:
+                    return
+                _, self.literal_left = literal_record.unpack_from(self.buffer)
+                del self.buffer[:literal_record.size]
+            elif self.buffer[0] == op_copy:
+                if len(self.buffer) < copy_record.size:
+                    return
+                _, index, count = copy_record.unpack_from(self.buffer)
+                del self.buffer[:copy_record.size]
+                yield from self.copy(index * self.block_size, count * self.block_size)
+            else:
+                raise ValueError(f"invalid delta record {self.buffer[0]}")
+
+    def copy(self, offset: int, length: int):
+        end = offset + length
+        while offset < end:
+            piece = os.pread(self.basis, min(self.copy_size, end - offset), offset)
+            if not piece:
+                break  # the last block of the basis is shorter
+            yield self.output_offset, piece
+            self.output_offset += len(piece)
+            offset += len(piece)
+
+    def close(self) -> None:
+        if self.basis is not None:
+            os.close(self.basis)
+            self.basis = None
@@ -0,0 +1,60 @@
+"""
+
+Receiver-driven flow control. The congestion window only protects the network: a receiver whose
+disk is slower than the path buffers the difference in the write-behind queue of its streams
+(see common/writer.py) until the event loop blocks on it, and then drops packets. Instead, every
+connection advertises how many bytes it accepts in a FlowControlFrame, and the sender keeps at
+most min(cwnd, advertised window) bytes in flight (see Connection.max_inflight_bytes).
+
+The window is autotuned like the receive buffer of linux tcp (dynamic right sizing): once per
+round trip (at least every min_interval seconds) the bytes that were written to disk in that
+time are measured, and the window grows to growth times the bytes written per round trip. As
+long as the disk keeps up, the window doubles every round trip like the congestion window in
+slow start, high bandwidth-delay paths therefore get large windows. The window never shrinks.
+
+The advertised window is the tuned window minus the bytes that were received but not written yet
+(at least min_window, so the sender never stalls completely). A slow disk thus closes the window,
+and the sender is held back instead of overflowing the receiver. A new window is only advertised
+if it differs by at least a quarter from the last one. Until the first FlowControlFrame arrives,
+the peer assumes initial_window.
+
+"""
+
+
+class ReceiveWindow:
+    initial_window = 4 * 1024 * 1024  # bytes
+    min_window = 256 * 1024
+    max_window = 256 * 1024 * 1024  # FlowControlFrame can carry up to 4 GiB
+    growth = 2
+    min_interval = 0.05  # seconds, the disk writes in chunks (see FileWriter.coalesce_size), shorter measurements are too bursty
+
+    def __init__(self) -> None:
+        self.window = self.initial_window
+        self.advertised = self.initial_window
+        self.interval_start: float | None = None
+        self.interval_written = 0  # bytes written by the streams at interval_start
+
+    def __repr__(self) -> str:
+        return f"ReceiveWindow(window={self.window}, advertised={self.advertised})"
+
+    def update(self, current_time: float, written: int, smoothed_rtt: float | None) -> None:
+        # written is the number of bytes that the streams of the connection wrote to disk so far
+        if smoothed_rtt is None:
+            return
+        if self.interval_start is None or written < self.interval_written:
+            # first measurement, or a stream finished (and its bytes are no longer counted)
+            self.interval_start, self.interval_written = current_time, written
+            return
+        elapsed = current_time - self.interval_start
+        if elapsed < max(smoothed_rtt, self.min_interval):
+            return
+        written_per_rtt = (written - self.interval_written) * smoothed_rtt / elapsed
+        self.window = min(self.max_window, max(self.window, int(self.growth * written_per_rtt)))
+        self.interval_start, self.interval_written = current_time, written
+
+    def available(self, backlog: int) -> int:
+        # the window that is advertised while backlog bytes wait to be written
+        return max(self.min_window, self.window - backlog)
+
+    def should_advertise(self, window: int) -> bool:
+        return abs(window - self.advertised) >= self.advertised // 4
@@ -0,0 +1,124 @@
+from __future__ import annotations
+
+from packet import Packet
+from collections import OrderedDict
+
+import bisect
+
+"""
+
+Bookkeeping of the packets that were sent but not acknowledged yet (packet cache for retransmissions).
+
+Every inflight packet is stored once together with its encoded bytes, so that retransmissions and
+the inflight byte accounting never have to encode a packet again. Three indices are kept:
+
+packets:     packet_id -> InflightPacket, for lookups
+packet_ids:  sorted list of the inflight packet_ids, for cumulative and selective (range) acks
+by_time:     packet_ids ordered by the time of their last transmission, for retransmission timeouts
+
+Lookups and finding the oldest packet are O(1), finding the packets of an ack range is O(log n)
+(plus the packets that are actually acknowledged).
+
+"""
+
+
+class InflightPacket:
+    __slots__ = ("packet", "data", "size", "sent_time", "retransmitted")
+
+    def __init__(self, packet: Packet, data: bytes, sent_time: float) -> None:
+        self.packet = packet
+        self.data = data  # the encoded packet, as it was sent
+        self.size = len(data)
+        self.sent_time = sent_time  # time of the last transmission
+        self.retransmitted = False
+
+    @property
+    def packet_id(self) -> int:
+        return self.packet.header.packet_id
+
+
+class InflightPackets:
+
+    def __init__(self) -> None:
+        self.packets: dict[int, InflightPacket] = {}
+        self.packet_ids: list[int] = []
+        self.by_time: OrderedDict[int, None] = OrderedDict()
+        self.bytes = 0  # sum of the sizes of all inflight packets
+
+    def __len__(self) -> int:
+        return len(self.packets)
+
+    def __iter__(self):
+        # iterates in packet_id order
+        return (self.packets[packet_id] for packet_id in self.packet_ids)
+
+    def __contains__(self, packet_id: int) -> bool:
+        return packet_id in self.packets
+
+    def add(self, packet: Packet, data: bytes, sent_time: float) -> InflightPacket:
+        entry = InflightPacket(packet, data, sent_time)
+        packet_id = entry.packet_id
+        if len(self.packet_ids) == 0 or self.packet_ids[-1] < packet_id:
+            # the common case, packet_ids are increasing
+            self.packet_ids.append(packet_id)
+        else:
+            bisect.insort(self.packet_ids, packet_id)
+        self.packets[packet_id] = entry
+        self.by_time[packet_id] = None
+        self.bytes += entry.size
+        return entry
+
+    def replace(self, entry: InflightPacket, packet: Packet, data: bytes) -> None:
+        # swaps the packet of an entry for another packet with the same packet_id (used for shrinking mtu probes)
+        self.bytes += len(data) - entry.size
+        entry.packet = packet
+        entry.data = data
+        entry.size = len(data)
+
+    def retransmitted(self, entry: InflightPacket, sent_time: float) -> None:
+        entry.sent_time = sent_time
+        entry.retransmitted = True
+        self.by_time.move_to_end(entry.packet_id)
+
+    def oldest(self) -> InflightPacket | None:
+        # the packet with the oldest (last) transmission
+        if len(self.by_time) == 0:
+            return None
+        return self.packets[next(iter(self.by_time))]
+
+    def sent_before(self, deadline: float) -> list[InflightPacket]:
+        # all packets whose last transmission happened before the deadline, oldest first
+        entries = []
+        for packet_id in self.by_time:
+            entry = self.packets[packet_id]
+            if entry.sent_time >= deadline:
+                break
+            entries.append(entry)
+        return entries
+
+    def ack_range(self, first: int, last: int) -> list[InflightPacket]:
+        # removes and returns all packets with first <= packet_id <= last
+        start = bisect.bisect_left(self.packet_ids, first)
+        end = bisect.bisect_right(self.packet_ids, last, lo=start)
+        if start == end:
+            return []
+        acked_packet_ids = self.packet_ids[start:end]
+        del self.packet_ids[start:end]
+        entries = []
+        for packet_id in acked_packet_ids:
+            entry = self.packets.pop(packet_id)
+            del self.by_time[packet_id]
+            self.bytes -= entry.size
+            entries.append(entry)
+        return entries
+
+    def ack_up_to(self, packet_id: int) -> list[InflightPacket]:
+        # removes and returns all packets with packet_id <= the given packet_id (cumulative ack)
+        if len(self.packet_ids) == 0:
+            return []
+        return self.ack_range(self.packet_ids[0], packet_id)
+
+    def up_to(self, packet_id: int) -> list[InflightPacket]:
+        # all packets with packet_id <= the given packet_id (without removing them)
+        end = bisect.bisect_right(self.packet_ids, packet_id)
+        return [self.packets[packet_id] for packet_id in self.packet_ids[:end]]
@@ -0,0 +1,158 @@
+from __future__ import annotations
+
+from collections import OrderedDict
+
+import os
+import stat
+import time
+
+"""
+
+Metadata cache of the server. Every ReadFrame, StatFrame, ChecksumFrame and ListFrame needs the
+metadata of a path, and clients that fetch a whole directory ask for the same paths over and over.
+The cache keeps
+
+- the stat result of a path (or that it does not exist) for ttl seconds
+- the listing of a directory, read with a single os.scandir(). After ttl seconds the listing is
+  only read again if the mtime of the directory changed (i.e. entries were added, removed or
+  renamed), otherwise one stat of the directory keeps it valid for another ttl seconds
+
+- the sha256 digest of a file for a ChecksumFrame without a stream, as long as the size and the
+  mtime of the file do not change (hashing reads the whole file, see ServerConnection)
+
+A listing only stats its regular files (their size and mtime are listed), and not even those if
+their stat result is still cached. Directories and other entries are listed with the type that
+os.scandir() reports from the directory itself, without size, mtime and permissions. The stat
+results of the files of a listing are stored as well, so the reads that follow a LIST do not stat
+their files again. STAT and the commands that read a file see changes of the file
+after at most ttl seconds. The sizes and mtimes in a listing that was kept valid by the mtime of
+its directory can be older: writing to a file does not change the mtime of its directory.
+
+"""
+
+
+class DirectoryEntry:
+    __slots__ = ("name", "size", "mtime_ns", "mode")
+
+    def __init__(self, name: str, size: int, mtime_ns: int, mode: int) -> None:
+        self.name = name
+        self.size = size
+        self.mtime_ns = mtime_ns
+        self.mode = mode
+
+    def __repr__(self) -> str:
+        return f"DirectoryEntry(name={self.name}, size={self.size}, mtime_ns={self.mtime_ns}, mode={oct(self.mode)})"
+
+
+class MetadataCache:
+    ttl = 1.0  # seconds
+    max_entries = 4096  # stat results, the least recently used ones are evicted
+    max_listings = 256
+    max_checksums = 256
+
+    def __init__(self) -> None:
+        # path -> (time of the stat, stat result or None if the path does not exist)
+        self.stats: OrderedDict[str, tuple[float, os.stat_result | None]] = OrderedDict()
+        # path -> (time of the check, mtime_ns of the directory, entries sorted by name)
+        self.listings: OrderedDict[str, tuple[float, int, list[DirectoryEntry]]] = OrderedDict()
+        # path -> (size, mtime_ns, sha256 digest of the file)
+        self.checksums: OrderedDict[str, tuple[int, int, bytes]] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __repr__(self) -> str:
+        return f"MetadataCache(stats={len(self.stats)}, listings={len(self.listings)}, hits={self.hits}, misses={self.misses})"
+
+    def stat(self, path: str) -> os.stat_result | None:
+        # the stat result of path (following symlinks), None if it does not exist
+        now = time.monotonic()
+        cached = self.stats.get(path)
+        if cached is not None and now - cached[0] < self.ttl:
+            self.stats.move_to_end(path)
+            self.hits += 1
+            return cached[1]
+        self.misses += 1
+        try:
+            result = os.stat(path)
+        except OSError:  # does not exist, or is not accessible
+            result = None
+        self.store(path, now, result)
+        return result
+
+    def store(self, path: str, now: float, result: os.stat_result | None) -> None:
+        self.stats[path] = (now, result)
+        self.stats.move_to_end(path)
+        if len(self.stats) > self.max_entries:
+            self.stats.popitem(last=False)
+
+    def checksum(self, path: str, result: os.stat_result) -> bytes | None:
+        # the digest of the file at path, None if it was not hashed since it last changed (result is its stat result)
+        cached = self.checksums.get(path)
+        if cached is None or cached[0] != result.st_size or cached[1] != result.st_mtime_ns:
+            return None
+        self.checksums.move_to_end(path)
+        self.hits += 1
+        return cached[2]
+
+    def store_checksum(self, path: str, result: os.stat_result, digest: bytes) -> None:
+        self.checksums[path] = (result.st_size, result.st_mtime_ns, digest)
+        self.checksums.move_to_end(path)
+        if len(self.checksums) > self.max_checksums:
+            self.checksums.popitem(last=False)
+
+    def list(self, path: str) -> list[DirectoryEntry] | None:
+        # the entries of the directory at path, None if it is not a directory
+        directory = self.stat(path)
+        if directory is None or not stat.S_ISDIR(directory.st_mode):
+            return None
+        now = time.monotonic()
+        cached = self.listings.get(path)
+        if cached is not None and now - cached[0] < self.ttl:
+            self.listings.move_to_end(path)
+            self.hits += 1
+            return cached[2]
+        if cached is not None and cached[1] == directory.st_mtime_ns:
+            # no entries were added or removed
+            self.listings[path] = (now, cached[1], cached[2])
+            self.listings.move_to_end(path)
+            self.hits += 1
+            return cached[2]
+        self.misses += 1
+
+        entries = []
+        try:
+            with os.scandir(path) as iterator:
+                for entry in iterator:
+                    entry_path = os.path.join(path, entry.name)
+                    try:
+                        if not entry.is_file():
+                            # the type from the directory is enough, directories and special files are not fetched
+                            entries.append(DirectoryEntry(entry.name, 0, 0, self.entry_type(entry)))
+                            continue
+                        # only files are stated (for their size and mtime), unless their stat result is still cached
+                        cached = self.stats.get(entry_path)
+                        if cached is not None and cached[1] is not None and now - cached[0] < self.ttl:
+                            result = cached[1]
+                        else:
+                            result = entry.stat()
+                            self.store(entry_path, now, result)
+                    except OSError:
+                        continue  # removed in the meantime
+                    entries.append(DirectoryEntry(entry.name, result.st_size, result.st_mtime_ns, result.st_mode))
+        except OSError:  # not readable
+            return None
+        entries.sort(key=lambda entry: entry.name)
+        self.listings[path] = (now, directory.st_mtime_ns, entries)
+        self.listings.move_to_end(path)
+        if len(self.listings) > self.max_listings:
+            self.listings.popitem(last=False)
+        return entries
+
+    @staticmethod
+    def entry_type(entry: os.DirEntry) -> int:
+        # the file type bits of an entry that is not a regular file, from the directory itself (d_type on linux)
+        if entry.is_dir():
+            return stat.S_IFDIR
+        if entry.is_symlink():
+            return stat.S_IFLNK  # a broken symlink
+        return 0  # another type (fifo, socket, device), only known from a stat
@@ -0,0 +1,63 @@
+"""
+
+Packet pacing. Without pacing, a connection sends everything the congestion window allows in
+a single burst, which overflows socket and router buffers and causes losses that the connection
+inflicted on itself. The pacer is a token bucket that is refilled at
+
+    rate = gain * cwnd / smoothed_rtt
+
+i.e. the congestion window is spread over a round trip. The gain (> 1) makes sure that pacing
+never limits the window growth: in slow start the window doubles every round trip, hence the
+higher gain (like linux does). A burst of burst_packets full sized packets may always be sent
+back to back, which keeps the number of wakeups (and system calls) per round trip low.
+
+The connection limits each flush to budget() bytes and, if the pacer prevented it from sending
+everything, asks delay() when the next packet may be sent (see Connection.next_deadline()).
+
+"""
+
+
+class Pacer:
+    slowstart_gain = 2
+    congestion_avoidance_gain = 1.25
+    burst_packets = 10
+
+    def __init__(self) -> None:
+        self.rate = None  # bytes per second, None until the first rtt sample (the initial window is not paced)
+        self.capacity = 0
+        self.tokens = 0
+        self.last_update = None
+
+    def __repr__(self) -> str:
+        return f"Pacer(rate={self.rate}, tokens={self.tokens}, capacity={self.capacity})"
+
+    def update(self, cwnd: int, smoothed_rtt: float | None, is_slowstart: bool, max_packet_size: int, now: float) -> None:
+        # refills the bucket for the time since the last update, with the rate of the current window
+        if smoothed_rtt is None or smoothed_rtt <= 0:
+            self.rate = None
+            return
+        gain = self.slowstart_gain if is_slowstart else self.congestion_avoidance_gain
+        self.capacity = self.burst_packets * max_packet_size
+        if self.rate is None:
+            self.tokens = self.capacity
+        else:
+            self.tokens = min(self.capacity, self.tokens + self.rate * (now - self.last_update))
+        self.rate = gain * cwnd / smoothed_rtt
+        self.last_update = now
+
+    def budget(self) -> float:
+        # bytes that may be sent right now
+        if self.rate is None:
+            return float("inf")
+        return max(self.tokens, 0)
+
+    def on_sent(self, size: int) -> None:
+        if self.rate is not None:
+            # retransmissions are not limited by budget(), so the bucket may become negative
+            self.tokens -= size
+
+    def delay(self, size: int) -> float:
+        # seconds until a packet of the given size may be sent
+        if self.rate is None or self.tokens >= size:
+            return 0
+        return (size - self.tokens) / self.rate
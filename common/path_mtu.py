@@ -0,0 +1,98 @@
+import logging
+import time
+
+"""
+
+Packetization layer path MTU discovery (loosely following RFC 8899, DPLPMTUD).
+
+Every connection starts out with a conservative maximum packet size that fits into an
+ethernet frame even for ipv6 (1500 - 40 byte ip header - 8 byte udp header). From there,
+probe packets (packets that only contain a PaddingFrame) of larger sizes are sent. If a
+probe is acknowledged, the probed size becomes the new maximum packet size. If a probe
+is lost (or the kernel refuses to send it because it is larger than the local interface
+MTU), the search space is narrowed down and a smaller size is probed next.
+
+The search starts by probing the largest possible udp payload, so that on loopback
+(where the MTU is 64 KiB) the optimum is found with a single probe. Otherwise, a binary
+search between the largest confirmed and smallest failed size is done.
+
+"""
+
+
+class PathMTUDiscovery:
+    # smallest size that is assumed to always work
+    base_packet_size = 1500 - 40 - 8
+    # largest udp payload that can be carried by an ipv4 datagram
+    max_packet_size = 65535 - 20 - 8
+    # the search stops as soon as the search range is smaller than this
+    search_granularity = 64
+    # a size is considered too large after this many lost probes
+    max_probes = 3
+    # the search is restarted after this amount of time (path may have changed)
+    reprobe_interval = 10 * 60  # seconds
+
+    def __init__(self) -> None:
+        self.packet_size = self.base_packet_size  # largest confirmed size
+        self.upper_bound = self.max_packet_size  # smallest size that is known or assumed to fail
+        self.probe_packet_id = None  # packet_id of the probe in flight (at most one)
+        self.probe_size = None
+        self.probe_count = 0  # number of lost probes of size probe_size
+        self.search_done_time = None
+
+    def is_searching(self) -> bool:
+        if self.search_done_time is not None and time.time() > self.search_done_time + self.reprobe_interval:
+            logging.info("restarting path MTU search")
+            self.search_done_time = None
+            self.upper_bound = self.max_packet_size
+        return self.search_done_time is None
+
+    def next_probe_size(self) -> int | None:
+        """
+        returns the size of the next probe packet that should be sent, or None if no probe should be sent right now
+        """
+        if self.probe_packet_id is not None or not self.is_searching():
+            return None
+        if self.upper_bound - self.packet_size < self.search_granularity:
+            logging.info(f"path MTU search done, max packet size is {self.packet_size}")
+            self.search_done_time = time.time()
+            return None
+        if self.probe_size is not None and self.probe_count > 0:
+            # retry the size of the last lost probe
+            return self.probe_size
+        if self.upper_bound == self.max_packet_size and self.packet_size == self.base_packet_size:
+            # optimistically try the largest possible size first
+            return self.upper_bound
+        return (self.packet_size + self.upper_bound + 1) // 2
+
+    def on_probe_sent(self, packet_id: int, size: int) -> None:
+        logging.info(f"sending path MTU probe of {size} bytes, packet_id = {packet_id}")
+        if size != self.probe_size:
+            self.probe_count = 0
+        self.probe_packet_id = packet_id
+        self.probe_size = size
+
+    def on_probe_acked(self, packet_id: int) -> None:
+        if packet_id != self.probe_packet_id:
+            return
+        logging.info(f"path MTU probe of {self.probe_size} bytes acknowledged")
+        self.packet_size = max(self.packet_size, self.probe_size)
+        self.probe_packet_id = None
+        self.probe_size = None
+        self.probe_count = 0
+
+    def on_probe_lost(self, packet_id: int) -> None:
+        if packet_id != self.probe_packet_id:
+            return
+        logging.info(f"path MTU probe of {self.probe_size} bytes lost")
+        self.probe_packet_id = None
+        self.probe_count += 1
+        if self.probe_count >= self.max_probes:
+            self.on_probe_too_large(self.probe_size)
+
+    def on_probe_too_large(self, size: int) -> None:
+        # either max_probes probes of this size were lost, or the kernel rejected it with EMSGSIZE
+        logging.info(f"path MTU probe of {size} bytes is too large")
+        self.upper_bound = min(self.upper_bound, size - 1)
+        self.probe_packet_id = None
+        self.probe_size = None
+        self.probe_count = 0
@@ -0,0 +1,63 @@
+from __future__ import annotations
+
+import os
+
+"""
+
+Read-ahead file reader for the sending side of a stream. Reading every data frame with its own
+seek() + read() costs two system calls and a new bytes object per frame. Instead, the reader
+fetches large aligned blocks (one pread per block_size bytes) and hands out the frame payloads
+as memoryview slices of the block. The kernel is told that the file is read sequentially
+(posix_fadvise), so it reads ahead while a block is sent.
+
+Files are not mapped into memory, not even big ones: a mapped file that is truncated while it is
+served raises SIGBUS on the next access, which would kill the whole server instead of one stream.
+With pread, a truncated file simply ends early.
+
+Blocks are not refilled in place: the packets of a flush are only packed (i.e. the payloads are
+copied) once the flush is complete, so the payloads of earlier frames must stay untouched while
+the next block is read. Every block is a new immutable bytes object, which is freed as soon as the
+last frame that refers to it was packed.
+
+"""
+
+
+class ReadAheadReader:
+    block_size = 1024 * 1024
+    alignment = 4096
+
+    def __init__(self, path: str) -> None:
+        self.fd = os.open(path, os.O_RDONLY)
+        self.size = os.fstat(self.fd).st_size
+        if hasattr(os, "posix_fadvise"):
+            os.posix_fadvise(self.fd, 0, 0, os.POSIX_FADV_SEQUENTIAL)
+
+        # the block that was read last and its file offset
+        self.block_view = memoryview(b"")
+        self.block_offset = 0
+
+    def __repr__(self) -> str:
+        return f"ReadAheadReader(size={self.size}, block_offset={self.block_offset})"
+
+    def read(self, offset: int, length: int) -> memoryview:
+        # up to length bytes at offset, an empty view at the end of the file
+        block_end = self.block_offset + len(self.block_view)
+        # a new block is read if offset is not buffered, or if the frame would be cut short at the end of a
+        # full block (a partial block is the end of the file)
+        if not self.block_offset <= offset < block_end or \
+                (offset + length > block_end and len(self.block_view) == self.block_size):
+            self.read_block(offset)
+        start = offset - self.block_offset
+        return self.block_view[start:start + length]
+
+    def read_block(self, offset: int) -> None:
+        # reads the aligned block that contains offset
+        self.block_offset = offset - offset % self.alignment
+        self.block_view = memoryview(os.pread(self.fd, self.block_size, self.block_offset))
+
+    def close(self) -> None:
+        if self.fd is None:
+            return
+        self.block_view = memoryview(b"")
+        os.close(self.fd)
+        self.fd = None
@@ -0,0 +1,61 @@
+import logging
+
+"""
+
+Round trip time estimation and retransmission timeout calculation following RFC 6298.
+
+Samples are taken by the connection from acknowledgements of packets that were sent exactly
+once (Karn's algorithm: an ack for a retransmitted packet cannot be matched with one of its
+transmissions). Every retransmission timeout doubles the timeout (exponential backoff) until
+an acknowledgement for new packets arrives, even if it does not yield a sample (as in RFC 9002).
+Otherwise a path on which all early packets were retransmitted would never leave the backoff.
+
+"""
+
+
+class RTTEstimator:
+    alpha = 1 / 8
+    beta = 1 / 4
+    initial_rto = 1  # seconds, used until the first sample arrives
+    min_rto = 0.05  # seconds
+    max_rto = 10  # seconds, lower than the 60s of RFC 6298 s.t. connections recover quickly after long loss bursts
+    clock_granularity = 0.001  # seconds
+
+    def __init__(self) -> None:
+        self.latest_rtt = None
+        self.smoothed_rtt = None
+        self.rtt_variance = None
+        self.min_rtt = None
+        self.backoff = 1
+
+    def __repr__(self) -> str:
+        return f"RTTEstimator(smoothed_rtt={self.smoothed_rtt}, rtt_variance={self.rtt_variance}, min_rtt={self.min_rtt}, rto={self.rto})"
+
+    def on_sample(self, rtt: float) -> None:
+        rtt = max(rtt, 0)
+        self.latest_rtt = rtt
+        if self.smoothed_rtt is None:
+            self.smoothed_rtt = rtt
+            self.rtt_variance = rtt / 2
+            self.min_rtt = rtt
+        else:
+            self.rtt_variance = (1 - self.beta) * self.rtt_variance + self.beta * abs(self.smoothed_rtt - rtt)
+            self.smoothed_rtt = (1 - self.alpha) * self.smoothed_rtt + self.alpha * rtt
+            self.min_rtt = min(self.min_rtt, rtt)
+
+    def on_ack(self) -> None:
+        # new packets were acknowledged, the path works again
+        self.backoff = 1
+
+    def on_timeout(self) -> None:
+        if self.rto < self.max_rto:
+            self.backoff *= 2
+        logging.info(f"retransmit timeout backed off to {self.rto}")
+
+    @property
+    def rto(self) -> float:
+        if self.smoothed_rtt is None:
+            rto = self.initial_rto
+        else:
+            rto = self.smoothed_rtt + max(self.clock_granularity, 4 * self.rtt_variance)
+        return min(max(rto, self.min_rto) * self.backoff, self.max_rto)
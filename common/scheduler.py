@@ -0,0 +1,140 @@
+from __future__ import annotations
+
+from collections import deque
+from frame import DataFrame
+
+import abc
+import heapq
+import itertools
+
+"""
+
+Stream schedulers decide which stream provides the next data frame of a connection (see
+Connection.generate_frame()). Streams are added once the transfer starts and are dropped by the
+scheduler as soon as they return no more frames (i.e. they are closed).
+
+rr:        round robin, one frame per stream in turn
+drr:       deficit round robin, every stream gets bytes in proportion to its weight per round
+priority:  strict priority, streams with a higher priority are sent first (round robin among
+           streams of the same priority)
+srf:       shortest remaining first, the stream with the fewest bytes left is sent first
+
+The priority (0-7) and weight (1-8) of a stream are requested by the client in the flags of the
+ReadFrame. All schedulers need O(1) per frame, independent of the number of streams (srf needs
+O(log n) to add a stream).
+
+"""
+
+
+class StreamScheduler(abc.ABC):
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}()"
+
+    @abc.abstractmethod
+    def add(self, stream) -> None:
+        pass
+
+    @abc.abstractmethod
+    def next_frame(self, max_payload_size: int) -> DataFrame | None:
+        pass
+
+
+class RoundRobinScheduler(StreamScheduler):
+
+    def __init__(self) -> None:
+        self.active = deque()
+
+    def add(self, stream) -> None:
+        self.active.append(stream)
+
+    def next_frame(self, max_payload_size: int) -> DataFrame | None:
+        while self.active:
+            stream = self.active.popleft()
+            frame = stream.get_next_data_frame(max_payload_size)
+            if frame is not None:
+                self.active.append(stream)
+                return frame
+        return None
+
+
+class DeficitRoundRobinScheduler(StreamScheduler):
+    # bytes a stream of weight 1 may send per round, larger than a packet s.t. a stream sends several
+    # packets in a row (fewer, larger data frames) and every stream is visited at most twice per frame
+    quantum = 16 * 1024
+
+    def __init__(self) -> None:
+        self.active = deque()
+        self.deficits = {}  # stream -> bytes the stream may still send in the current round
+
+    def add(self, stream) -> None:
+        self.active.append(stream)
+        self.deficits[stream] = self.quantum * stream.weight
+
+    def next_frame(self, max_payload_size: int) -> DataFrame | None:
+        while self.active:
+            stream = self.active[0]
+            if self.deficits[stream] <= 0:
+                # the stream used up its share of this round, it gets the next share once it is its turn again
+                self.deficits[stream] += self.quantum * stream.weight
+                self.active.rotate(-1)
+                continue
+            frame = stream.get_next_data_frame(max_payload_size)
+            if frame is None:
+                self.active.popleft()
+                del self.deficits[stream]
+                continue
+            self.deficits[stream] -= frame.header.payload_length
+            return frame
+        return None
+
+
+class PriorityScheduler(StreamScheduler):
+    levels = 8
+
+    def __init__(self) -> None:
+        # one round robin scheduler per priority, the number of levels is fixed (see ReadFrame flags)
+        self.schedulers = [RoundRobinScheduler() for _ in range(self.levels)]
+
+    def add(self, stream) -> None:
+        self.schedulers[stream.priority].add(stream)
+
+    def next_frame(self, max_payload_size: int) -> DataFrame | None:
+        for scheduler in reversed(self.schedulers):
+            frame = scheduler.next_frame(max_payload_size)
+            if frame is not None:
+                return frame
+        return None
+
+
+class ShortestRemainingFirstScheduler(StreamScheduler):
+
+    def __init__(self) -> None:
+        self.heap: list[tuple[int, int, object]] = []
+        self.sequence = itertools.count()  # tie breaker, streams are not comparable (and keeps the order of requests)
+
+    def add(self, stream) -> None:
+        if self.heap:
+            # only the first stream is sent, so it is the only one whose key is outdated
+            _, sequence, first = self.heap[0]
+            heapq.heapreplace(self.heap, (first.remaining_bytes(), sequence, first))
+        heapq.heappush(self.heap, (stream.remaining_bytes(), next(self.sequence), stream))
+
+    def next_frame(self, max_payload_size: int) -> DataFrame | None:
+        # the remaining bytes of the first stream only decrease while it is sent, it stays first
+        # until a shorter stream is added (its key is updated in add()). hence the heap is not updated per frame
+        while self.heap:
+            stream = self.heap[0][2]
+            frame = stream.get_next_data_frame(max_payload_size)
+            if frame is not None:
+                return frame
+            heapq.heappop(self.heap)
+        return None
+
+
+stream_schedulers = {
+    "rr": RoundRobinScheduler,
+    "drr": DeficitRoundRobinScheduler,
+    "priority": PriorityScheduler,
+    "srf": ShortestRemainingFirstScheduler,
+}
@@ -1,21 +1,43 @@
+import hashlib
 import pathlib
 import common.util as util
+from common.reader import ReadAheadReader
+from common.compression import CompressingReader, OrderedDecoder
+from common.delta import DeltaReader, Signatures
+from common.writer import FileWriter
 import json
 from frame import *
 
 class Stream:
-    def __init__(self, stream_id: int, path: str, direction=None):
+    def __init__(self, stream_id: int, path: str, direction=None, priority: int = 0, weight: int = 1, durability: str = "none"):
         self.stream_id = stream_id
         if not pathlib.Path(path).exists():
             raise FileNotFoundError(f"File {path} not found")
         self.path = path
         self.file = open(path, "a+b")
         # TODO: file checksum calculation
-        self.frames_so_far = []  # for debugging
         self.next_offset = 0
-        self.payload_size = 128
+        self.end_offset: int | None = None  # set if only a range of the file is transferred, see set_range()
         self.is_closed = False
         self.direction = direction
+        # used by the stream scheduler of the sending side, see common/scheduler.py
+        self.priority = priority
+        self.weight = weight
+        self.reader: ReadAheadReader | None = None  # created once the first data frame is sent
+        # compressed transfer (see common/compression.py): the codec of the sending side. the receiving side decodes
+        # compressed data or delta records (common/delta.py) with an OrderedDecoder before writing to the file
+        self.compression: str | None = None
+        # delta transfer (see common/delta.py): the signatures of the basis of the client, the records of the delta are sent
+        self.signatures: Signatures | None = None
+        self.decoder: OrderedDecoder | None = None
+        # receiving side: written through a FileWriter, which preallocates expected_size bytes if the size is known
+        self.writer: FileWriter | None = None  # created once the first data frame is received
+        self.expected_size: int | None = None
+        self.durability = durability
+        # running sha256 of the file, fed with the data that is sent/received (in file order), see get_file_checksum().
+        # None if the data did not arrive in order, the checksum is then calculated from the file
+        self.checksum_hash = hashlib.sha256()
+        self.checksum_offset = 0  # number of bytes (from the start of the file) that went into checksum_hash
 
     def __repr__(self):
         return json.dumps({
@@ -28,45 +50,133 @@ class Stream:
 
     def __del__(self):
         self.file.close()
+        if self.reader is not None:
+            self.reader.close()
+        if self.writer is not None:
+            self.writer.close()
 
     @classmethod
-    def open(cls, stream_id: int, path: str, direction=None):
+    def open(cls, stream_id: int, path: str, direction=None, durability: str = "none"):
         open(path, "a+b").close()
-        return cls(stream_id, path, direction)
+        return cls(stream_id, path, direction, durability=durability)
 
     def close(self):
         if self.is_closed:
             return
-        self.file.close()
         self.is_closed = True
-        # if the file is empty, delete it
-        if self.get_file_size() == 0:
+        self.file.close()
+        if self.reader is not None:
+            self.reader.close()
+        if self.decoder is not None:
+            self.decoder.close()
+        if self.writer is not None:
+            writer, self.writer = self.writer, None
+            writer.close()
+        # if the received file is empty, delete it (never the file that is sent)
+        if self.direction == "r" and self.get_file_size() == 0:
             pathlib.Path(self.path).unlink()
 
+    def write(self, offset: int, data):
+        # data is written at offset by the write-behind thread of the writer, see common/writer.py.
+        # data that needs decoding (compressed data, delta records) is decoded first, offset is then an offset of the stream
+        if self.decoder is not None:
+            for file_offset, decoded in self.decoder.feed(offset, data):
+                self.write_data(file_offset, decoded)
+            return
+        self.write_data(offset, data)
+
+    def write_data(self, offset: int, data):
+        if self.writer is None:
+            self.writer = FileWriter(self.path, self.expected_size, self.durability)
+        self.update_checksum(offset, data)
+        self.writer.write(offset, data)
+
     def flush(self):
         self.file.flush()
+        if self.writer is not None:
+            self.writer.flush()
+
+    def written_bytes(self) -> int:
+        # bytes of received data that were written to the file, and bytes that still wait for the disk
+        return self.writer.written_bytes if self.writer is not None else 0
+
+    def write_backlog(self) -> int:
+        return self.writer.backlog_bytes if self.writer is not None else 0
 
     def get_file_size(self) -> int:
         return pathlib.Path(self.path).stat().st_size
 
-    def get_file_checksum(self) -> str:
+    def set_range(self, offset: int, length: int):
+        # only the bytes [offset, offset + length) are transferred, up to the end of the file if length is 0
+        self.next_offset = offset
+        if length > 0:
+            self.end_offset = offset + length
+            # the running checksum only helps if the stream covers the file up to its end
+            self.checksum_hash = None
+
+    def get_file_checksum(self) -> bytes:
+        # the running checksum if it covers the whole file, so that the file does not need to be read again
+        if self.checksum_hash is not None and self.checksum_offset == self.get_file_size():
+            return self.checksum_hash.digest()
         return util.sha256_file_checksum(self.path)
 
+    def set_checksum_prefix(self, checksum_hash, offset: int):
+        # resumed transfer: the sha256 of the first offset bytes was calculated elsewhere (see ChecksumIndex.prefix())
+        if self.checksum_hash is not None:
+            self.checksum_hash = checksum_hash
+            self.checksum_offset = offset
+
+    def update_checksum(self, offset: int, data):
+        if self.checksum_hash is None:
+            return
+        if offset != self.checksum_offset:
+            if self.checksum_offset == 0 and offset <= self.get_file_size():
+                # resumed transfer: the part of the file that exists already is hashed once, from disk
+                self.checksum_hash = util.sha256_file_hash(self.path, 0, offset)
+                self.checksum_offset = offset
+            else:
+                self.checksum_hash = None
+                return
+        self.checksum_hash.update(data)
+        self.checksum_offset += len(data)
+
+    def remaining_bytes(self) -> int:
+        if isinstance(self.reader, (CompressingReader, DeltaReader)):
+            return self.reader.remaining_bytes()
+        end_offset = self.end_offset if self.end_offset is not None else self.get_file_size()
+        return max(0, end_offset - self.next_offset)
+
     def get_file_name(self) -> str:
         return pathlib.Path(self.path).name
     
-    def get_next_data_frame(self) -> DataFrame:
+    def get_next_data_frame(self, max_payload_size: int) -> DataFrame:
+        # max_payload_size is chosen by the connection s.t. the frame fills up the packet that is currently built
         if self.is_closed or self.direction == "r":
             return None
-        self.file.seek(self.next_offset)
-        # print(f"Reading {self.payload_size} bytes from {self.next_offset}")
-        data = self.file.read(self.payload_size)
+        if self.reader is None and self.signatures is not None:
+            # next_offset counts the bytes of the delta records
+            self.reader = DeltaReader(self.path, self.signatures)
+            self.next_offset, self.end_offset = 0, None
+            self.checksum_hash = None
+        if self.reader is None:
+            self.reader = ReadAheadReader(self.path)
+            if self.compression is not None:
+                # from here on next_offset counts compressed bytes, the compressor reads the file range and
+                # feeds the uncompressed data into the running checksum
+                self.reader = CompressingReader(self.reader, self.compression, self.next_offset, self.end_offset, self.update_checksum)
+                self.next_offset, self.end_offset = 0, None
+        length = min(max_payload_size, DataFrame.max_payload_size)
+        if self.end_offset is not None:
+            length = min(length, self.end_offset - self.next_offset)
+        # the payload is a view of the read-ahead buffer, it is copied once the frame is packed
+        data = self.reader.read(self.next_offset, length)
+        if self.compression is None:
+            self.update_checksum(self.next_offset, data)
         if not data:
             self.close()
             return DataFrame(self.stream_id, self.next_offset, b"")
-        frame = DataFrame(self.stream_id, self.next_offset, data)
+        frame = DataFrame.create(self.stream_id, self.next_offset, data)
         self.next_offset += len(data)
-        self.frames_so_far.append(frame)
         return frame
     
     def remove_file(self):
@@ -0,0 +1,73 @@
+from __future__ import annotations
+
+import heapq
+import itertools
+
+"""
+
+Central timer structure of the ConnectionManager. Every connection registers the deadline of its
+next timeout (the earliest of connection/idle timeout, retransmit timeout and pacing, see
+Connection.next_deadline()), the manager sleeps until the earliest deadline and fires all timers
+that are due at once.
+
+The timers are a binary heap of (deadline, sequence number, connection) entries with lazy
+cancellation: rescheduling a connection only pushes a new entry and remembers the current deadline
+of the connection in a dict, outdated entries are dropped once they reach the top of the heap.
+Scheduling, cancelling and firing a timer are O(log n) (n = number of connections), instead of
+asking every connection for its timeout on every wakeup.
+
+"""
+
+
+class TimerHeap:
+    # the heap is rebuilt from the current deadlines once it holds that many outdated entries
+    # per scheduled timer (plus a constant), so that connections which reschedule often do not let it grow
+    compact_factor = 4
+    compact_minimum = 64
+
+    def __init__(self) -> None:
+        self.heap: list[tuple[float, int, object]] = []
+        self.deadlines: dict[object, float] = {}  # connection -> its current deadline
+        self.sequence = itertools.count()  # tie breaker, connections are not comparable
+
+    def __len__(self) -> int:
+        return len(self.deadlines)
+
+    def __contains__(self, connection) -> bool:
+        return connection in self.deadlines
+
+    def schedule(self, connection, deadline: float) -> None:
+        # replaces the previous deadline of the connection
+        if self.deadlines.get(connection) == deadline:
+            return
+        self.deadlines[connection] = deadline
+        heapq.heappush(self.heap, (deadline, next(self.sequence), connection))
+        if len(self.heap) > self.compact_factor * len(self.deadlines) + self.compact_minimum:
+            self.compact()
+
+    def cancel(self, connection) -> None:
+        self.deadlines.pop(connection, None)
+
+    def compact(self) -> None:
+        self.heap = [(deadline, next(self.sequence), connection) for connection, deadline in self.deadlines.items()]
+        heapq.heapify(self.heap)
+
+    def next(self) -> tuple[float | None, object | None]:
+        # the earliest deadline and its connection, (None, None) if no timer is scheduled
+        while self.heap:
+            deadline, _, connection = self.heap[0]
+            if self.deadlines.get(connection) == deadline:
+                return deadline, connection
+            heapq.heappop(self.heap)  # cancelled or rescheduled
+        return None, None
+
+    def pop_due(self, now: float) -> list:
+        # removes and returns all connections whose deadline has passed, earliest first
+        due = []
+        while True:
+            deadline, connection = self.next()
+            if deadline is None or deadline > now:
+                return due
+            heapq.heappop(self.heap)
+            del self.deadlines[connection]
+            due.append(connection)
@@ -4,6 +4,10 @@ import zlib
 import hashlib
 
 def sha256_file_checksum(file_path: str, offset: int = 0, length: int = -1) -> bytes:
+    return sha256_file_hash(file_path, offset, length).digest()
+
+def sha256_file_hash(file_path: str, offset: int = 0, length: int = -1):
+    # the hash object, so that more data can be added to it (see Stream.update_checksum())
     with open(file_path, "r+b") as file:
         sha256_hash = hashlib.sha256()
         file.seek(offset)
@@ -23,7 +27,7 @@ def sha256_file_checksum(file_path: str, offset: int = 0, length: int = -1) -> b
                 sha256_hash.update(chunk)
                 remaining_bytes -= len(chunk)
         
-        return sha256_hash.digest()
+        return sha256_hash
 
 def crc32_file_checksum(file_path: str, offset: int = 0, length: int = 0) -> int:
     with open(file_path, "r+b") as file:
@@ -44,4 +48,10 @@ def crc32_file_checksum(file_path: str, offset: int = 0, length: int = 0) -> int
                 crc32_hash = zlib.crc32(chunk, crc32_hash)
                 remaining_bytes -= len(chunk)
         
-        return crc32_hash
\ No newline at end of file
+        return crc32_hash
+
+def split_ranges(size: int, count: int, min_range_size: int = 1024 * 1024) -> list[tuple[int, int]]:
+    # (offset, length) of up to count non-empty ranges of at least min_range_size bytes that cover size bytes
+    count = max(1, min(count, size // min_range_size))
+    range_size = -(-size // count)
+    return [(offset, min(range_size, size - offset)) for offset in range(0, size, range_size)]
@@ -0,0 +1,213 @@
+from __future__ import annotations
+
+import ctypes
+import ctypes.util
+import logging
+import os
+import queue
+import sys
+import threading
+import time
+
+"""
+
+Storage engine of the receiving side of a stream. Writing every DataFrame payload with its own
+file.write() on the event loop thread stalls the connection (and its acks) whenever the disk is
+slow, and relies on the frames arriving in order. The FileWriter instead
+
+- writes positionally (at the offset of the frame), so the order of the frames does not matter
+- coalesces adjacent payloads into large writes (one pwritev() per coalesce_size bytes, the
+  payloads are not copied)
+- hands the writes to a write-behind thread, the event loop only waits if the disk is more than
+  queue_size chunks behind
+- preallocates the whole file if its size is known, so that the file system can place it
+  contiguously
+
+Preallocation uses fallocate() with FALLOC_FL_KEEP_SIZE via ctypes (linux only): the file size
+only grows with the data that was actually written, an interrupted transfer can be resumed from
+the size of the file. posix_fallocate() would extend the file size right away. The blocks past
+the end of the file stay allocated with FALLOC_FL_KEEP_SIZE, close() releases them again (an
+interrupted transfer would otherwise keep the space of the whole file).
+
+Durability policies:
+
+none:      the data is left to the page cache of the operating system
+end:       fdatasync() once the transfer is complete (before the checksum is verified)
+periodic:  fdatasync() every sync_interval seconds during the transfer and at the end
+
+"""
+
+FALLOC_FL_KEEP_SIZE = 1
+
+
+def load_fallocate():
+    if not sys.platform.startswith("linux"):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+    except OSError as e:
+        logging.warning(f"could not load libc, files are not preallocated: {e}")
+        return None
+    if not hasattr(libc, "fallocate"):
+        return None
+    fallocate = libc.fallocate
+    fallocate.argtypes = [ctypes.c_int, ctypes.c_int, ctypes.c_longlong, ctypes.c_longlong]
+    fallocate.restype = ctypes.c_int
+    return fallocate
+
+
+durability_policies = ("none", "end", "periodic")
+
+
+class FileWriter:
+    coalesce_size = 1024 * 1024
+    queue_size = 32  # chunks of up to coalesce_size bytes
+    sync_interval = 1.0  # seconds, for the periodic durability policy
+    max_iovecs = os.sysconf("SC_IOV_MAX") if hasattr(os, "sysconf") and "SC_IOV_MAX" in os.sysconf_names else 1024
+    fallocate = load_fallocate()
+
+    def __init__(self, path: str, expected_size: int | None = None, durability: str = "none") -> None:
+        if durability not in durability_policies:
+            raise ValueError(f"unknown durability policy {durability}")
+        self.path = path
+        self.durability = durability
+        self.fd = os.open(path, os.O_WRONLY | os.O_CREAT, 0o644)
+
+        # adjacent payloads that were not handed to the write-behind thread yet
+        self.pending: list = []
+        self.pending_offset = 0
+        self.pending_bytes = 0
+        # bytes handed to the write-behind thread, and bytes it wrote (see backlog_bytes)
+        self.submitted_bytes = 0
+        self.written_bytes = 0
+
+        self.preallocated = os.fstat(self.fd).st_size
+        self.preallocate_enabled = self.fallocate is not None
+        if expected_size is not None:
+            # the file may already have its final size without being allocated (range transfers truncate it to
+            # the size up front, see ClientConnection.request_segmented()), so the whole file is allocated.
+            # parts that are allocated already are skipped by the file system
+            self.preallocate(expected_size, 0)
+
+        self.error: OSError | None = None  # set by the write-behind thread, raised by the next call
+        self.last_sync = time.time()
+        self.chunks = queue.Queue(self.queue_size)
+        self.thread = threading.Thread(target=self.write_behind, name=f"rft-writer-{os.path.basename(path)}", daemon=True)
+        self.thread.start()
+
+    def __repr__(self) -> str:
+        return f"FileWriter(path={self.path}, pending_bytes={self.pending_bytes}, queued={self.chunks.qsize()})"
+
+    def write(self, offset: int, data) -> None:
+        # data must not change afterwards (bytes, or a memoryview of bytes), it is written later
+        self.raise_error()
+        if len(data) == 0:
+            return
+        if self.pending and (offset != self.pending_offset + self.pending_bytes or len(self.pending) >= self.max_iovecs):
+            self.submit()
+        if not self.pending:
+            self.pending_offset = offset
+        self.pending.append(data)
+        self.pending_bytes += len(data)
+        if self.pending_bytes >= self.coalesce_size:
+            self.submit()
+
+    def flush(self) -> None:
+        # returns once all data was written to the file (not necessarily to the disk, see durability)
+        self.submit()
+        self.chunks.join()
+        self.raise_error()
+
+    def close(self) -> None:
+        if self.fd is None:
+            return
+        try:
+            self.flush()
+            if self.durability != "none":
+                self.sync()
+        finally:
+            self.chunks.put(None)
+            self.thread.join()
+            self.release_preallocation()
+            os.close(self.fd)
+            self.fd = None
+
+    def release_preallocation(self) -> None:
+        # truncating the file to its own size frees the blocks that were preallocated past its end
+        if self.preallocated == 0:
+            return
+        try:
+            size = os.fstat(self.fd).st_size
+            if size < self.preallocated:
+                os.ftruncate(self.fd, size)
+        except OSError as e:
+            logging.info(f"could not release the preallocated space of {self.path}: {e}")
+        self.preallocated = 0
+
+    @property
+    def backlog_bytes(self) -> int:
+        # bytes that were passed to write() but are not written to the file yet
+        return self.pending_bytes + self.submitted_bytes - self.written_bytes
+
+    def submit(self) -> None:
+        if self.pending:
+            self.submitted_bytes += self.pending_bytes
+            self.chunks.put((self.pending_offset, self.pending))
+            self.pending = []
+            self.pending_bytes = 0
+
+    def preallocate(self, size: int, start: int | None = None) -> None:
+        # allocates the file from start (default: the end of the allocated part) up to size
+        start = self.preallocated if start is None else start
+        if not self.preallocate_enabled or size <= start:
+            return
+        if self.fallocate(self.fd, FALLOC_FL_KEEP_SIZE, start, size - start) != 0:
+            # e.g. not supported by the file system, the file simply grows with the data
+            logging.info(f"could not preallocate {self.path}: {os.strerror(ctypes.get_errno())}")
+            self.preallocate_enabled = False
+            return
+        self.preallocated = max(self.preallocated, size)
+
+    def sync(self) -> None:
+        if hasattr(os, "fdatasync"):
+            os.fdatasync(self.fd)
+        else:
+            os.fsync(self.fd)
+        self.last_sync = time.time()
+
+    def raise_error(self) -> None:
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+
+    def write_behind(self) -> None:
+        while True:
+            chunk = self.chunks.get()
+            try:
+                if chunk is None:
+                    return
+                if self.error is None:
+                    self.write_chunk(*chunk)
+                    self.written_bytes += sum(len(buffer) for buffer in chunk[1])
+                    if self.durability == "periodic" and time.time() - self.last_sync >= self.sync_interval:
+                        self.sync()
+            except OSError as e:
+                # the chunks that follow are dropped, the error is raised by the next write()/flush()
+                logging.error(f"could not write to {self.path}: {e}")
+                self.error = e
+            finally:
+                self.chunks.task_done()
+
+    def write_chunk(self, offset: int, buffers: list) -> None:
+        if not hasattr(os, "pwritev"):
+            os.pwrite(self.fd, b"".join(buffers), offset)
+            return
+        while buffers:
+            written = os.pwritev(self.fd, buffers, offset)
+            offset += written
+            # partial write: skip the buffers that were written completely, cut the first one that was not
+            while buffers and written >= len(buffers[0]):
+                written -= len(buffers[0])
+                buffers = buffers[1:]
+            if written:
+                buffers[0] = memoryview(buffers[0])[written:]
@@ -1,5 +1,6 @@
 from frame.command import (
     ChecksumFrame,
+    DeltaFrame,
     ListFrame,
     StatFrame,
     WriteFrame,
@@ -16,7 +17,9 @@ from frame.control import (
     ConnectionIDChangeFrame,
     ErrorFrame,
     ExitFrame,
-    FlowControlFrame
+    FlowControlFrame,
+    PaddingFrame,
+    SackFrame
 )
 
 from frame.data import (
@@ -4,9 +4,24 @@ from frame.frame import Frame
 
 class ReadFrame(Frame):
     type = 7
+    __slots__ = ("header", "payload")
+    # flags: bit 0 requests a checksum check of the first offset bytes (resumption), bits 1-3 are the priority
+    # of the stream (0-7, higher is sent first), bits 4-6 are the weight of the stream minus 1 (1-8),
+    # bit 7 tells that the client accepts compressed data (see common/compression.py)
+    flag_check_checksum = 0b00000001
+    priority_shift = 1
+    priority_mask = 0b00001110
+    weight_shift = 4
+    weight_mask = 0b01110000
+    flag_compress = 0b10000000
+    max_priority = 7
+    max_weight = 8
 
     class Header(Frame.Header):
-        size = struct.calcsize('<BHB6s6sIH')
+        __slots__ = ("type", "stream_id", "flags", "offset", "length", "checksum", "payload_length")
+        # the 6 byte offset and length fields are split into a 4 byte low and a 2 byte high part
+        format = struct.Struct('<BHBIHIHIH')
+        size = format.size
 
         def __init__(self, stream_id: int, flags: bytes, offset: int, length: int, checksum: int, payload_length: int) -> None:
             self.type = ReadFrame.type
@@ -18,18 +33,18 @@ class ReadFrame(Frame):
             self.payload_length = payload_length
 
         def pack(self) -> bytes:
-            return struct.pack('<BHB6s6sIH', self.type, self.stream_id, self.flags, int.to_bytes(self.offset, 6, 'little'), int.to_bytes(self.length, 6, 'little'), self.checksum, self.payload_length)
+            return self.format.pack(self.type, self.stream_id, self.flags, self.offset & 0xFFFFFFFF, self.offset >> 32, self.length & 0xFFFFFFFF, self.length >> 32, self.checksum, self.payload_length)
 
         @classmethod
         def unpack(cls, header_bytes: bytes) -> 'ReadFrame.Header':
-            type, stream_id, flags, offset, length, checksum, payload_length = struct.unpack(
-                '<BHB6s6sIH', header_bytes)
+            type, stream_id, flags, offset_low, offset_high, length_low, length_high, checksum, payload_length = cls.format.unpack(header_bytes)
             if type != ReadFrame.type:
                 raise ValueError(
                     f'Invalid header type: {type} (expected {ReadFrame.type})')
-            return cls(stream_id, flags, int.from_bytes(offset, 'little'), int.from_bytes(length, 'little'), checksum, payload_length)
+            return cls(stream_id, flags, offset_high << 32 | offset_low, length_high << 32 | length_low, checksum, payload_length)
 
     class Payload(Frame.Payload):
+        __slots__ = ("data",)
 
         def __init__(self, path: str) -> None:
             self.data = path
@@ -52,6 +67,30 @@ class ReadFrame(Frame):
     def __len__(self) -> int:
         return len(self.header) + len(self.payload)
 
+    @classmethod
+    def encode_flags(cls, check_checksum: bool = False, priority: int = 0, weight: int = 1, compress: bool = False) -> int:
+        if not 0 <= priority <= cls.max_priority or not 1 <= weight <= cls.max_weight:
+            raise ValueError(f'Invalid priority {priority} or weight {weight}')
+        flags = cls.flag_check_checksum if check_checksum else 0
+        flags |= cls.flag_compress if compress else 0
+        return flags | priority << cls.priority_shift | (weight - 1) << cls.weight_shift
+
+    @property
+    def check_checksum(self) -> bool:
+        return bool(self.header.flags & self.flag_check_checksum)
+
+    @property
+    def compress(self) -> bool:
+        return bool(self.header.flags & self.flag_compress)
+
+    @property
+    def priority(self) -> int:
+        return (self.header.flags & self.priority_mask) >> self.priority_shift
+
+    @property
+    def weight(self) -> int:
+        return ((self.header.flags & self.weight_mask) >> self.weight_shift) + 1
+
     def pack(self) -> bytes:
         return self.header.pack() + self.payload.pack()
 
@@ -67,9 +106,13 @@ class ReadFrame(Frame):
 
 class WriteFrame(Frame):
     type = 8
+    __slots__ = ("header", "payload")
 
     class Header(Frame.Header):
-        size = struct.calcsize('<BH6s6sH')
+        __slots__ = ("type", "stream_id", "offset", "length", "payload_length")
+        # the 6 byte offset and length fields are split into a 4 byte low and a 2 byte high part
+        format = struct.Struct('<BHIHIHH')
+        size = format.size
 
         def __init__(self, stream_id: int, offset: int, length: int, payload_length: int) -> None:
             self.type = WriteFrame.type
@@ -79,18 +122,18 @@ class WriteFrame(Frame):
             self.payload_length = payload_length
 
         def pack(self) -> bytes:
-            return struct.pack('<BH6s6sH', self.type, self.stream_id, self.offset.to_bytes(6, 'little'), self.length.to_bytes(6, 'little'), self.payload_length)
+            return self.format.pack(self.type, self.stream_id, self.offset & 0xFFFFFFFF, self.offset >> 32, self.length & 0xFFFFFFFF, self.length >> 32, self.payload_length)
 
         @classmethod
         def unpack(cls, header_bytes: bytes) -> 'WriteFrame.Header':
-            type, stream_id, offset, length, payload_length = struct.unpack(
-                '<BH6s6sH', header_bytes)
+            type, stream_id, offset_low, offset_high, length_low, length_high, payload_length = cls.format.unpack(header_bytes)
             if type != WriteFrame.type:
                 raise ValueError(
                     f'Invalid header type: {type} (expected {WriteFrame.type})')
-            return cls(stream_id, int.from_bytes(offset, 'little'), int.from_bytes(length, 'little'), payload_length)
+            return cls(stream_id, offset_high << 32 | offset_low, length_high << 32 | length_low, payload_length)
 
     class Payload(Frame.Payload):
+        __slots__ = ("data",)
 
         def __init__(self, path: str) -> None:
             self.data = path
@@ -127,9 +170,12 @@ class WriteFrame(Frame):
 
 class ChecksumFrame(Frame):
     type = 9
+    __slots__ = ("header", "payload")
 
     class Header(Frame.Header):
-        size = struct.calcsize('<BHH')
+        __slots__ = ("type", "stream_id", "payload_length")
+        format = struct.Struct('<BHH')
+        size = format.size
 
         def __init__(self, stream_id: int, payload_length: int) -> None:
             self.type = ChecksumFrame.type
@@ -137,18 +183,18 @@ class ChecksumFrame(Frame):
             self.payload_length = payload_length
 
         def pack(self) -> bytes:
-            return struct.pack('<BHH', self.type, self.stream_id, self.payload_length)
+            return self.format.pack(self.type, self.stream_id, self.payload_length)
 
         @classmethod
         def unpack(cls, header_bytes: bytes) -> 'ChecksumFrame.Header':
-            type, stream_id, payload_length = struct.unpack(
-                '<BHH', header_bytes)
+            type, stream_id, payload_length = cls.format.unpack(header_bytes)
             if type != ChecksumFrame.type:
                 raise ValueError(
                     f'Invalid header type: {type} (expected {ChecksumFrame.type})')
             return cls(stream_id, payload_length)
 
     class Payload(Frame.Payload):
+        __slots__ = ("data",)
 
         def __init__(self, path: str) -> None:
             self.data = path
@@ -186,9 +232,14 @@ class ChecksumFrame(Frame):
 
 class StatFrame(Frame):
     type = 10
+    __slots__ = ("header", "payload")
+    # payload of the AnswerFrame to a StatFrame: size, modification time (nanoseconds) and st_mode (file type and permissions)
+    answer_format = struct.Struct('<QQI')
 
     class Header(Frame.Header):
-        size = struct.calcsize('<BHH')
+        __slots__ = ("type", "stream_id", "payload_length")
+        format = struct.Struct('<BHH')
+        size = format.size
 
         def __init__(self, stream_id: int, payload_length: int) -> None:
             self.type = StatFrame.type
@@ -196,18 +247,18 @@ class StatFrame(Frame):
             self.payload_length = payload_length
 
         def pack(self) -> bytes:
-            return struct.pack('<BHH', self.type, self.stream_id, self.payload_length)
+            return self.format.pack(self.type, self.stream_id, self.payload_length)
 
         @classmethod
         def unpack(cls, header_bytes: bytes) -> 'StatFrame.Header':
-            type, stream_id, payload_length = struct.unpack(
-                '<BHH', header_bytes)
+            type, stream_id, payload_length = cls.format.unpack(header_bytes)
             if type != StatFrame.type:
                 raise ValueError(
                     f'Invalid header type: {type} (expected {StatFrame.type})')
             return cls(stream_id, payload_length)
 
     class Payload(Frame.Payload):
+        __slots__ = ("data",)
 
         def __init__(self, path: str) -> None:
             self.data = path
@@ -229,6 +280,14 @@ class StatFrame(Frame):
     def __len__(self) -> int:
         return len(self.header) + len(self.payload)
 
+    @classmethod
+    def pack_answer(cls, size: int, mtime_ns: int, mode: int) -> bytes:
+        return cls.answer_format.pack(size, mtime_ns, mode)
+
+    @classmethod
+    def unpack_answer(cls, answer: bytes) -> tuple[int, int, int]:
+        return cls.answer_format.unpack_from(answer)
+
     def pack(self) -> bytes:
         return self.header.pack() + self.payload.pack()
 
@@ -244,9 +303,44 @@ class StatFrame(Frame):
 
 class ListFrame(Frame):
     type = 11
+    __slots__ = ("header", "payload")
+    # a listing is answered with one AnswerFrame per page: the page header (index of the page, 1 if it is
+    # the last page) is followed by the entries (size, mtime_ns, st_mode, length of the name, utf-8 name)
+    page_header = struct.Struct('<IB')
+    entry_format = struct.Struct('<QQIH')
+
+    @classmethod
+    def pack_entry(cls, name: str, size: int, mtime_ns: int, mode: int) -> bytes:
+        name_bytes = bytes(name, 'utf-8', 'surrogateescape')
+        return cls.entry_format.pack(size, mtime_ns, mode, len(name_bytes)) + name_bytes
+
+    @classmethod
+    def pack_page(cls, index: int, last: bool, entries: list[bytes]) -> bytes:
+        return cls.page_header.pack(index, last) + b"".join(entries)
+
+    @classmethod
+    def unpack_page(cls, answer: bytes) -> tuple[int, bool, list[tuple[str, int, int, int]]]:
+        # (index, last, [(name, size, mtime_ns, mode), ...])
+        if len(answer) < cls.page_header.size:
+            raise ValueError("truncated page header")
+        index, last = cls.page_header.unpack_from(answer)
+        entries = []
+        offset = cls.page_header.size
+        while offset < len(answer):
+            if offset + cls.entry_format.size > len(answer):
+                raise ValueError("truncated directory entry")
+            size, mtime_ns, mode, name_length = cls.entry_format.unpack_from(answer, offset)
+            offset += cls.entry_format.size
+            if offset + name_length > len(answer):
+                raise ValueError("truncated directory entry")
+            entries.append((str(answer[offset:offset + name_length], 'utf-8', 'replace'), size, mtime_ns, mode))
+            offset += name_length
+        return index, bool(last), entries
 
     class Header(Frame.Header):
-        size = struct.calcsize('<BHH')
+        __slots__ = ("type", "stream_id", "payload_length")
+        format = struct.Struct('<BHH')
+        size = format.size
 
         def __init__(self, stream_id: int, payload_length: int) -> None:
             self.type = ListFrame.type
@@ -254,18 +348,18 @@ class ListFrame(Frame):
             self.payload_length = payload_length
 
         def pack(self) -> bytes:
-            return struct.pack('<BHH', self.type, self.stream_id, self.payload_length)
+            return self.format.pack(self.type, self.stream_id, self.payload_length)
 
         @classmethod
         def unpack(cls, header_bytes: bytes) -> 'ListFrame.Header':
-            type, stream_id, payload_length = struct.unpack(
-                '<BHH', header_bytes)
+            type, stream_id, payload_length = cls.format.unpack(header_bytes)
             if type != ListFrame.type:
                 raise ValueError(
                     f'Invalid header type: {type} (expected {ListFrame.type})')
             return cls(stream_id, payload_length)
 
     class Payload(Frame.Payload):
+        __slots__ = ("data",)
 
         def __init__(self, path: str) -> None:
             self.data = path
@@ -298,3 +392,70 @@ class ListFrame(Frame):
             raise ValueError(
                 f'Invalid payload length: {len(payload)} (expected {header.payload_length})')
         return cls(header.stream_id, payload.data)
+
+
+class DeltaFrame(Frame):
+    type = 14
+    __slots__ = ("header", "payload")
+    # the block size is chosen by the client, see common/delta.py
+    min_block_size = 512
+    max_block_size = 16 * 1024 * 1024
+
+    class Header(Frame.Header):
+        __slots__ = ("type", "stream_id", "block_size", "signature_length", "payload_length")
+        # the 6 byte signature_length field is split into a 4 byte low and a 2 byte high part
+        format = struct.Struct('<BHIIHH')
+        size = format.size
+
+        def __init__(self, stream_id: int, block_size: int, signature_length: int, payload_length: int) -> None:
+            self.type = DeltaFrame.type
+            self.stream_id = stream_id
+            self.block_size = block_size
+            self.signature_length = signature_length
+            self.payload_length = payload_length
+
+        def pack(self) -> bytes:
+            return self.format.pack(self.type, self.stream_id, self.block_size, self.signature_length & 0xFFFFFFFF, self.signature_length >> 32, self.payload_length)
+
+        @classmethod
+        def unpack(cls, header_bytes: bytes) -> 'DeltaFrame.Header':
+            type, stream_id, block_size, signature_length_low, signature_length_high, payload_length = cls.format.unpack(header_bytes)
+            if type != DeltaFrame.type:
+                raise ValueError(
+                    f'Invalid header type: {type} (expected {DeltaFrame.type})')
+            return cls(stream_id, block_size, signature_length_high << 32 | signature_length_low, payload_length)
+
+    class Payload(Frame.Payload):
+        __slots__ = ("data",)
+
+        def __init__(self, path: str) -> None:
+            self.data = path
+
+        def __len__(self) -> int:
+            return len(self.data)
+
+        def pack(self) -> bytes:
+            return bytes(self.data, 'utf-8')
+
+        @classmethod
+        def unpack(cls, payload_bytes: bytes) -> 'DeltaFrame.Payload':
+            return cls(str(payload_bytes, 'utf-8'))
+
+    def __init__(self, stream_id: int, block_size: int, signature_length: int, payload: str) -> None:
+        self.header = self.Header(stream_id, block_size, signature_length, len(payload))
+        self.payload = self.Payload(payload)
+
+    def __len__(self) -> int:
+        return len(self.header) + len(self.payload)
+
+    def pack(self) -> bytes:
+        return self.header.pack() + self.payload.pack()
+
+    @classmethod
+    def unpack(cls, frame_bytes: bytes) -> 'DeltaFrame':
+        header = cls.Header.unpack(frame_bytes[:cls.Header.size])
+        payload = cls.Payload.unpack(frame_bytes[cls.Header.size:])
+        if len(payload) != header.payload_length:
+            raise ValueError(
+                f'Invalid payload length: {len(payload)} (expected {header.payload_length})')
+        return cls(header.stream_id, header.block_size, header.signature_length, payload.data)
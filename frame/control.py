@@ -4,20 +4,25 @@ from frame.frame import Frame
 
 class AckFrame(Frame):
     type = 0
+    __slots__ = ("header",)
+    ack_eliciting = False
+    free_list = []
 
     class Header(Frame.Header):
-        size = struct.calcsize('<BI')
+        __slots__ = ("type", "packet_id")
+        format = struct.Struct('<BI')
+        size = format.size
 
         def __init__(self, packet_id: int) -> None:
             self.type = AckFrame.type
             self.packet_id = packet_id
 
         def pack(self) -> bytes:
-            return struct.pack('<BI', self.type, self.packet_id)
+            return self.format.pack(self.type, self.packet_id)
 
         @classmethod
         def unpack(cls, header_bytes: bytes) -> 'AckFrame.Header':
-            type, packet_id = struct.unpack('<BI', header_bytes)
+            type, packet_id = cls.format.unpack(header_bytes)
             if type != AckFrame.type:
                 raise ValueError(
                     f'Invalid header type: {type} (expected {AckFrame.type})')
@@ -26,6 +31,15 @@ class AckFrame(Frame):
     def __init__(self, packet_id: int) -> None:
         self.header = self.Header(packet_id)
 
+    @classmethod
+    def create(cls, packet_id: int) -> 'AckFrame':
+        # same as AckFrame(...), but reuses a released frame if there is one
+        if not cls.free_list:
+            return cls(packet_id)
+        frame = cls.free_list.pop()
+        frame.header.packet_id = packet_id
+        return frame
+
     def __len__(self) -> int:
         return len(self.header)
 
@@ -37,22 +51,30 @@ class AckFrame(Frame):
         header = cls.Header.unpack(frame_bytes[:cls.Header.size])
         return cls(header.packet_id)
 
+    @classmethod
+    def unpack_from(cls, buffer: memoryview, offset: int) -> tuple['AckFrame', int]:
+        _, packet_id = cls.Header.format.unpack_from(buffer, offset)
+        return cls.create(packet_id), offset + cls.Header.size
+
 
 class ExitFrame(Frame):
     type = 1
+    __slots__ = ("header",)
 
     class Header(Frame.Header):
-        size = struct.calcsize('<B')
+        __slots__ = ("type",)
+        format = struct.Struct('<B')
+        size = format.size
 
         def __init__(self) -> None:
             self.type = ExitFrame.type
 
         def pack(self) -> bytes:
-            return struct.pack('<B', self.type)
+            return self.format.pack(self.type)
 
         @classmethod
         def unpack(cls, header_bytes: bytes) -> 'ExitFrame.Header':
-            type = struct.unpack('<B', header_bytes)[0]
+            type = cls.format.unpack(header_bytes)[0]
             if type != ExitFrame.type:
                 raise ValueError(
                     f'Invalid header type: {type} (expected {ExitFrame.type})')
@@ -75,9 +97,12 @@ class ExitFrame(Frame):
 
 class ConnectionIDChangeFrame(Frame):
     type = 2
+    __slots__ = ("header",)
 
     class Header(Frame.Header):
-        size = struct.calcsize('<BII')
+        __slots__ = ("type", "old_connection_id", "new_connection_id")
+        format = struct.Struct('<BII')
+        size = format.size
 
         def __init__(self, old_connection_id: int, new_connection_id: int) -> None:
             self.type = ConnectionIDChangeFrame.type
@@ -85,12 +110,11 @@ class ConnectionIDChangeFrame(Frame):
             self.new_connection_id = new_connection_id
 
         def pack(self) -> bytes:
-            return struct.pack('<BII', self.type, self.old_connection_id, self.new_connection_id)
+            return self.format.pack(self.type, self.old_connection_id, self.new_connection_id)
 
         @classmethod
         def unpack(cls, header_bytes: bytes) -> 'ConnectionIDChangeFrame.Header':
-            type, old_connection_id, new_connection_id = struct.unpack(
-                '<BII', header_bytes)
+            type, old_connection_id, new_connection_id = cls.format.unpack(header_bytes)
             if type != ConnectionIDChangeFrame.type:
                 raise ValueError(
                     f'Invalid header type: {type} (expected {ConnectionIDChangeFrame.type})')
@@ -113,20 +137,23 @@ class ConnectionIDChangeFrame(Frame):
 
 class FlowControlFrame(Frame):
     type = 3
+    __slots__ = ("header",)
 
     class Header(Frame.Header):
-        size = struct.calcsize('<BI')
+        __slots__ = ("type", "window_size")
+        format = struct.Struct('<BI')
+        size = format.size
 
         def __init__(self, window_size: int) -> None:
             self.type = FlowControlFrame.type
             self.window_size = window_size
 
         def pack(self) -> bytes:
-            return struct.pack('<BI', self.type, self.window_size)
+            return self.format.pack(self.type, self.window_size)
 
         @classmethod
         def unpack(cls, header_bytes: bytes) -> 'FlowControlFrame.Header':
-            type, window_size = struct.unpack('<BI', header_bytes)
+            type, window_size = cls.format.unpack(header_bytes)
             if type != FlowControlFrame.type:
                 raise ValueError(
                     f'Invalid header type: {type} (expected {FlowControlFrame.type})')
@@ -149,9 +176,12 @@ class FlowControlFrame(Frame):
 
 class AnswerFrame(Frame):
     type = 4
+    __slots__ = ("header", "payload")
 
     class Header(Frame.Header):
-        size = struct.calcsize('<BHH')
+        __slots__ = ("type", "stream_id", "payload_length")
+        format = struct.Struct('<BHH')
+        size = format.size
 
         def __init__(self, stream_id: int, payload_length: int) -> None:
             self.type = AnswerFrame.type
@@ -159,18 +189,18 @@ class AnswerFrame(Frame):
             self.payload_length = payload_length
 
         def pack(self) -> bytes:
-            return struct.pack('<BHH', self.type, self.stream_id, self.payload_length)
+            return self.format.pack(self.type, self.stream_id, self.payload_length)
 
         @classmethod
         def unpack(cls, header_bytes: bytes) -> 'AnswerFrame.Header':
-            type, stream_id, payload_length = struct.unpack(
-                '<BHH', header_bytes)
+            type, stream_id, payload_length = cls.format.unpack(header_bytes)
             if type != AnswerFrame.type:
                 raise ValueError(
                     f'Invalid header type: {type} (expected {AnswerFrame.type})')
             return cls(stream_id, payload_length)
 
     class Payload(Frame.Payload):
+        __slots__ = ("data",)
 
         def __init__(self, payload: bytes) -> None:
             self.data = payload
@@ -207,9 +237,12 @@ class AnswerFrame(Frame):
 
 class ErrorFrame(Frame):
     type = 5
+    __slots__ = ("header", "payload")
 
     class Header(Frame.Header):
-        size = struct.calcsize('<BHH')
+        __slots__ = ("type", "stream_id", "payload_length")
+        format = struct.Struct('<BHH')
+        size = format.size
 
         def __init__(self, stream_id: int, payload_length: int) -> None:
             self.type = ErrorFrame.type
@@ -217,18 +250,18 @@ class ErrorFrame(Frame):
             self.payload_length = payload_length
 
         def pack(self) -> bytes:
-            return struct.pack('<BHH', self.type, self.stream_id, self.payload_length)
+            return self.format.pack(self.type, self.stream_id, self.payload_length)
 
         @classmethod
         def unpack(cls, header_bytes: bytes) -> 'ErrorFrame.Header':
-            type, stream_id, payload_length = struct.unpack(
-                '<BHH', header_bytes)
+            type, stream_id, payload_length = cls.format.unpack(header_bytes)
             if type != ErrorFrame.type:
                 raise ValueError(
                     f'Invalid header type: {type} (expected {cls.type})')
             return cls(stream_id, payload_length)
 
     class Payload(Frame.Payload):
+        __slots__ = ("data",)
 
         def __init__(self, message: str) -> None:
             self.data = message
@@ -261,3 +294,160 @@ class ErrorFrame(Frame):
             raise ValueError(
                 f'Invalid payload length: {len(payload)} (expected {header.payload_length})')
         return cls(header.stream_id, payload.data)
+
+
+class PaddingFrame(Frame):
+    type = 12
+    __slots__ = ("header", "payload")
+
+    class Header(Frame.Header):
+        __slots__ = ("type", "payload_length")
+        format = struct.Struct('<BH')
+        size = format.size
+
+        def __init__(self, payload_length: int) -> None:
+            self.type = PaddingFrame.type
+            self.payload_length = payload_length
+
+        def pack(self) -> bytes:
+            return self.format.pack(self.type, self.payload_length)
+
+        @classmethod
+        def unpack(cls, header_bytes: bytes) -> 'PaddingFrame.Header':
+            type, payload_length = cls.format.unpack(header_bytes)
+            if type != PaddingFrame.type:
+                raise ValueError(
+                    f'Invalid header type: {type} (expected {PaddingFrame.type})')
+            return cls(payload_length)
+
+    class Payload(Frame.Payload):
+        # only the length is kept, the zero bytes are written when the frame is packed
+        __slots__ = ("length",)
+
+        def __init__(self, length: int) -> None:
+            self.length = length
+
+        def __len__(self) -> int:
+            return self.length
+
+        def pack(self) -> bytes:
+            return bytes(self.length)
+
+        def pack_into(self, buffer: bytearray, offset: int) -> int:
+            # pad bytes of a struct format are written as zeros
+            struct.pack_into(f'{self.length}x', buffer, offset)
+            return offset + self.length
+
+        @classmethod
+        def unpack(cls, payload_bytes: bytes) -> 'PaddingFrame.Payload':
+            return cls(len(payload_bytes))
+
+    def __init__(self, length: int) -> None:
+        # padding frames only exist to inflate a packet to a given size (used for path MTU probes)
+        self.header = self.Header(length)
+        self.payload = self.Payload(length)
+
+    def __len__(self) -> int:
+        return len(self.header) + len(self.payload)
+
+    def pack(self) -> bytes:
+        return self.header.pack() + self.payload.pack()
+
+    def pack_into(self, buffer: bytearray, offset: int) -> int:
+        return self.payload.pack_into(buffer, self.header.pack_into(buffer, offset))
+
+    @classmethod
+    def unpack(cls, frame_bytes: bytes) -> 'PaddingFrame':
+        header = cls.Header.unpack(frame_bytes[:cls.Header.size])
+        payload = cls.Payload.unpack(frame_bytes[cls.Header.size:])
+        if len(payload) != header.payload_length:
+            raise ValueError(
+                f'Invalid payload length: {len(payload)} (expected {header.payload_length})')
+        return cls(header.payload_length)
+
+    @classmethod
+    def unpack_from(cls, buffer: memoryview, offset: int) -> tuple['PaddingFrame', int]:
+        _, payload_length = cls.Header.format.unpack_from(buffer, offset)
+        end = offset + cls.Header.size + payload_length
+        if end > len(buffer):
+            raise ValueError(
+                f'Invalid payload length: {payload_length} (exceeds the packet)')
+        return cls(payload_length), end
+
+
+class SackFrame(Frame):
+    type = 13
+    __slots__ = ("header", "payload")
+    ack_eliciting = False
+    range_format = struct.Struct('<II')
+
+    class Header(Frame.Header):
+        __slots__ = ("type", "packet_id", "payload_length")
+        format = struct.Struct('<BIH')
+        size = format.size
+
+        def __init__(self, packet_id: int, payload_length: int) -> None:
+            self.type = SackFrame.type
+            self.packet_id = packet_id
+            self.payload_length = payload_length
+
+        def pack(self) -> bytes:
+            return self.format.pack(self.type, self.packet_id, self.payload_length)
+
+        @classmethod
+        def unpack(cls, header_bytes: bytes) -> 'SackFrame.Header':
+            type, packet_id, payload_length = cls.format.unpack(header_bytes)
+            if type != SackFrame.type:
+                raise ValueError(
+                    f'Invalid header type: {type} (expected {SackFrame.type})')
+            return cls(packet_id, payload_length)
+
+    class Payload(Frame.Payload):
+        __slots__ = ("data",)
+
+        def __init__(self, ranges: list[tuple[int, int]]) -> None:
+            # inclusive (first, last) packet_id ranges that were received in addition to the cumulative ack
+            self.data = ranges
+
+        def __len__(self) -> int:
+            return len(self.data) * SackFrame.range_format.size
+
+        def pack(self) -> bytes:
+            return b''.join(SackFrame.range_format.pack(first, last) for first, last in self.data)
+
+        @classmethod
+        def unpack(cls, payload_bytes: bytes) -> 'SackFrame.Payload':
+            if len(payload_bytes) % SackFrame.range_format.size != 0:
+                raise ValueError(
+                    f'Invalid payload length: {len(payload_bytes)} (expected a multiple of {SackFrame.range_format.size})')
+            return cls(list(SackFrame.range_format.iter_unpack(payload_bytes)))
+
+    def __init__(self, packet_id: int, ranges: list[tuple[int, int]]) -> None:
+        # packet_id has the same meaning as in an AckFrame: all packets up to packet_id were received
+        self.header = self.Header(packet_id, len(ranges) * self.range_format.size)
+        self.payload = self.Payload(ranges)
+
+    def __len__(self) -> int:
+        return len(self.header) + len(self.payload)
+
+    def pack(self) -> bytes:
+        return self.header.pack() + self.payload.pack()
+
+    @classmethod
+    def unpack(cls, frame_bytes: bytes) -> 'SackFrame':
+        header = cls.Header.unpack(frame_bytes[:cls.Header.size])
+        payload = cls.Payload.unpack(frame_bytes[cls.Header.size:])
+        if len(payload) != header.payload_length:
+            raise ValueError(
+                f'Invalid payload length: {len(payload)} (expected {header.payload_length})')
+        return cls(header.packet_id, payload.data)
+
+    @classmethod
+    def unpack_from(cls, buffer: memoryview, offset: int) -> tuple['SackFrame', int]:
+        _, packet_id, payload_length = cls.Header.format.unpack_from(buffer, offset)
+        start = offset + cls.Header.size
+        end = start + payload_length
+        if end > len(buffer) or payload_length % cls.range_format.size != 0:
+            raise ValueError(
+                f'Invalid payload length: {payload_length}')
+        return cls(packet_id, list(cls.range_format.iter_unpack(buffer[start:end]))), end
@@ -4,9 +4,15 @@ from frame.frame import Frame
 
 class DataFrame(Frame):
     type = 6
+    __slots__ = ("header", "payload")
+    max_payload_size = 2**16 - 1  # payload_length is a 16 bit field
+    free_list = []
 
     class Header(Frame.Header):
-        size = struct.calcsize('<BH6sH')
+        __slots__ = ("type", "stream_id", "offset", "payload_length")
+        # the 6 byte offset field is split into a 4 byte low and a 2 byte high part
+        format = struct.Struct('<BHIHH')
+        size = format.size
 
         def __init__(self, stream_id: int, offset: int, payload_length: int) -> None:
             self.type = DataFrame.type
@@ -15,18 +21,22 @@ class DataFrame(Frame):
             self.payload_length = payload_length
 
         def pack(self) -> bytes:
-            return struct.pack('<BH6sH', self.type, self.stream_id, int.to_bytes(self.offset, 6, 'little'), self.payload_length)
+            return self.format.pack(self.type, self.stream_id, self.offset & 0xFFFFFFFF, self.offset >> 32, self.payload_length)
+
+        def pack_into(self, buffer: bytearray, offset: int) -> int:
+            self.format.pack_into(buffer, offset, self.type, self.stream_id, self.offset & 0xFFFFFFFF, self.offset >> 32, self.payload_length)
+            return offset + self.size
 
         @classmethod
         def unpack(cls, header_bytes: bytes) -> 'DataFrame.Header':
-            type, stream_id, offset, payload_length = struct.unpack(
-                '<BH6sH', header_bytes)
+            type, stream_id, offset_low, offset_high, payload_length = cls.format.unpack(header_bytes)
             if type != DataFrame.type:
                 raise ValueError(
                     f'Invalid header type: {type} (expected {DataFrame.type})')
-            return cls(stream_id, int.from_bytes(offset, 'little'), payload_length)
+            return cls(stream_id, offset_high << 32 | offset_low, payload_length)
 
     class Payload(Frame.Payload):
+        __slots__ = ("data",)
 
         def __init__(self, payload: bytes) -> None:
             self.data = payload
@@ -45,6 +55,23 @@ class DataFrame(Frame):
         self.header = self.Header(stream_id, offset, len(payload))
         self.payload = self.Payload(payload)
 
+    @classmethod
+    def create(cls, stream_id: int, offset: int, payload: bytes) -> 'DataFrame':
+        # same as DataFrame(...), but reuses a released frame (and its header and payload objects) if there is one
+        if not cls.free_list:
+            return cls(stream_id, offset, payload)
+        frame = cls.free_list.pop()
+        frame.header.stream_id = stream_id
+        frame.header.offset = offset
+        frame.header.payload_length = len(payload)
+        frame.payload.data = payload
+        return frame
+
+    def release(self) -> None:
+        # the file data must not be kept alive by the free list
+        self.payload.data = None
+        super().release()
+
     def __len__(self) -> int:
         return len(self.header) + len(self.payload)
 
@@ -59,3 +86,14 @@ class DataFrame(Frame):
             raise ValueError(
                 f'Invalid payload length: {len(payload)} (expected {header.payload_length})')
         return cls(header.stream_id, header.offset, payload.data)
+
+    @classmethod
+    def unpack_from(cls, buffer: memoryview, offset: int) -> tuple['DataFrame', int]:
+        # the payload is a memoryview of the received packet, it is not copied until it is written to the file
+        _, stream_id, offset_low, offset_high, payload_length = cls.Header.format.unpack_from(buffer, offset)
+        start = offset + cls.Header.size
+        end = start + payload_length
+        if end > len(buffer):
+            raise ValueError(
+                f'Invalid payload length: {payload_length} (exceeds the packet)')
+        return cls.create(stream_id, offset_high << 32 | offset_low, buffer[start:end]), end
@@ -5,8 +5,17 @@ from typing import Self
 
 class Frame(abc.ABC):
     type = ...
+    # frames, headers and payloads are created for every single packet, so none of them has a __dict__.
+    # subclasses list their attributes in __slots__
+    __slots__ = ()
+    # packets that contain at least one ack-eliciting frame are acknowledged and retransmitted
+    ack_eliciting = True
+    # frame types that are created very often keep released frames for reuse (see create() and release())
+    free_list: list | None = None
+    free_list_size = 1024
 
     class Header(abc.ABC):
+        __slots__ = ()
         size = ...
 
         def __repr__(self) -> str:
@@ -22,16 +31,23 @@ class Frame(abc.ABC):
         def pack(self) -> bytes:
             ...
 
+        def pack_into(self, buffer: bytearray, offset: int) -> int:
+            # writes the header into buffer at offset and returns the offset behind it
+            data = self.pack()
+            buffer[offset:offset + len(data)] = data
+            return offset + len(data)
+
         @classmethod
         @abc.abstractmethod
         def unpack(cls, header_bytes: bytes) -> Self:
             ...
 
         def to_dict(self):
-            return {key: (value.hex() if isinstance(value, bytes) else value)
-                    for key, value in self.__dict__.items()}
+            return {key: (value.hex() if isinstance(value, (bytes, memoryview)) else value)
+                    for key, value in ((key, getattr(self, key)) for key in self.__slots__)}
 
     class Payload(abc.ABC):
+        __slots__ = ()
 
         def __repr__(self) -> str:
             return json.dumps(self.to_dict(), indent=4)
@@ -53,8 +69,8 @@ class Frame(abc.ABC):
             ...
 
         def to_dict(self):
-            return {key: (value.hex() if isinstance(value, bytes) else value)
-                    for key, value in self.__dict__.items()}
+            return {key: (value.hex() if isinstance(value, (bytes, memoryview)) else value)
+                    for key, value in ((key, getattr(self, key)) for key in self.__slots__)}
 
     def __repr__(self) -> str:
         return json.dumps(self.to_dict(), indent=4)
@@ -70,11 +86,38 @@ class Frame(abc.ABC):
     def pack(self) -> bytes:
         ...
 
+    def pack_into(self, buffer: bytearray, offset: int) -> int:
+        # writes the frame into buffer at offset (without building intermediate bytes objects
+        # for the whole frame) and returns the offset behind it. used by Packet.pack()
+        offset = self.header.pack_into(buffer, offset)
+        if hasattr(self, "payload"):
+            data = self.payload.pack()
+            buffer[offset:offset + len(data)] = data
+            offset += len(data)
+        return offset
+
     @classmethod
     @abc.abstractmethod
     def unpack(cls, frame_bytes: bytes) -> Self:
         ...
 
+    @classmethod
+    def unpack_from(cls, buffer: memoryview, offset: int) -> tuple[Self, int]:
+        # decodes the frame starting at offset and returns it together with the offset behind it. used by
+        # Packet.unpack(). frames that are received often override this to decode without any copies
+        end = offset + cls.Header.size
+        header = cls.Header.unpack(buffer[offset:end])
+        end += getattr(header, "payload_length", 0)
+        if end > len(buffer):
+            raise ValueError(f'Invalid payload length: {header.payload_length} (exceeds the packet)')
+        return cls.unpack(bytes(buffer[offset:end])), end
+
+    def release(self) -> None:
+        # hands the frame back for reuse. must only be called once the frame is not referenced anymore,
+        # i.e. after the packet containing it was acknowledged (sender) or delivered (receiver)
+        if self.free_list is not None and len(self.free_list) < self.free_list_size:
+            self.free_list.append(self)
+
     def to_dict(self):
         if hasattr(self, "payload"):
             return {"header": self.header.to_dict(), "payload": self.payload.to_dict()}
@@ -1,5 +1,7 @@
 # main.py
-from app import run_client, run_server
+from app import run_client, run_server, run_parallel_client, run_metadata_client
+from common import congestion_control_algorithms, stream_schedulers, durability_policies, compression_codecs
+from frame import ReadFrame
 
 import argparse
 import textwrap
@@ -8,6 +10,16 @@ import logging
 import time
 import pathlib
 
+def parse_per_file_values(values: list[str] | None, name: str, minimum: int, maximum: int) -> dict[str, int]:
+    # values of the form FILE=N, e.g. --priority big.iso=0 --priority small.txt=7
+    parsed = {}
+    for value in values or []:
+        path, _, number = value.rpartition("=")
+        if not path or not number.isdigit() or not minimum <= int(number) <= maximum:
+            sys.exit(f"{name} must be given as FILE=N with N between {minimum} and {maximum}")
+        parsed[path] = int(number)
+    return parsed
+
 def main():
     parser = argparse.ArgumentParser(
         prog='rft',
@@ -74,6 +86,97 @@ def main():
         default=False,
         help="specifies if the program should use ipv6 (default: False)",
     )
+    parser.add_argument(
+        '--congestion-control',
+        action='store',
+        type=str,
+        choices=congestion_control_algorithms.keys(),
+        default='cubic',
+        help="specifies the congestion control algorithm used for sending (default: cubic)",
+    )
+    parser.add_argument(
+        '--no-pacing',
+        action='store_false',
+        dest='pacing',
+        help="sends the whole congestion window at once instead of spreading it over a round trip",
+    )
+    parser.add_argument(
+        '--durability',
+        action='store',
+        type=str,
+        choices=durability_policies,
+        default='none',
+        help="when received files are synced to disk: none (left to the os), end (once complete) or periodic (default: none)",
+    )
+    parser.add_argument(
+        '--stat',
+        action='store_true',
+        help="prints the size, modification time and mode of the files instead of fetching them",
+    )
+    parser.add_argument(
+        '--list',
+        action='store_true',
+        help="prints the entries of the directories on the server instead of fetching files",
+    )
+    parser.add_argument(
+        '--delta',
+        action='store_true',
+        help="only fetches the differences to files that exist already (rsync algorithm), instead of resuming them",
+    )
+    parser.add_argument(
+        '--compress',
+        action='store_true',
+        help="accepts compressed data from the server, for files that compress well",
+    )
+    parser.add_argument(
+        '--compression',
+        action='store',
+        type=str,
+        choices=("none",) + compression_codecs,
+        default='zlib',
+        help="codec the server compresses with if a client accepts compressed data (default: zlib)",
+    )
+    parser.add_argument(
+        '--workers',
+        action='store',
+        type=int,
+        default=1,
+        help="number of server processes that share the port, connections are spread over them (default: 1)",
+    )
+    parser.add_argument(
+        '--parallel',
+        action='store',
+        type=int,
+        default=1,
+        help="number of connections each file is fetched over, in parallel byte ranges (default: 1)",
+    )
+    parser.add_argument(
+        '--segments',
+        action='store',
+        type=int,
+        default=1,
+        help="number of byte ranges each file is fetched as, all of them over the same connection (default: 1)",
+    )
+    parser.add_argument(
+        '--scheduler',
+        action='store',
+        type=str,
+        choices=stream_schedulers.keys(),
+        default='rr',
+        help="specifies the order in which the server sends the requested files (default: rr)",
+    )
+    parser.add_argument(
+        '--priority',
+        action='append',
+        metavar='FILE=N',
+        help=f"priority of a file (0-{ReadFrame.max_priority}, default: 0), used by the priority scheduler of the server",
+    )
+    parser.add_argument(
+        '--weight',
+        action='append',
+        metavar='FILE=N',
+        help=f"weight of a file (1-{ReadFrame.max_weight}, default: 1), used by the drr scheduler of the server",
+    )
     parser.add_argument(
         'file',
         type=str,
@@ -88,6 +191,58 @@ def main():
     if not args.server and (not args.host or len(args.file) == 0):
         sys.exit("in client mode the host and at least one filename must be specified")
 
+    if not args.server and args.workers != 1:
+        sys.exit("workers can only be specified in server mode")
+
+    if not 1 <= args.workers <= 256:
+        sys.exit("the number of workers must be between 1 and 256")
+
+    if args.server and args.parallel != 1:
+        sys.exit("parallel can only be specified in client mode")
+
+    if not 1 <= args.parallel <= 64:
+        sys.exit("the number of parallel connections must be between 1 and 64")
+
+    if args.server and args.segments != 1:
+        sys.exit("segments can only be specified in client mode")
+
+    if not 1 <= args.segments <= 64:
+        sys.exit("the number of segments must be between 1 and 64")
+
+    if args.server and args.delta:
+        sys.exit("delta can only be specified in client mode")
+
+    if args.delta and (args.parallel > 1 or args.segments > 1):
+        sys.exit("delta can not be combined with parallel or segments")
+
+    if args.parallel > 1 and args.segments > 1:
+        sys.exit("parallel and segments can not be combined")
+
+    if args.parallel > 1 and (args.priority or args.weight):
+        # the files are fetched one after the other, every range over a connection of its own
+        sys.exit("priorities and weights can not be combined with parallel")
+
+    if args.server and (args.stat or args.list):
+        sys.exit("stat and list can only be specified in client mode")
+
+    if args.stat and args.list:
+        sys.exit("stat and list can not be combined")
+
+    if args.server and args.compress:
+        sys.exit("compress can only be specified in client mode, the server uses --compression")
+
+    if not args.server and args.compression != "zlib":
+        sys.exit("compression can only be specified in server mode, the client uses --compress")
+
+    if args.server and args.durability != "none":
+        sys.exit("durability can only be specified in client mode")
+
+    if args.server and (args.priority or args.weight):
+        sys.exit("priorities and weights can only be specified in client mode")
+
+    priorities = parse_per_file_values(args.priority, "priority", 0, ReadFrame.max_priority)
+    weights = parse_per_file_values(args.weight, "weight", 1, ReadFrame.max_weight)
+
     if not 0 <= args.p <= 1 or not 0 <= args.q <= 1:
         sys.exit("p and q probabilities must be between 0 and 1")
 
@@ -99,10 +254,16 @@ def main():
     logging.basicConfig(level=logging_level, format="[ %(levelname)s ] %(filename)s:%(funcName)s (%(lineno)d):\t\t %(message)s")
 
     if args.server:
-        run_server(args.port, args.p, args.q, args.ipv6)
+        run_server(args.port, args.p, args.q, args.ipv6, args.congestion_control, args.pacing, args.workers, args.scheduler, args.compression)
+    elif args.stat or args.list:
+        if not run_metadata_client(args.host, args.port, args.file, "stat" if args.stat else "list", args.p, args.q, args.ipv6):
+            sys.exit(1)
     else:
         start = time.time()
-        run_client(args.host, args.port, args.file, args.p, args.q, args.ipv6)
+        if args.parallel > 1:
+            run_parallel_client(args.host, args.port, args.file, args.parallel, args.p, args.q, args.ipv6, args.congestion_control, args.pacing, args.durability, args.compress)
+        else:
+            run_client(args.host, args.port, args.file, args.p, args.q, args.ipv6, args.congestion_control, args.pacing, priorities, weights, args.durability, args.segments, args.compress, args.delta)
         end = time.time()
         print("Time taken: " + str(end - start) + " seconds")
         # check which files were saved
@@ -18,14 +18,24 @@ frame_types = {
     9: ChecksumFrame,
     10: StatFrame,
     11: ListFrame,
+    12: PaddingFrame,
+    13: SackFrame,
+    14: DeltaFrame,
 }
 
+# frame type -> function that decodes a frame of this type from a buffer at an offset
+frame_decoders = {frame_type: frame_class.unpack_from for frame_type, frame_class in frame_types.items()}
+
 
 class Packet:
+    __slots__ = ("header", "frames", "wire_bytes")
 
     class Header:
+        __slots__ = ("version", "connection_id", "packet_id", "checksum")
 
-        size = struct.calcsize('<BII3s')
+        # the 3 byte checksum field is split into a 2 byte low and a 1 byte high part
+        format = struct.Struct('<BIIHB')
+        size = format.size
 
         def __init__(self, version: int, connection_id: int, packet_id: int, checksum: int) -> None:
             self.version = version
@@ -43,13 +53,16 @@ class Packet:
             return self.size
 
         def pack(self) -> bytes:
-            return struct.pack('<BII3s', self.version, self.connection_id, self.packet_id, self.checksum.to_bytes(4, "little")[:3])
+            return self.format.pack(self.version, self.connection_id, self.packet_id, self.checksum & 0xFFFF, self.checksum >> 16 & 0xFF)
+
+        def pack_into(self, buffer: bytearray, offset: int) -> int:
+            self.format.pack_into(buffer, offset, self.version, self.connection_id, self.packet_id, self.checksum & 0xFFFF, self.checksum >> 16 & 0xFF)
+            return offset + self.size
 
         @classmethod
         def unpack(cls, packet_bytes: bytes):
-            version, connection_id, packet_id, checksum = struct.unpack(
-                '<BII3s', packet_bytes[:cls.size])
-            return cls(version, connection_id, packet_id, int.from_bytes(checksum, "little"))
+            version, connection_id, packet_id, checksum_low, checksum_high = cls.format.unpack_from(packet_bytes)
+            return cls(version, connection_id, packet_id, checksum_high << 16 | checksum_low)
 
         def to_dict(self):
             return {
@@ -62,7 +75,9 @@ class Packet:
     def __init__(self, version: int, connection_id: int, packet_id: int, frames: list) -> None:
         self.header = Packet.Header(version, connection_id, packet_id, 0)
         self.frames = frames
-        self.header.checksum = self.calculateChecksum()
+        # the encoded packet, created once by pack() (or the received bytes if the packet was unpacked).
+        # frames must not be changed after the packet was packed
+        self.wire_bytes = None
 
     def __repr__(self) -> str:
         return json.dumps(self.to_dict(), indent=4)
@@ -74,7 +89,18 @@ class Packet:
         return self.header.size + sum([len(frame) for frame in self.frames])
 
     def pack(self) -> bytes:
-        return self.header.pack() + b''.join(frame.pack() for frame in self.frames)
+        if self.wire_bytes is None:
+            # single pass: header and frames are written into one preallocated buffer, the checksum
+            # is calculated while the checksum field is still zeroed and written into it at last
+            buffer = bytearray(len(self))
+            self.header.checksum = 0
+            offset = self.header.pack_into(buffer, 0)
+            for frame in self.frames:
+                offset = frame.pack_into(buffer, offset)
+            self.header.checksum = crc32(buffer) & 0xFFFFFF
+            self.header.pack_into(buffer, 0)
+            self.wire_bytes = buffer
+        return self.wire_bytes
 
     def createCopy(header: Header, frames: list):
         packet = Packet(header.version, header.connection_id,
@@ -84,33 +110,35 @@ class Packet:
 
     @classmethod
     def unpack(cls, packet_bytes: bytes) -> 'Packet':
+        # the frames are decoded from a single memoryview with an offset cursor (no copies of the remaining bytes)
+        buffer = memoryview(packet_bytes)
         try:
-            header = Packet.Header.unpack(packet_bytes[:Packet.Header.size])
+            header = Packet.Header.unpack(buffer)
         except struct.error:
             raise ValueError("Invalid packet header")
         frames = []
-        frames_bytes = packet_bytes[Packet.Header.size:]
-        while frames_bytes:
-            frame_type = frames_bytes[0]
-            frame_header = frame_types[frame_type].Header.unpack(
-                frames_bytes[:frame_types[frame_type].Header.size])
-            # if freame has a payload
-            if hasattr(frame_header, "payload_length"):
-                frame = frame_types[frame_type].unpack(
-                    frames_bytes[:frame_types[frame_type].Header.size + frame_header.payload_length])
-            else:
-                frame = frame_types[frame_type].unpack(
-                    frames_bytes[:frame_types[frame_type].Header.size])
+        offset = Packet.Header.size
+        while offset < len(buffer):
+            decoder = frame_decoders.get(buffer[offset])
+            if decoder is None:
+                raise ValueError(f"Invalid frame type: {buffer[offset]}")
+            try:
+                frame, offset = decoder(buffer, offset)
+            except struct.error:
+                raise ValueError(f"Truncated frame of type {buffer[offset]}")
             frames.append(frame)
-            frames_bytes = frames_bytes[len(frame):]
-        return cls.createCopy(header, frames)
+        packet = cls.createCopy(header, frames)
+        packet.wire_bytes = packet_bytes
+        return packet
 
     def calculateChecksum(self):
-        data = self.pack()
-        data = b"".join([data[:Packet.Header.size-3],
-                        bytes(b"\x00\x00\x00"), data[Packet.Header.size:]])
-
-        return int.from_bytes(crc32(data).to_bytes(4, "little")[:3], "little")
+        # crc32 (truncated to 3 bytes) of the encoded packet with a zeroed checksum field. calculated over
+        # the segments around the checksum field, s.t. received packets do not need to be copied
+        data = memoryview(self.pack())
+        checksum = crc32(data[:Packet.Header.size - 3])
+        checksum = crc32(b"\x00\x00\x00", checksum)
+        checksum = crc32(data[Packet.Header.size:], checksum)
+        return checksum & 0xFFFFFF
 
     @property
     def correctChecksum(self):
@@ -123,4 +151,7 @@ class Packet:
         }
     
     def contains_non_ack_frame(self):
-        return any([not isinstance(frame, AckFrame) for frame in self.frames])
+        return any(frame.ack_eliciting for frame in self.frames)
+
+    def is_mtu_probe(self):
+        return len(self.frames) > 0 and all(isinstance(frame, PaddingFrame) for frame in self.frames)
@@ -4,8 +4,12 @@ import os
 import pytest
 import hashlib
 import time
+import sys
 import unshare
 
+# the unit tests below import the modules of the project directly
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
 @pytest.fixture(autouse=True)
 def lo_up():
     unshare.unshare(unshare.CLONE_NEWNET)
@@ -125,3 +129,1050 @@ def test_send_file_with_loss(executable, server_dir, client_dir):
 
     server.kill()
     client.kill()
+
+
+def test_async_client_and_server(server_dir, client_dir):
+    import asyncio
+    from app import AsyncServer, AsyncClient, TransferError
+
+    async def transfer():
+        async with AsyncServer(12349) as server:
+            async with AsyncClient("127.0.0.1", 12349) as client:
+                # both transfers share one connection
+                await asyncio.gather(
+                    client.fetch(str(Path(server_dir).joinpath("LICENSE")), str(Path(client_dir).joinpath("LICENSE"))),
+                    client.fetch(str(Path(server_dir).joinpath("LICENSE")), str(Path(client_dir).joinpath("LICENSE2"))),
+                )
+                with pytest.raises(TransferError):
+                    await client.fetch(str(Path(server_dir).joinpath("LICENCE")), str(Path(client_dir).joinpath("LICENCE")))
+
+    asyncio.run(asyncio.wait_for(transfer(), timeout=20))
+
+    input = Path(server_dir).joinpath("LICENSE").read_bytes()
+    for name in ["LICENSE", "LICENSE2"]:
+        if Path(client_dir).joinpath(name).read_bytes() != input:
+            pytest.fail("File that Client received is not equal to original file")
+
+
+def test_async_connection_manager_wake():
+    import asyncio
+    import threading
+    from common import AsyncConnectionManager
+
+    class FakeConnection:
+        connection_id = 1
+
+        def __init__(self, flushed: asyncio.Event) -> None:
+            self.flushed = flushed
+
+        def flush(self) -> None:
+            self.flushed.set()
+
+        def is_closed(self) -> bool:
+            return False
+
+        def next_deadline(self, current_time: float) -> float:
+            return current_time + 60
+
+    async def wake_from_thread():
+        connection_manager = AsyncConnectionManager(0)
+        await connection_manager.start()
+        connection = FakeConnection(asyncio.Event())
+        connection_manager.connections[connection.connection_id] = connection
+        # e.g. a checksum of the server that finished on the thread pool
+        thread = threading.Thread(target=connection_manager.wake, args=(connection,))
+        thread.start()
+        thread.join()
+        await asyncio.wait_for(connection.flushed.wait(), timeout=5)
+        connection_manager.close()
+
+    asyncio.run(wake_from_thread())
+
+def test_send_compressed_file(executable, server_dir, client_dir):
+    server = subprocess.Popen([executable, "-s", "--port", "12350", "--verbose"], cwd=server_dir)
+
+    client = subprocess.Popen([executable, "--host", "localhost", "--port", "12350", "LICENSE", "--compress", "--verbose"], cwd=client_dir)
+
+    exitcode = client.wait(timeout=10)
+
+    if not Path(client_dir).joinpath("LICENSE").exists():
+        pytest.fail("Client did not receive LICENSE file")
+
+    input = Path(server_dir).joinpath("LICENSE").read_bytes()
+    output = Path(client_dir).joinpath("LICENSE").read_bytes()
+
+    if input != output:
+        pytest.fail("File that Client received is not equal to original file")
+
+    if not exitcode == 0:
+        pytest.fail(f"Expected exit code 0 but got exit code {exitcode}")
+
+    server.kill()
+    client.kill()
+
+
+def test_workers_forward_datagrams_of_other_workers(executable, server_dir, client_dir):
+    import multiprocessing
+    import select
+    import socket
+    import struct
+    import threading
+    from app.server import run_worker
+
+    # two workers on their own ports, and a proxy in front of them. new connections are accepted by worker 0, all other
+    # datagrams of the client go to worker 1, which has to forward them (as after the client changed its address)
+    proxy_port, worker_ports = 12364, [12365, 12366]
+    data = os.urandom(2 * 1024 * 1024)
+    Path(server_dir).joinpath("big").write_bytes(data)
+
+    def serve(worker_id: int, socket_pairs: list) -> None:
+        os.chdir(server_dir)
+        run_worker(worker_id, socket_pairs, worker_ports[worker_id], 1, 0, False, "cubic", True)
+
+    socket_pairs = [socket.socketpair(socket.AF_UNIX, socket.SOCK_DGRAM) for _ in worker_ports]
+    context = multiprocessing.get_context("fork")
+    workers = [context.Process(target=serve, args=(worker_id, socket_pairs), daemon=True) for worker_id in range(len(worker_ports))]
+    for worker in workers:
+        worker.start()
+
+    proxy = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    proxy.bind(("127.0.0.1", proxy_port))
+    stop = threading.Event()
+    sent_to_workers = [0, 0]
+    connection_id = struct.Struct("<I")
+
+    def relay() -> None:
+        client_address = None
+        while not stop.is_set():
+            if not select.select([proxy], [], [], 0.1)[0]:
+                continue
+            datagram, address = proxy.recvfrom(65536)
+            if address[1] in worker_ports:
+                proxy.sendto(datagram, client_address)
+            else:
+                client_address = address
+                worker_id = 0 if connection_id.unpack_from(datagram, 1)[0] == 0 else 1
+                sent_to_workers[worker_id] += 1
+                proxy.sendto(datagram, ("127.0.0.1", worker_ports[worker_id]))
+
+    relay_thread = threading.Thread(target=relay, daemon=True)
+    relay_thread.start()
+    time.sleep(0.5)
+    try:
+        client = subprocess.Popen([executable, "--host", "127.0.0.1", "--port", str(proxy_port), "big"], cwd=client_dir)
+        exitcode = client.wait(timeout=20)
+    finally:
+        stop.set()
+        relay_thread.join()
+        proxy.close()
+        for worker in workers:
+            worker.terminate()
+
+    assert exitcode == 0
+    assert Path(client_dir).joinpath("big").read_bytes() == data
+    assert sent_to_workers[1] > 10
+
+
+def test_delta_transfer(executable, server_dir, client_dir):
+    # the client has an outdated copy, only the differences are fetched
+    input = Path(server_dir).joinpath("LICENSE").read_bytes()
+    Path(client_dir).joinpath("LICENSE").write_bytes(input[:1000] + b"outdated" + input[2000:])
+
+    server = subprocess.Popen([executable, "-s", "--port", "12351", "--verbose"], cwd=server_dir)
+
+    client = subprocess.Popen([executable, "--host", "localhost", "--port", "12351", "LICENSE", "--delta", "--verbose"], cwd=client_dir)
+
+    exitcode = client.wait(timeout=10)
+
+    output = Path(client_dir).joinpath("LICENSE").read_bytes()
+
+    if input != output:
+        pytest.fail("File that Client rebuilt is not equal to original file")
+
+    if Path(client_dir).joinpath("LICENSE.rft-delta").exists():
+        pytest.fail("Client did not remove the rebuilt file")
+
+    if not exitcode == 0:
+        pytest.fail(f"Expected exit code 0 but got exit code {exitcode}")
+
+    server.kill()
+    client.kill()
+
+
+def test_list_directory(executable, server_dir, client_dir):
+    server = subprocess.Popen([executable, "-s", "--port", "12352", "--verbose"], cwd=server_dir)
+
+    client = subprocess.Popen([executable, "--host", "localhost", "--port", "12352", ".", "--list"], cwd=client_dir, stdout=subprocess.PIPE)
+
+    output, _ = client.communicate(timeout=10)
+
+    if b" LICENSE\n" not in output:
+        pytest.fail("Listing of the server directory does not contain LICENSE")
+
+    if not client.returncode == 0:
+        pytest.fail(f"Expected exit code 0 but got exit code {client.returncode}")
+
+    server.kill()
+    client.kill()
+
+
+
+def test_listing_only_stats_files(server_dir):
+    import stat
+    from common import MetadataCache
+
+    os.mkdir(Path(server_dir).joinpath("subdir"))
+    cache = MetadataCache()
+    entries = {entry.name: entry for entry in cache.list(server_dir)}
+
+    assert stat.S_ISDIR(entries["subdir"].mode) and entries["subdir"].size == 0
+    license = os.stat(Path(server_dir).joinpath("LICENSE"))
+    assert stat.S_ISREG(entries["LICENSE"].mode)
+    assert (entries["LICENSE"].size, entries["LICENSE"].mtime_ns) == (license.st_size, license.st_mtime_ns)
+    # the stat result of the file is cached for the reads that follow, the directory was not stated
+    assert cache.stats[os.path.join(server_dir, "LICENSE")][1] is not None
+    assert os.path.join(server_dir, "subdir") not in cache.stats
+
+
+@pytest.mark.parametrize("option, port", [("--segments", "12354"), ("--parallel", "12355")])
+def test_transfer_in_ranges(executable, server_dir, client_dir, option, port):
+    # 5 MiB are split into 4 ranges of at least 1 MiB (see util.split_ranges()), so every range but the first
+    # one is requested at an offset
+    input = os.urandom(5 * 1024 * 1024 + 123)
+    Path(server_dir).joinpath("random").write_bytes(input)
+
+    server = subprocess.Popen([executable, "-s", "--port", port], cwd=server_dir)
+
+    client = subprocess.Popen([executable, "--host", "localhost", "--port", port, "random", option, "4"], cwd=client_dir)
+
+    exitcode = client.wait(timeout=30)
+
+    if not Path(client_dir).joinpath("random").exists():
+        pytest.fail("Client did not receive random file")
+
+    if Path(client_dir).joinpath("random").read_bytes() != input:
+        pytest.fail("File that Client received is not equal to original file")
+
+    if not exitcode == 0:
+        pytest.fail(f"Expected exit code 0 but got exit code {exitcode}")
+
+    server.kill()
+    client.kill()
+
+
+@pytest.mark.parametrize("option, port", [("--segments", "12356"), ("--parallel", "12357")])
+def test_transfer_empty_file_in_ranges(executable, server_dir, client_dir, option, port):
+    # an empty file has no ranges, both options fall back to a single read of the whole file (whose checksum is compared)
+    Path(server_dir).joinpath("empty").write_bytes(b"")
+
+    server = subprocess.Popen([executable, "-s", "--port", port], cwd=server_dir)
+
+    client = subprocess.Popen([executable, "--host", "localhost", "--port", port, "empty", option, "4", "--verbose"], cwd=client_dir, stderr=subprocess.PIPE)
+
+    _, log = client.communicate(timeout=10)
+
+    if b"Transfer of empty completed" not in log or b"has been checksummed" not in log:
+        pytest.fail("Client did not read the empty file")
+
+    if not client.returncode == 0:
+        pytest.fail(f"Expected exit code 0 but got exit code {client.returncode}")
+
+    server.kill()
+    client.kill()
+
+
+def test_path_checksum_is_cached(server_dir, monkeypatch):
+    import select
+    import app.server
+    from common import ConnectionManager, MetadataCache
+    from app.server import ServerConnection
+    from frame import AnswerFrame
+
+    class FakeServerConnection(ServerConnection):
+        # only the parts of ServerConnection that answer a ChecksumFrame without a stream
+        def __init__(self) -> None:
+            self.connection_manager = ConnectionManager(0)
+            self.pending_checksums = {}
+            self.answers = []
+
+        def queue_frame(self, frame) -> None:
+            self.answers.append(frame)
+
+    monkeypatch.setattr(ServerConnection, "metadata_cache", MetadataCache())
+    hashed = []
+    original_hash_file = app.server.hash_file
+    monkeypatch.setattr(app.server, "hash_file", lambda path, result: hashed.append(path) or original_hash_file(path, result))
+
+    path = str(Path(server_dir).joinpath("LICENSE"))
+    connection = FakeServerConnection()
+    for stream_id in (1, 2):
+        connection.request_path_checksum(stream_id, path, os.stat(path))
+        while connection.pending_checksums:
+            connection.pending_checksums[stream_id][2].result(timeout=10)
+            # the finished digest wakes up the loop of the connection manager
+            assert select.select([connection.connection_manager.wakeup_receiver], [], [], 10)[0]
+            connection.connection_manager.receive_wakeups()
+            assert connection in connection.connection_manager.to_be_flushed
+            connection.answer_path_checksums()
+
+    expected = hashlib.sha256(Path(path).read_bytes()).digest()
+    assert [(frame.header.stream_id, frame.payload.data) for frame in connection.answers] == [(1, expected), (2, expected)]
+    assert isinstance(connection.answers[0], AnswerFrame)
+    # the second request is answered from the cache, without reading the file again
+    assert hashed == [path]
+
+    # a changed file is hashed again
+    Path(path).write_bytes(b"changed")
+    connection.request_path_checksum(3, path, os.stat(path))
+    assert connection.pending_checksums[3][2].result(timeout=10)[0] == hashlib.sha256(b"changed").digest()
+    assert hashed == [path, path]
+
+
+
+def test_read_of_deleted_file_is_answered_with_error(server_dir, monkeypatch):
+    from common import ConnectionManager, MetadataCache
+    from app.server import ServerConnection
+    from frame import ReadFrame
+
+    class FakeServerConnection(ServerConnection):
+        # only the parts of ServerConnection that answer a ReadFrame
+        def __init__(self) -> None:
+            self.connection_manager = ConnectionManager(0)
+            self.streams = {}
+            self.pending_resumes = {}
+            self.frame_queue = []
+            self.answers = []
+
+        def queue_frame(self, frame) -> None:
+            self.answers.append(frame)
+
+        def flush(self) -> None:
+            pass
+
+    monkeypatch.setattr(ServerConnection, "metadata_cache", MetadataCache())
+    path = str(Path(server_dir).joinpath("LICENSE"))
+    connection = FakeServerConnection()
+    # the file is still in the metadata cache when it is deleted
+    assert connection.metadata_cache.stat(path) is not None
+    os.unlink(path)
+    connection.handle_frame(ReadFrame(1, ReadFrame.encode_flags(check_checksum=True), 10, 0, 0, path))
+    connection.handle_frame(ReadFrame(2, ReadFrame.encode_flags(), 0, 0, 0, path))
+    # the resume checksum is calculated on the checksum pool
+    connection.pending_resumes[1][2].exception(timeout=10)
+    connection.start_resumed_streams()
+
+    assert sorted((type(frame).__name__, frame.header.stream_id) for frame in connection.answers) == [("ErrorFrame", 1), ("ErrorFrame", 2)]
+    assert connection.streams == {}
+
+
+def test_resume_prefix_continues_at_checkpoint(client_dir, monkeypatch):
+    import builtins
+    import zlib
+    import common.checksum_index
+    from common import ChecksumIndex
+
+    read_bytes = []
+
+    class CountingFile:
+        # counts the bytes that the index reads from the file
+        def __init__(self, file) -> None:
+            self.file = file
+
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *exc_info) -> None:
+            self.file.close()
+
+        def seek(self, offset: int) -> None:
+            self.file.seek(offset)
+
+        def readinto(self, buffer) -> int:
+            count = self.file.readinto(buffer)
+            read_bytes.append(count)
+            return count
+
+    monkeypatch.setattr(common.checksum_index, "open", lambda path, mode: CountingFile(builtins.open(path, mode)), raising=False)
+    interval = 64 * 1024
+    monkeypatch.setattr(ChecksumIndex, "checkpoint_interval", interval)
+    monkeypatch.setattr(ChecksumIndex, "read_size", 16 * 1024)
+
+    path = str(Path(client_dir).joinpath("prefix"))
+    data = os.urandom(3 * interval + 1000)
+    Path(path).write_bytes(data)
+    index = ChecksumIndex()
+
+    length = 2 * interval + 500
+    crc, sha256_hash = index.prefix(path, length)
+    assert crc == zlib.crc32(data[:length])
+    assert sha256_hash.digest() == hashlib.sha256(data[:length]).digest()
+    assert len(index.checkpoints(path)) == 3
+    assert sum(read_bytes) == length
+
+    # a longer prefix is only read from the last checkpoint on, for both checksums
+    read_bytes.clear()
+    crc, sha256_hash = index.prefix(path, len(data))
+    assert crc == zlib.crc32(data)
+    assert sha256_hash.digest() == hashlib.sha256(data).digest()
+    assert sum(read_bytes) == len(data) - 2 * interval
+    assert len(index.checkpoints(path)) == 4
+
+    # a shorter one as well
+    read_bytes.clear()
+    assert index.crc32(path, interval + 10) == zlib.crc32(data[:interval + 10])
+    assert sum(read_bytes) == 10
+
+
+def test_only_requested_connections_are_flushed():
+    from common import ConnectionManager
+
+    class FakeConnection:
+        def __init__(self, connection_id: int) -> None:
+            self.connection_id = connection_id
+            self.flushes = 0
+
+        def flush(self) -> None:
+            self.flushes += 1
+
+        def is_closed(self) -> bool:
+            return False
+
+        def next_deadline(self, current_time: float) -> float:
+            return current_time + 60
+
+    connection_manager = ConnectionManager(0)
+    connections = [FakeConnection(connection_id) for connection_id in (1, 2, 3)]
+    for connection in connections:
+        connection_manager.add_connection(connection)
+    list(connection_manager.flush_connections())
+    assert [connection.flushes for connection in connections] == [1, 1, 1]
+
+    # an idle wakeup flushes nothing, a connection that queued frames is flushed once
+    list(connection_manager.flush_connections())
+    connection_manager.request_flush(connections[1])
+    list(connection_manager.flush_connections())
+    assert [connection.flushes for connection in connections] == [1, 2, 1]
+    assert len(connection_manager.timers) == 3
+
+class FakeStream:
+    # stands in for common.Stream in scheduler tests, every frame sends frame_size bytes
+    def __init__(self, name: str, remaining: int, frame_size: int = 5) -> None:
+        self.name = name
+        self.remaining = remaining
+        self.frame_size = frame_size
+        self.priority = 0
+        self.weight = 1
+
+    def remaining_bytes(self) -> int:
+        return self.remaining
+
+    def get_next_data_frame(self, max_payload_size: int):
+        if self.remaining == 0:
+            return None
+        self.remaining -= min(self.frame_size, self.remaining)
+        return self.name
+
+
+def test_shortest_remaining_first_preemption():
+    from common import ShortestRemainingFirstScheduler
+
+    scheduler = ShortestRemainingFirstScheduler()
+    a = FakeStream("a", 100)
+    scheduler.add(a)
+    while a.remaining > 5:
+        assert scheduler.next_frame(1000) == "a"
+
+    # a has 5 bytes left and must not be preempted by a stream with 50 bytes left
+    scheduler.add(FakeStream("b", 50))
+    assert scheduler.next_frame(1000) == "a"
+    assert scheduler.next_frame(1000) == "b"
+
+    # a shorter stream does preempt b
+    scheduler.add(FakeStream("c", 10))
+    assert [scheduler.next_frame(1000) for _ in range(3)] == ["c", "c", "b"]
+
+
+def test_slowstart_exits_at_threshold():
+    from common import NewReno
+
+    # 1000 byte datagrams, initial window of 10 datagrams
+    congestion_control = NewReno(1000, 20000)
+    assert congestion_control.cwnd == 10000 and congestion_control.is_slowstart
+    congestion_control.on_ack(10000, 1.0, 1.1)
+    assert congestion_control.cwnd == 20000
+    assert not congestion_control.is_slowstart
+    # congestion avoidance: one datagram per acknowledged window
+    congestion_control.on_ack(10000, 1.2, 1.3)
+    assert congestion_control.cwnd == 20000
+    congestion_control.on_ack(10000, 1.2, 1.3)
+    assert congestion_control.cwnd == 21000
+
+
+def test_lost_mtu_probe_keeps_congestion_window():
+    from common import ConnectionManager
+    from app.client import ClientConnection
+    from packet import Packet
+    from frame import DataFrame, PaddingFrame
+
+    connection = ClientConnection(ConnectionManager(0), "127.0.0.1", 12358, [])
+    connection.connection_id = 1
+    cwnd = connection.congestion_control.cwnd
+    probe = Packet(1, 1, 1, [PaddingFrame(1200)])
+    connection.inflight_packets.add(probe, probe.pack(), 1.0)
+    connection.timed_out(1.0 + connection.retransmit_timeout + 0.1)
+    # the probe is retransmitted (shrunk), but the window is not collapsed
+    assert connection.retransmit_timeout_triggered
+    assert connection.congestion_control.cwnd == cwnd
+
+    packet = Packet(1, 1, 2, [DataFrame(1, 0, b"x" * 100)])
+    connection.inflight_packets.add(packet, packet.pack(), 1.0)
+    connection.timed_out(1.0 + connection.retransmit_timeout + 0.1)
+    assert connection.congestion_control.cwnd < cwnd
+
+
+def test_padding_frame_keeps_only_its_length():
+    from frame import PaddingFrame
+    from packet import Packet
+
+    frame, end = PaddingFrame.unpack_from(memoryview(PaddingFrame(1200).pack()), 0)
+    assert end == PaddingFrame.Header.size + 1200
+    assert frame.payload.length == 1200 and not hasattr(frame.payload, "data")
+
+    # the padding is written as zeros, also into a buffer that is not zero initialized
+    buffer = bytearray(b"\xff" * 1300)
+    assert frame.pack_into(buffer, 10) == 10 + len(frame)
+    assert buffer[10:10 + len(frame)] == frame.pack()
+    assert buffer[10 + PaddingFrame.Header.size:10 + len(frame)] == bytes(1200)
+    assert buffer[10 + len(frame):] == b"\xff" * (1300 - 10 - len(frame))
+
+    packet = Packet.unpack(Packet(1, 1, 1, [PaddingFrame(500)]).pack())
+    assert packet.is_mtu_probe() and len(packet.frames[0]) == PaddingFrame.Header.size + 500
+
+
+def test_address_caches_are_bounded():
+    import socket
+    import struct
+    from common import create_datagram_io
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    io = create_datagram_io(sock)
+    for port in range(1, 3000):
+        io.resolve(("127.0.0.1", port))
+        if hasattr(io, "decode_sockaddr"):
+            io.encode_sockaddr(("127.0.0.1", port))
+            sockaddr = struct.pack("=H", socket.AF_INET) + struct.pack("!H", port) + socket.inet_aton("10.0.0.1") + bytes(8)
+            assert io.decode_sockaddr(sockaddr) == ("10.0.0.1", port)
+    sock.close()
+    assert len(io.resolved_addresses) == io.resolved_addresses.max_entries
+    if hasattr(io, "decode_sockaddr"):
+        assert len(io.sockaddrs) == io.sockaddrs.max_entries
+        assert len(io.addresses) == io.addresses.max_entries
+
+
+def test_connection_reports_current_slowstart_threshold():
+    from common import Connection, ConnectionManager
+    from app.client import ClientConnection
+
+    connection = ClientConnection(ConnectionManager(0), "127.0.0.1", 12359, [])
+    assert connection.slowstart_threshold == Connection.initial_slowstart_threshold
+    connection.congestion_control.on_loss(1.0, 2.0)
+    assert connection.slowstart_threshold == connection.congestion_control.cwnd < Connection.initial_slowstart_threshold
+
+
+def test_receive_window_autotuning():
+    from common import ReceiveWindow
+
+    mib = 1024 * 1024
+    flow_control = ReceiveWindow()
+    # nothing is measured without a round trip time, the first measurement only starts the interval
+    flow_control.update(1.0, 0, None)
+    assert flow_control.interval_start is None
+    flow_control.update(1.0, 0, 0.5)
+    assert flow_control.interval_start == 1.0
+
+    # an interval lasts at least one round trip
+    flow_control.update(1.25, 10 * mib, 0.5)
+    assert flow_control.window == ReceiveWindow.initial_window
+    # 10 MiB were written in one round trip, the window grows to twice that
+    flow_control.update(1.5, 10 * mib, 0.5)
+    assert flow_control.window == 20 * mib
+    # a slower disk does not shrink the window
+    flow_control.update(2.0, 11 * mib, 0.5)
+    assert flow_control.window == 20 * mib
+    flow_control.update(2.5, 1000 * mib, 0.5)
+    assert flow_control.window == ReceiveWindow.max_window
+
+    # the bytes that wait for the disk are not advertised, but the window never closes completely
+    assert flow_control.available(10 * mib) == ReceiveWindow.max_window - 10 * mib
+    assert flow_control.available(2 * ReceiveWindow.max_window) == ReceiveWindow.min_window
+
+
+def test_receive_window_advertise_hysteresis():
+    from common import ReceiveWindow
+
+    mib = 1024 * 1024
+    flow_control = ReceiveWindow()
+    assert flow_control.advertised == 4 * mib
+    # only a change of at least a quarter of the advertised window is advertised
+    assert not flow_control.should_advertise(4 * mib)
+    assert not flow_control.should_advertise(5 * mib - 1)
+    assert flow_control.should_advertise(5 * mib)
+    assert not flow_control.should_advertise(3 * mib + 1)
+    assert flow_control.should_advertise(3 * mib)
+
+
+def test_receive_window_only_measures_receiving_streams():
+    from common import ConnectionManager
+    from frame import FlowControlFrame
+    from app.client import ClientConnection
+
+    class FakeStream:
+        def __init__(self, stream_id: int, direction: str) -> None:
+            self.stream_id = stream_id
+            self.direction = direction
+            self.is_closed = False
+            self.priority = 0
+            self.weight = 1
+            self.written = 0
+
+        def remaining_bytes(self) -> int:
+            return 0
+
+        def written_bytes(self) -> int:
+            assert self.direction == "r", "the bytes of a sending stream were measured"
+            return self.written
+
+        def write_backlog(self) -> int:
+            assert self.direction == "r", "the backlog of a sending stream was measured"
+            return 0
+
+    connection = ClientConnection(ConnectionManager(0), "127.0.0.1", 12360, [])
+    connection.connection_id = 1
+    connection.rtt.on_sample(0.5)
+    for stream_id in range(1, 100):
+        connection.add_stream(FakeStream(stream_id, "w"))
+    # a connection that only sends skips the update
+    connection.update_receive_window(1.0)
+    assert connection.flow_control.interval_start is None
+
+    receiving = FakeStream(100, "r")
+    connection.add_stream(receiving)
+    assert list(connection.receive_streams) == [100]
+    connection.update_receive_window(1.0)
+    receiving.written = 10 * 1024 * 1024
+    connection.update_receive_window(1.5)
+    assert connection.flow_control.window == 20 * 1024 * 1024
+    assert any(isinstance(frame, FlowControlFrame) for frame in connection.frame_queue)
+
+    # closed streams are no longer measured
+    receiving.is_closed = True
+    connection.update_receive_window(2.0)
+    assert connection.receive_streams == {}
+
+
+def test_ack_policy_every_n_and_delay():
+    from common import AckPolicy
+
+    ack_policy = AckPolicy(ack_every=3, max_ack_delay=0.025)
+    ack_policy.quick_acks = 0
+    assert not ack_policy.pending
+    # the first packet starts the delayed ack timer, it is not acknowledged on its own
+    ack_policy.on_packet_received(1.0)
+    assert ack_policy.pending and ack_policy.deadline == 1.025
+    assert not ack_policy.due(1.0)
+    assert ack_policy.due(1.025)
+    ack_policy.on_packet_received(1.01)
+    assert ack_policy.deadline == 1.025 and not ack_policy.due(1.01)
+    # the ack_every-th packet is acknowledged right away
+    ack_policy.on_packet_received(1.02)
+    assert ack_policy.due(1.02)
+    ack_policy.on_ack_sent()
+    assert not ack_policy.pending and ack_policy.deadline is None and not ack_policy.due(2.0)
+    assert (ack_policy.acks_sent, ack_policy.packets_acked) == (1, 3)
+
+    # the delay is at most a quarter of the round trip time
+    ack_policy.on_packet_received(2.0, smoothed_rtt=0.04)
+    assert ack_policy.deadline == pytest.approx(2.01)
+    # a packet that arrived out of order is acknowledged right away
+    ack_policy.on_packet_received(2.001, in_order=False)
+    assert ack_policy.due(2.001)
+
+    # the first packets of a connection are acknowledged right away
+    ack_policy = AckPolicy(ack_every=3)
+    for _ in range(AckPolicy.quick_acks):
+        ack_policy.on_packet_received(1.0)
+        assert ack_policy.due(1.0)
+        ack_policy.on_ack_sent()
+    ack_policy.on_packet_received(1.0)
+    assert not ack_policy.due(1.0)
+
+
+def test_gaps_are_acknowledged_right_away():
+    from common import ConnectionManager
+    from app.client import ClientConnection
+    from frame import PaddingFrame, SackFrame
+    from packet import Packet
+
+    connection = ClientConnection(ConnectionManager(0), "127.0.0.1", 12361, [])
+    connection.connection_id = 1
+    connection.ack_policy.quick_acks = 0
+
+    def receive(packet_id: int) -> None:
+        packet = Packet.unpack(Packet(1, 1, packet_id, [PaddingFrame(10)]).pack())
+        connection.update(packet, ("127.0.0.1", 12361))
+
+    receive(1)
+    assert connection.ack_policy.pending and not connection.ack_policy.due(time.time())
+    # packet 2 is missing, the peer needs the selective ack to detect the loss
+    receive(3)
+    assert connection.ack_policy.due(time.time())
+    ack = connection.build_ack()
+    assert isinstance(ack, SackFrame)
+    connection.ack_policy.on_ack_sent()
+    # the packet that fills the gap is acknowledged right away as well
+    receive(2)
+    assert connection.ack_policy.due(time.time())
+    assert connection.next_recv_packet_id == 4
+
+
+def test_ack_is_piggybacked_on_data():
+    from common import ConnectionManager
+    from app.client import ClientConnection
+    from frame import DataFrame, PaddingFrame
+    from packet import Packet
+
+    class FakeStream:
+        # sends a single data frame
+        stream_id = 1
+        direction = "w"
+        priority = 0
+        weight = 1
+
+        def __init__(self) -> None:
+            self.remaining = 100
+
+        def remaining_bytes(self) -> int:
+            return self.remaining
+
+        def get_next_data_frame(self, max_payload_size: int):
+            if self.remaining == 0:
+                return None
+            self.remaining = 0
+            return DataFrame.create(self.stream_id, 0, b"x" * 100)
+
+    sent = []
+    connection = ClientConnection(ConnectionManager(0), "127.0.0.1", 12362, [])
+    connection.connection_manager.sendmany = lambda datagrams, address: sent.extend(datagrams)
+    connection.connection_id = 1
+    connection.ack_policy.quick_acks = 0
+    connection.update(Packet.unpack(Packet(1, 1, 1, [PaddingFrame(10)]).pack()), ("127.0.0.1", 12362))
+    assert connection.ack_policy.pending and not connection.ack_policy.due(time.time())
+
+    # one data frame is sent, the pending ack rides along instead of getting its own packet
+    connection.add_stream(FakeStream())
+    connection.flush()
+    packets = [Packet.unpack(data) for data in sent]
+    assert len(packets) == 1
+    assert sorted(type(frame).__name__ for frame in packets[0].frames) == ["AckFrame", "DataFrame"]
+    assert not connection.ack_policy.pending
+    assert connection.ack_policy.acks_sent == 1
+
+
+def test_sack_marks_only_reordered_packets_lost():
+    from common import ConnectionManager
+    from app.client import ClientConnection
+    from frame import DataFrame, SackFrame
+    from packet import Packet
+
+    retransmitted = []
+    connection = ClientConnection(ConnectionManager(0), "127.0.0.1", 12363, [])
+    connection.connection_manager.sendto = lambda data, address: retransmitted.append(Packet.unpack(data).header.packet_id)
+    connection.connection_id = 1
+    sent_time = time.time() - 1
+    for packet_id in range(1, 9):
+        packet = Packet(1, 1, packet_id, [DataFrame.create(1, packet_id * 100, b"x" * 100)])
+        connection.inflight_packets.add(packet, packet.pack(), sent_time + packet_id * 0.01)
+
+    # 2 and 4 are missing. only 2 is packet_reordering_threshold packets below the largest acked packet
+    connection.handle_ack(SackFrame(1, [(3, 3), (5, 5)]))
+    assert retransmitted == [2]
+    assert [entry.packet_id for entry in connection.inflight_packets] == [2, 4, 6, 7, 8]
+    assert connection.largest_acked_packet_id == 5
+
+    # now 4 is lost as well. 2 was retransmitted after the acked packets were sent, it is not lost again
+    connection.handle_ack(SackFrame(1, [(3, 3), (5, 8)]))
+    assert retransmitted == [2, 4]
+    assert [entry.packet_id for entry in connection.inflight_packets] == [2, 4]
+    assert connection.inflight_bytes == sum(entry.size for entry in connection.inflight_packets)
+
+
+def test_rtt_estimator_samples_and_backoff():
+    from common import RTTEstimator
+
+    rtt = RTTEstimator()
+    assert rtt.rto == RTTEstimator.initial_rto
+    # the first sample initialises the smoothed rtt and the variance (RFC 6298 2.2)
+    rtt.on_sample(0.2)
+    assert rtt.smoothed_rtt == pytest.approx(0.2)
+    assert rtt.rtt_variance == pytest.approx(0.1)
+    assert rtt.rto == pytest.approx(0.6)
+    rtt.on_sample(0.4)
+    assert rtt.rtt_variance == pytest.approx(0.75 * 0.1 + 0.25 * 0.2)
+    assert rtt.smoothed_rtt == pytest.approx(0.875 * 0.2 + 0.125 * 0.4)
+    assert rtt.min_rtt == pytest.approx(0.2)
+
+    # every timeout doubles the rto up to max_rto, an ack of new packets resets it
+    rto = rtt.rto
+    rtt.on_timeout()
+    assert rtt.rto == pytest.approx(2 * rto)
+    for _ in range(20):
+        rtt.on_timeout()
+    assert rtt.rto == RTTEstimator.max_rto
+    rtt.on_ack()
+    assert rtt.rto == pytest.approx(rto)
+
+    # a very short round trip does not go below min_rto
+    rtt = RTTEstimator()
+    rtt.on_sample(0.001)
+    assert rtt.rto == RTTEstimator.min_rto
+
+
+def test_retransmitted_packets_give_no_rtt_sample():
+    from common import ConnectionManager
+    from app.client import ClientConnection
+    from frame import AckFrame, DataFrame
+    from packet import Packet
+
+    connection = ClientConnection(ConnectionManager(0), "127.0.0.1", 12367, [])
+    connection.connection_id = 1
+    sent_time = time.time() - 0.5
+    for packet_id in (1, 2):
+        packet = Packet(1, 1, packet_id, [DataFrame.create(1, packet_id * 100, b"x" * 100)])
+        connection.inflight_packets.add(packet, packet.pack(), sent_time)
+    connection.rtt.on_timeout()
+    # Karn's algorithm: the ack cannot be matched with one of the transmissions of packet 1
+    connection.inflight_packets.retransmitted(connection.inflight_packets.packets[1], sent_time + 0.1)
+    connection.handle_ack(AckFrame.create(1))
+    assert connection.rtt.smoothed_rtt is None
+    # the ack still ends the backoff
+    assert connection.rtt.backoff == 1
+
+    connection.handle_ack(AckFrame.create(2))
+    assert connection.rtt.smoothed_rtt == pytest.approx(0.5, abs=0.1)
+
+
+def test_pacer_refill_and_burst_limit():
+    from common import Pacer
+
+    pacer = Pacer()
+    # nothing is paced before the first rtt sample
+    pacer.update(100000, None, False, 1000, 1.0)
+    assert pacer.budget() == float("inf") and pacer.delay(1000) == 0
+
+    # a full burst may be sent right away, then the bucket refills with gain * cwnd / smoothed_rtt
+    pacer.update(100000, 0.1, False, 1000, 1.0)
+    assert pacer.rate == pytest.approx(1.25 * 100000 / 0.1)
+    assert pacer.budget() == Pacer.burst_packets * 1000
+    pacer.on_sent(Pacer.burst_packets * 1000)
+    assert pacer.budget() == 0
+    assert pacer.delay(1000) == pytest.approx(1000 / pacer.rate)
+    pacer.update(100000, 0.1, False, 1000, 1.004)
+    assert pacer.budget() == pytest.approx(0.004 * pacer.rate)
+
+    # the bucket never holds more than one burst, however long the connection was idle
+    pacer.update(100000, 0.1, False, 1000, 5.0)
+    assert pacer.budget() == Pacer.burst_packets * 1000
+
+    # retransmissions may overdraw the bucket, the budget stays at 0 until it is refilled
+    pacer.on_sent(Pacer.burst_packets * 1000 + 5000)
+    assert pacer.budget() == 0
+    assert pacer.delay(1000) == pytest.approx(6000 / pacer.rate)
+
+    # slow start uses the higher gain
+    pacer.update(100000, 0.1, True, 1000, 5.0)
+    assert pacer.rate == pytest.approx(2 * 100000 / 0.1)
+
+
+def test_newreno_halves_on_loss():
+    from common import NewReno
+
+    congestion_control = NewReno(1000, 2**32 - 1)
+    congestion_control.on_ack(30000, 1.0, 1.1)
+    assert congestion_control.cwnd == 40000
+    congestion_control.on_loss(1.0, 2.0)
+    assert congestion_control.cwnd == 20000
+    assert congestion_control.slowstart_threshold == 20000
+    # packets sent before the reduction do not reduce the window again
+    congestion_control.on_loss(1.5, 2.1)
+    assert congestion_control.cwnd == 20000
+    congestion_control.on_loss(2.5, 3.0)
+    assert congestion_control.cwnd == 10000
+    # the window never drops below two datagrams
+    for time in range(4, 10):
+        congestion_control.on_loss(time, time + 0.5)
+    assert congestion_control.cwnd == 2000
+
+
+def test_cubic_k_and_w_max():
+    import math
+    from common import Cubic
+
+    congestion_control = Cubic(1000, 2**32 - 1)
+    congestion_control.on_ack(90000, 1.0, 1.1)
+    assert congestion_control.cwnd == 100000
+    congestion_control.on_loss(1.0, 2.0)
+    assert congestion_control.w_max == 100000
+    assert congestion_control.cwnd == 70000
+
+    # K is the time it takes to grow back to w_max: cbrt(w_max * (1 - beta) / C) in datagrams
+    congestion_control.on_ack(1000, 2.5, 3.0)
+    assert congestion_control.k == pytest.approx(math.cbrt(30 / 0.4))
+    assert congestion_control.w_cubic(congestion_control.k) == pytest.approx(100000)
+
+    # fast convergence: a loss before the window grew back to the last maximum lowers w_max further
+    cwnd = congestion_control.cwnd
+    congestion_control.on_loss(3.0, 4.0)
+    assert congestion_control.w_max == pytest.approx(cwnd * (1 + 0.7) / 2)
+
+
+def test_range_stream_preallocates_file(client_dir):
+    from common import ConnectionManager, FileWriter
+    from app.client import ClientConnection
+
+    if FileWriter.fallocate is None:
+        pytest.skip("fallocate is not available")
+    size = 8 * 1024 * 1024
+    path = str(Path(client_dir).joinpath("range"))
+    # as ClientConnection.request_segmented(): the file has its final size, but is not allocated
+    with open(path, "wb") as file:
+        file.truncate(size)
+    assert os.stat(path).st_blocks * 512 < size
+
+    connection = ClientConnection(ConnectionManager(0), "127.0.0.1", 12353, [])
+    stream_id = connection.request_range("range", 4 * 1024 * 1024, 1024, path, size)
+    stream = connection.streams[stream_id]
+    assert stream.expected_size == size
+    stream.write_data(4 * 1024 * 1024, b"x" * 1024)
+    stream.close()
+
+    assert os.stat(path).st_size == size
+    assert os.stat(path).st_blocks * 512 >= size
+
+
+def test_writer_releases_preallocation(client_dir):
+    from common import FileWriter
+
+    if FileWriter.fallocate is None:
+        pytest.skip("fallocate is not available")
+    # an interrupted transfer: the size of the file was known, but only a part of it was received
+    path = str(Path(client_dir).joinpath("partial"))
+    writer = FileWriter(path, 8 * 1024 * 1024)
+    writer.write(0, b"x" * 1000)
+    writer.close()
+
+    assert os.stat(path).st_size == 1000
+    assert os.stat(path).st_blocks * 512 < 1024 * 1024
+
+    # without a known size nothing is preallocated
+    path = str(Path(client_dir).joinpath("unknown"))
+    writer = FileWriter(path)
+    writer.write(0, b"x" * 1000)
+    assert os.stat(path).st_blocks * 512 < 1024 * 1024
+    writer.close()
+
+
+def test_reader_survives_truncated_file(client_dir):
+    from common.reader import ReadAheadReader
+
+    path = str(Path(client_dir).joinpath("truncated"))
+    data = os.urandom(3 * ReadAheadReader.block_size)
+    Path(path).write_bytes(data)
+    reader = ReadAheadReader(path)
+    assert bytes(reader.read(0, 1000)) == data[:1000]
+    # the file is truncated while it is served, the stream ends early instead of crashing the server
+    os.truncate(path, ReadAheadReader.block_size + 100)
+    assert bytes(reader.read(ReadAheadReader.block_size, 1000)) == data[ReadAheadReader.block_size:ReadAheadReader.block_size + 100]
+    assert len(reader.read(2 * ReadAheadReader.block_size, 1000)) == 0
+    reader.close()
+
+
+def test_delta_reader_reads_windows(client_dir, monkeypatch):
+    from common.delta import DeltaDecoder, DeltaReader, Signatures, compute_signature
+
+    monkeypatch.setattr(DeltaReader, "input_size", 64 * 1024)
+    block_size = 4096
+    basis_path = str(Path(client_dir).joinpath("basis"))
+    path = str(Path(client_dir).joinpath("changed"))
+    basis = os.urandom(100 * block_size + 123)
+    # changes in the middle (shifting the rest of the file) and at the end
+    data = basis[:30 * block_size] + os.urandom(5000) + basis[31 * block_size:90 * block_size] + os.urandom(20000)
+    Path(basis_path).write_bytes(basis)
+    Path(path).write_bytes(data)
+
+    def delta(truncate: int | None = None) -> tuple[DeltaReader, bytes]:
+        signature = compute_signature(basis_path, block_size)
+        signatures = Signatures(block_size, len(signature))
+        signatures.write(0, signature)
+        reader = DeltaReader(path, signatures)
+        records = bytearray()
+        while piece := reader.read(len(records), 1000):
+            records += piece
+            if truncate is not None:
+                os.truncate(path, truncate)
+        reader.close()
+        return reader, bytes(records)
+
+    def rebuild(records: bytes) -> bytes:
+        decoder = DeltaDecoder(basis_path, block_size)
+        output = bytearray()
+        for offset, piece in decoder.feed(0, records):
+            assert offset == len(output)
+            output += piece
+        decoder.close()
+        return bytes(output)
+
+    reader, records = delta()
+    assert rebuild(records) == data
+    assert reader.copied_bytes >= 80 * block_size
+
+    # the file is truncated during the delta, it ends early instead of crashing the server
+    reader, records = delta(truncate=40 * block_size)
+    # (data of a window that was read before the truncation is still sent)
+    assert 40 * block_size <= reader.size < len(data)
+    assert rebuild(records) == data[:reader.size]
+
+
+def test_compressed_stream_keeps_running_checksum(server_dir, monkeypatch):
+    import common.util as util
+    from common import Stream
+
+    path = str(Path(server_dir).joinpath("LICENSE"))
+    stream = Stream(1, path, "w")
+    stream.compression = "zlib"
+    while stream.get_next_data_frame(1000) is not None and not stream.is_closed:
+        pass
+
+    # the checksum comes from the uncompressed data that was read, the file is not read again
+    monkeypatch.setattr(util, "sha256_file_checksum", lambda path: pytest.fail("file was hashed again"))
+    assert stream.get_file_checksum() == hashlib.sha256(Path(path).read_bytes()).digest()
+
+
+@pytest.mark.parametrize("codec", ["zlib", "lzma", "bz2"])
+def test_decompressor_bounds_output(codec):
+    from common import Decompressor, compression_codecs
+    from common.compression import codec_ids, create_compressor
+
+    if codec not in compression_codecs:
+        pytest.skip(f"{codec} is not available")
+    size = 20 * 1024 * 1024
+    compressor = create_compressor(codec)
+    data = bytes([codec_ids[codec]]) + compressor.compress(bytes(size)) + compressor.flush()
+    assert len(data) < size // 100
+
+    decompressor = Decompressor(0)
+    offset = 0
+    for piece_offset, piece in decompressor.feed(0, data):
+        assert piece_offset == offset
+        assert len(piece) <= Decompressor.max_output
+        offset += len(piece)
+    assert offset == size